@@ -0,0 +1,156 @@
+"""
+Process-wide cache of the availability and version of external programs.
+
+A program is resolved by shutil.which() and '<cmd> --version' is executed once per resolved path and process.
+Missing programs are detected without starting a process.
+Optionally the results are persisted to a file and reused within a TTL, as long as the binary is unchanged.
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+__author__ = 'Christof Pieloth'
+
+logger = logging.getLogger(__name__)
+
+_VERSION = re.compile(r'(\d+)\.(\d+)(?:\.(\d+))?')
+
+
+class ToolInfo:
+    """Availability and version of a program."""
+
+    def __init__(self, cmd, path=None, available=False, version_text=''):
+        """
+        :param cmd: Name of the program.
+        :param path: Resolved path of the program, None if it was not found.
+        :param available: True if the version check succeeded.
+        :param version_text: Output of the version check.
+        """
+        self.cmd = cmd
+        self.path = path
+        self.available = available
+        self.version_text = version_text
+
+    @property
+    def version(self):
+        """First version number of the version output, e.g. (3, 1, 2) or None."""
+        match = _VERSION.search(self.version_text)
+        if not match:
+            return None
+        return tuple(int(part) for part in match.groups() if part is not None)
+
+    def at_least(self, *version):
+        """
+        Check the version for feature detection, e.g. at_least(3, 1).
+
+        :return: True if the program is available and its version is equal or greater.
+        """
+        return self.available and self.version is not None and self.version >= tuple(version)
+
+
+class AvailabilityCache:
+    """Thread-safe cache of ToolInfo."""
+
+    def __init__(self, cache_file=None, ttl=24 * 3600):
+        """
+        :param cache_file: JSON file to persist the results, None to cache in memory only.
+        :param ttl: Seconds, for which a persisted result is valid.
+        """
+        self._lock = threading.Lock()
+        self._tools = dict()
+        self._persisted = dict()
+        self.cache_file = None
+        self.ttl = ttl
+        self.configure(cache_file, ttl)
+
+    def configure(self, cache_file, ttl=24 * 3600):
+        """
+        Set or disable the persisted cache.
+
+        :param cache_file: JSON file to persist the results, None to cache in memory only.
+        :param ttl: Seconds, for which a persisted result is valid.
+        """
+        with self._lock:
+            self.cache_file = os.path.expanduser(cache_file) if cache_file else None
+            self.ttl = ttl
+            self._persisted = self._load()
+
+    def clear(self):
+        """Forget all results of this process, e.g. after installing a program."""
+        with self._lock:
+            self._tools.clear()
+
+    def lookup(self, cmd, version_arg='--version'):
+        """
+        Get the availability and version of a program.
+
+        :param cmd: Name or path of the program.
+        :param version_arg: Argument, which prints the version and exits with 0.
+        :rtype: ToolInfo
+        """
+        # Resolving the path does not start a process, but respects changes of PATH.
+        path = shutil.which(cmd)
+        if path is None:
+            return ToolInfo(cmd)
+
+        key = '{} {}'.format(path, version_arg)
+        with self._lock:
+            if key not in self._tools:
+                self._tools[key] = self._probe(key, cmd, path, version_arg)
+            return self._tools[key]
+
+    def _probe(self, key, cmd, path, version_arg):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        entry = self._persisted.get(key)
+        if entry and entry['path'] == path and entry['mtime'] == mtime and time.time() - entry['checked'] < self.ttl:
+            return ToolInfo(cmd, path, entry['available'], entry['version_text'])
+
+        try:
+            process = subprocess.run([path, version_arg], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     stdin=subprocess.DEVNULL, universal_newlines=True, errors='replace')
+            info = ToolInfo(cmd, path, process.returncode == 0, process.stdout.strip())
+        except OSError:
+            info = ToolInfo(cmd, path)
+        logger.debug('Checked %s: available=%s, version=%s', path, info.available, info.version)
+
+        if self.cache_file:
+            self._persisted[key] = {'path': path, 'mtime': mtime, 'checked': time.time(),
+                                    'available': info.available, 'version_text': info.version_text}
+            self._save()
+        return info
+
+    def _load(self):
+        if not self.cache_file or not os.path.isfile(self.cache_file):
+            return dict()
+        try:
+            with open(self.cache_file, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError) as ex:
+            logger.warning('Ignoring invalid cache file %s: %s', self.cache_file, ex)
+            return dict()
+
+    def _save(self):
+        tmp_file = '{}.{}.tmp'.format(self.cache_file, os.getpid())
+        try:
+            with open(tmp_file, 'w') as file:
+                json.dump(self._persisted, file, indent=1, sort_keys=True)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as ex:
+            logger.warning('Could not write cache file %s: %s', self.cache_file, ex)
+
+
+cache = AvailabilityCache()
+
+
+def lookup(cmd, version_arg='--version'):
+    """Get the availability and version of a program from the process-wide cache, see AvailabilityCache.lookup."""
+    return cache.lookup(cmd, version_arg)
@@ -4,21 +4,32 @@ import argparse
 import sys
 
 
-def main(argv=None):
+class ParserError(Exception):
+    """Raised instead of exiting, if a parser is created with exit_on_error=False."""
+
+
+class _RaisingArgumentParser(argparse.ArgumentParser):
+
+    def error(self, message):
+        raise ParserError(message)
+
+
+def create_parser(prog, exit_on_error=True):
     """
-    Start the Example tool.
+    Create the argument parser with all sub-commands.
 
-    :return: 0 on success.
+    :param prog: Program name.
+    :param exit_on_error: If False, a ParserError is raised on invalid arguments instead of exiting.
+    :return: The argument parser.
+    :rtype: argparse.ArgumentParser
     """
     import backbacker.sub_commands
     import backbacker.commands
     import backbacker.tasks
 
-    if not argv:
-        argv = sys.argv
-
-    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
-    parser.prog = argv[0]
+    parser_class = argparse.ArgumentParser if exit_on_error else _RaisingArgumentParser
+    parser = parser_class(formatter_class=argparse.RawTextHelpFormatter)
+    parser.prog = prog
     parser.name = 'BackBacker'
     parser.description = 'BackBacker is a light backup tool ' \
         'with a "declarative" job file based on simple commands with arguments.'
@@ -32,7 +43,19 @@ def main(argv=None):
     backbacker.sub_commands.register_sub_commands(subparser)
     backbacker.commands.register_sub_commands(subparser)
     backbacker.tasks.register_sub_commands(subparser)
+    return parser
+
+
+def main(argv=None):
+    """
+    Start the Example tool.
+
+    :return: 0 on success.
+    """
+    if not argv:
+        argv = sys.argv
 
+    parser = create_parser(argv[0])
     args = parser.parse_args(argv[1:])
     try:
         # Check if a sub-command is given, otherwise print help.
@@ -0,0 +1,295 @@
+"""
+Reading and scheduling of batch files.
+
+A batch file contains one command per line. A line can be prefixed with a label and dependencies,
+which are used to run independent commands concurrently::
+
+    @dump_a pgsqldump --dst_dir /tmp --db_name a ...
+    @dump_b pgsqldump --dst_dir /tmp --db_name b ...
+    after:dump_a,dump_b backup_rotation --dir /tmp
+
+A dependency must refer to a label of a previous line.
+"""
+
+import concurrent.futures
+import logging
+
+__author__ = 'Christof Pieloth'
+
+logger = logging.getLogger(__name__)
+
+LABEL_PREFIX = '@'
+AFTER_PREFIX = 'after:'
+
+
+class BatchFileError(ValueError):
+    """Invalid batch file, contains a message for each bad line."""
+
+    def __init__(self, errors):
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+class BatchJob:
+    """A single line of a batch file."""
+
+    def __init__(self, line_no, command, label=None, after=None):
+        self.line_no = line_no
+        self.command = command
+        self.label = label
+        self.after = list(after) if after else list()
+        self._action = None
+
+    def __repr__(self):
+        return '{}(line_no={}, label={}, command={})'.format(
+            type(self).__name__, self.line_no, self.label, self.command)
+
+    @property
+    def argv(self):
+        """Arguments of the command without program name."""
+        return self.command.split(' ')
+
+    @property
+    def compiled(self):
+        return self._action is not None
+
+    def compile(self, parser):
+        """
+        Parse and validate the arguments and create the command instance.
+
+        :param parser: Argument parser with all sub-commands, which raises an exception on error.
+        :raise Exception on invalid arguments
+        """
+        args = parser.parse_args(self.argv)
+        if not hasattr(args, 'prepare'):
+            raise ValueError('Missing sub-command.')
+        self._action = args.prepare(args)
+
+    def execute(self):
+        """
+        Execute the compiled command.
+
+        :return: 0 on success.
+        """
+        if not self.compiled:
+            raise RuntimeError('Batch job is not compiled: {}'.format(self.command))
+        return self._action()
+
+    @classmethod
+    def parse(cls, line_no, line):
+        """
+        Parse a stripped, non-empty line of a batch file.
+
+        :param line_no: Line number, used for error messages.
+        :param line: Line of a batch file.
+        :return: A batch job.
+        :rtype: BatchJob
+        """
+        label = None
+        after = list()
+        tokens = line.split(' ')
+        while tokens:
+            if tokens[0].startswith(LABEL_PREFIX):
+                label = tokens.pop(0)[len(LABEL_PREFIX):]
+                if not label:
+                    raise ValueError('Line {}: empty label.'.format(line_no))
+            elif tokens[0].startswith(AFTER_PREFIX):
+                deps = [dep for dep in tokens.pop(0)[len(AFTER_PREFIX):].split(',') if dep]
+                if not deps:
+                    raise ValueError('Line {}: empty dependency list.'.format(line_no))
+                after.extend(deps)
+            else:
+                break
+
+        if not tokens:
+            raise ValueError('Line {}: missing command.'.format(line_no))
+        return cls(line_no, ' '.join(tokens), label, after)
+
+
+def read_batch_file(fname):
+    """
+    Read a batch file and check the labels and dependencies.
+
+    :param fname: Path to batch file.
+    :return: List of batch jobs in order of the file.
+    :rtype: list
+    :raise BatchFileError on invalid lines
+    """
+    errors = list()
+    jobs = _read_batch_file(fname, errors)
+    if errors:
+        raise BatchFileError([error[1] for error in errors])
+    return jobs
+
+
+def load_batch_file(fname):
+    """
+    Read a batch file and compile all jobs, i.e. parse the arguments and create the command instances.
+    The argument parser is created once for the whole file. Nothing is executed.
+
+    :param fname: Path to batch file.
+    :return: List of compiled batch jobs in order of the file.
+    :rtype: list
+    :raise BatchFileError with an error for each bad line
+    """
+    errors = list()
+    jobs = _read_batch_file(fname, errors)
+    errors.extend(compile_jobs(jobs))
+    if errors:
+        errors.sort(key=lambda error: error[0])
+        raise BatchFileError([error[1] for error in errors])
+    return jobs
+
+
+def compile_jobs(jobs):
+    """
+    Compile batch jobs with a shared argument parser.
+
+    :param jobs: List of batch jobs.
+    :return: List of (line number, message) tuples for jobs, which could not be compiled.
+    :rtype: list
+    """
+    from backbacker.backbacker import create_parser
+
+    parser = create_parser('batch', exit_on_error=False)
+    errors = list()
+    for job in jobs:
+        try:
+            job.compile(parser)
+        except SystemExit as ex:  # e.g. --help or --version
+            errors.append((job.line_no, 'Line {}: exited with {}: {}'.format(job.line_no, ex.code, job.command)))
+        except Exception as ex:  # pylint: disable=broad-except
+            errors.append((job.line_no, 'Line {}: {}: {}'.format(job.line_no, ex, job.command)))
+    return errors
+
+
+def _read_batch_file(fname, errors):
+    jobs = list()
+    labels = set()
+    with open(fname, 'r') as file:
+        for line_no, line in enumerate(file, start=1):
+            stripped = line.strip()
+            if not stripped:  # skip empty lines
+                continue
+            if stripped.startswith('#'):  # skip comments
+                continue
+
+            try:
+                job = BatchJob.parse(line_no, stripped)
+            except ValueError as ex:
+                errors.append((line_no, str(ex)))
+                continue
+
+            for dep in job.after:
+                if dep not in labels:
+                    errors.append((line_no, 'Line {}: unknown dependency "{}", it must be a label of a previous line.'
+                                   .format(line_no, dep)))
+            if job.label is not None:
+                if job.label in labels:
+                    errors.append((line_no, 'Line {}: duplicate label "{}".'.format(line_no, job.label)))
+                labels.add(job.label)
+            jobs.append(job)
+    return jobs
+
+
+def run_jobs(jobs, run, workers=1, ignore_errors=False):
+    """
+    Run batch jobs and respect their dependencies.
+
+    With one worker the jobs are executed in order of the batch file. With more workers, a job is started
+    as soon as all its dependencies have finished successfully.
+    A job whose dependency failed is not executed and counts as an error.
+
+    :param jobs: List of batch jobs, dependencies must refer to previous jobs.
+    :param run: Callable, which executes a job and returns 0 on success, e.g. BatchJob.execute.
+    :param workers: Maximum number of concurrently running jobs.
+    :param ignore_errors: Continue on error.
+    :return: Without ignore_errors the return code of the first failed job, otherwise the number of failed jobs.
+    """
+    if workers <= 0:
+        raise ValueError('Invalid number of workers. Must be greater than 0, but it is: {}'.format(workers))
+
+    if workers == 1:
+        return _run_sequential(jobs, run, ignore_errors)
+    return _run_parallel(jobs, run, workers, ignore_errors)
+
+
+def _run_job(job, run):
+    try:
+        return run(job)
+    except SystemExit as ex:  # e.g. a nested batch command
+        return ex.code if isinstance(ex.code, int) else 1
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Unexpected error executing command: %s', job.command)
+        return 1
+
+
+def _log_error(job, rc):
+    logger.error('Error executing command: %s. Returned with: %d', job.command, rc)
+
+
+def _log_skipped(job):
+    logger.error('Skipping command: %s. A dependency failed.', job.command)
+
+
+def _run_sequential(jobs, run, ignore_errors):
+    failed = set()
+    error_count = 0
+    for job in jobs:
+        if failed.intersection(job.after):
+            _log_skipped(job)
+            failed.add(job.label)
+            error_count += 1
+            continue
+
+        rc = _run_job(job, run)
+        if rc > 0:
+            error_count += 1
+            _log_error(job, rc)
+            if not ignore_errors:
+                return rc
+            failed.add(job.label)
+
+    return error_count
+
+
+def _run_parallel(jobs, run, workers, ignore_errors):
+    waiting = list(jobs)
+    done = set()  # labels of successful jobs
+    failed = set()  # labels of failed or skipped jobs
+    running = dict()
+    error_count = 0
+    first_rc = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while waiting or running:
+            if not first_rc:
+                for job in list(waiting):
+                    if failed.intersection(job.after):
+                        _log_skipped(job)
+                        waiting.remove(job)
+                        failed.add(job.label)
+                        error_count += 1
+                    elif all(dep in done for dep in job.after) and len(running) < workers:
+                        waiting.remove(job)
+                        running[executor.submit(_run_job, job, run)] = job
+            elif not running:
+                break
+
+            if not running:
+                continue
+
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                rc = future.result()
+                if rc > 0:
+                    error_count += 1
+                    failed.add(job.label)
+                    _log_error(job, rc)
+                    if not ignore_errors and not first_rc:
+                        first_rc = rc
+                else:
+                    done.add(job.label)
+
+    return first_rc if first_rc else error_count
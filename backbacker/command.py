@@ -1,12 +1,21 @@
 """
 A command is the core component of BackBacker.
 A concrete command implements the back-up logic.
+
+Commands can also be executed by asyncio, see Command.execute_async() and execute_concurrently().
+A SystemCommand, which runs a single program, starts it with asyncio.create_subprocess_exec(),
+so it can overlap with other commands in one thread and is killed on timeout or cancellation.
 """
 
 import abc
+import asyncio
 import enum
 import logging
+import subprocess
+import time
 
+from backbacker import availability
+from backbacker import instrumentation
 import backbacker.sub_commands
 
 __author__ = 'Christof Pieloth'
@@ -18,8 +27,15 @@ class Command(abc.ABC):  # pylint: disable=too-few-public-methods
     """
     A command is a basic and often an atomic functionality for a backup job, e.g. copying a file.
     Implementations can be used for API access.
+    Each execute() of a subclass is measured, see backbacker.instrumentation.
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        execute = cls.__dict__.get('execute')
+        if execute is not None and not getattr(execute, '__isabstractmethod__', False):
+            cls.execute = instrumentation.instrument(execute)
+
     @abc.abstractmethod
     def execute(self):
         """
@@ -29,15 +45,28 @@ class Command(abc.ABC):  # pylint: disable=too-few-public-methods
         """
         raise NotImplementedError()
 
+    async def execute_async(self):
+        """
+        Execute the command without blocking the event loop.
+        The default runs execute() in a thread of the default executor. Cancelling does not interrupt the thread.
+
+        :raise Exception on error
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.execute)
+
 
 class SystemCommand(Command, metaclass=abc.ABCMeta):
     """
     A system command is a OS-dependent command. It checks the availability before execution.
+
+    A command, which runs a single program, implements _command_line(). Then _execute_command() and
+    execute_async() run the program and stop it after timeout seconds.
     """
 
     def __init__(self, cmd):
         super().__init__()
         self._cmd = cmd
+        self.timeout = None
 
     @property
     def cmd(self):
@@ -47,33 +76,182 @@ class SystemCommand(Command, metaclass=abc.ABCMeta):
         """Checks if this command is available on the system, uses argument --version."""
         return self.check_version(self.cmd)
 
+    @property
+    def tool(self):
+        """
+        Availability and version of the program, e.g. for feature detection.
+
+        :rtype: backbacker.availability.ToolInfo
+        """
+        return availability.lookup(self.cmd)
+
     def execute(self):
         if not self.is_available():
             raise OSError('Command not available: {}'.format(self.cmd))
 
         self._execute_command()
 
-    @abc.abstractmethod
+    async def execute_async(self):
+        """
+        Execute the command without blocking the event loop.
+        The program of _command_line() is started as asyncio subprocess and killed on timeout or cancellation,
+        other commands are executed in a thread.
+
+        :return: ProcessResult or None, if the command has no command line.
+        :raise subprocess.TimeoutExpired: if the program did not finish within timeout seconds.
+        :raise subprocess.CalledProcessError: if the program failed.
+        """
+        if not self.is_available():
+            raise OSError('Command not available: {}'.format(self.cmd))
+
+        cmd = self._command_line()
+        if cmd is None:
+            # execute() and not _execute_command(), so the run is measured
+            await asyncio.get_running_loop().run_in_executor(None, self.execute)
+            return None
+        return await self._run_async(cmd)
+
+    @instrumentation.instrument_async
+    async def _run_async(self, cmd):
+        logger.info('execute: %s', cmd)
+        return await run_process(cmd, timeout=self.timeout)
+
+    def _command_line(self):
+        """
+        Check the preconditions and create the command line of the program, if the command runs a single program.
+
+        :return: List of arguments or None, if _execute_command() is implemented instead.
+        :raise Exception on error
+        """
+        return None
+
     def _execute_command(self):
         """
-        Abstract method, implements the specific functionality.
+        Implements the specific functionality, the default runs the program of _command_line().
 
         :raise Exception on error
         """
-        raise NotImplementedError('This method must be implemented by each SystemCommand.')
+        cmd = self._command_line()
+        if cmd is None:
+            raise NotImplementedError('This method must be implemented by each SystemCommand.')
+        logger.info('execute: %s', cmd)
+        subprocess.check_call(cmd, timeout=self.timeout)
 
     @classmethod
     def check_version(cls, cmd):
         """
         Checks if  'cmd --version' is callable.
+        The result is cached for the whole process, see backbacker.availability.
 
         :return True 'cmd --version' has return code 0.
         """
-        import subprocess
-        try:
-            return subprocess.call([cmd, '--version'], stdout=subprocess.PIPE) == 0
-        except OSError:
-            return False
+        return availability.lookup(cmd).available
+
+
+class ProcessResult:
+    """Result of run_process()."""
+
+    def __init__(self, args, returncode, stdout, stderr, seconds):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.seconds = seconds
+
+
+async def run_process(cmd, timeout=None, cwd=None, env=None, check=True, on_line=None, kill_delay=5.0):
+    """
+    Run a program as asyncio subprocess and capture its output.
+
+    stdout and stderr are read concurrently while the program runs. Each line is logged on debug level and
+    passed to on_line. On timeout or cancellation the program is terminated, killed after kill_delay seconds
+    and reaped, so no process is left behind.
+
+    :param cmd: Command line of the program.
+    :param timeout: Seconds until the program is stopped, None to wait without limit.
+    :param cwd: Working directory of the program.
+    :param env: Environment of the program.
+    :param check: Raise an exception if the program returns a non-zero exit status.
+    :param on_line: Callable(stream name, line) for each line of stdout and stderr, e.g. for progress.
+    :param kill_delay: Seconds between terminate and kill.
+    :rtype: ProcessResult
+    :raise subprocess.TimeoutExpired: if the program did not finish within timeout seconds.
+    :raise subprocess.CalledProcessError: if check is set and the program failed.
+    """
+    start = time.monotonic()
+    process = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                                   stderr=subprocess.PIPE, cwd=cwd, env=env)
+    stdout = bytearray()
+    stderr = bytearray()
+    try:
+        await asyncio.wait_for(asyncio.gather(_read_stream(process.stdout, stdout, 'stdout', on_line),
+                                              _read_stream(process.stderr, stderr, 'stderr', on_line),
+                                              process.wait()), timeout)
+    except asyncio.TimeoutError:
+        await _stop_process(process, kill_delay)
+        raise subprocess.TimeoutExpired(cmd, timeout, bytes(stdout), bytes(stderr))
+    except BaseException:
+        # e.g. asyncio.CancelledError
+        await asyncio.shield(_stop_process(process, kill_delay))
+        raise
+
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, bytes(stdout), bytes(stderr))
+    return ProcessResult(cmd, process.returncode, bytes(stdout), bytes(stderr), time.monotonic() - start)
+
+
+async def _read_stream(stream, buffer, name, on_line):
+    # Chunks instead of readline(), which fails on long lines, e.g. progress output without newlines.
+    pending = b''
+    while True:
+        chunk = await stream.read(64 * 1024)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            _emit_line(name, line, on_line)
+    if pending:
+        _emit_line(name, pending, on_line)
+
+
+def _emit_line(name, line, on_line):
+    text = line.decode(errors='replace').rstrip('\r')
+    logger.debug('%s: %s', name, text)
+    if on_line is not None:
+        on_line(name, text)
+
+
+async def _stop_process(process, kill_delay):
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+        await asyncio.wait_for(process.wait(), kill_delay)
+    except ProcessLookupError:
+        pass
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+async def execute_concurrently(commands, limit=None):
+    """
+    Execute commands concurrently by execute_async(), e.g. I/O-bound commands like git clones.
+
+    :param commands: List of Command.
+    :param limit: Maximum number of commands, which run at the same time, None for no limit.
+    :return: Result or exception of each command in order of commands.
+    :rtype: list
+    """
+    semaphore = asyncio.Semaphore(limit if limit else max(len(commands), 1))
+
+    async def execute(cmd):
+        async with semaphore:
+            return await cmd.execute_async()
+
+    return await asyncio.gather(*(execute(cmd) for cmd in commands), return_exceptions=True)
 
 
 class Task(Command, metaclass=abc.ABCMeta):  # pylint: disable=too-few-public-methods
@@ -128,8 +306,26 @@ class CliCommand(backbacker.sub_commands.SubCommand, metaclass=abc.ABCMeta):
         raise NotImplementedError()
 
     @classmethod
-    def exec(cls, args):
+    def init_subparser(cls, subparsers):
+        super().init_subparser(subparsers)
+        parser = subparsers.choices[cls._name().strip()]
+        parser.add_argument(Argument.PROM_FILE.long_arg,
+                            help='Write duration, exit status and output bytes to a node_exporter textfile.')
+
+    @classmethod
+    def prepare(cls, args):
         instance = cls._instance(args)
+        if Argument.PROM_FILE.has_value(args):
+            prom_file = Argument.PROM_FILE.get_value(args)
+            return lambda: cls._execute_exported(instance, prom_file)
+        return lambda: cls._execute_instance(instance)
+
+    @classmethod
+    def exec(cls, args):
+        return cls.prepare(args)()
+
+    @classmethod
+    def _execute_instance(cls, instance):
         try:
             instance.execute()
             return 0
@@ -137,13 +333,34 @@ class CliCommand(backbacker.sub_commands.SubCommand, metaclass=abc.ABCMeta):
             logger.error(ex)
             return 1
 
+    @classmethod
+    def _execute_exported(cls, instance, prom_file):
+        from backbacker import prometheus
+
+        instrumentation.pop_last_measurement()
+        start = time.monotonic()
+        with instrumentation.output_measured():
+            rc = cls._execute_instance(instance)
+        measurement = instrumentation.pop_last_measurement()
+        output_bytes = measurement.bytes_written if measurement else None
+        result = prometheus.Result(cls._name(), cls._name(), time.monotonic() - start, rc, output_bytes)
+        try:
+            prometheus.write_textfile(prom_file, [result])
+        except OSError as ex:
+            logger.error('Could not write textfile %s: %s', prom_file, ex)
+        return rc
+
 
 class Argument(enum.Enum):
     SRC_DIR = 'src_dir'
     DST_DIR = 'dst_dir'
     DIR = 'dir'
+    FILE = 'file'
     BACKUP_DIR = 'backup_dir'
+    STORE_DIR = 'store_dir'
     CONFIG_FILE = 'cfg_file'
+    PROM_FILE = 'prom_file'
+    PATH = 'path'
 
     # Network
     URL = 'url'
@@ -160,12 +377,33 @@ class Argument(enum.Enum):
     DB_PASSWD = 'db_passwd'
 
     # Misc
+    NAME = 'name'
     DATE_FORMAT = 'datefmt'
     ROTATE = 'rotate'
+    KEEP_DAILY = 'keep-daily'
+    KEEP_WEEKLY = 'keep-weekly'
+    KEEP_MONTHLY = 'keep-monthly'
+    KEEP_YEARLY = 'keep-yearly'
+    DRY_RUN = 'dry-run'
     MIRROR = 'mirror'
     SHELL = 'shell'
     EXCLUDE_FILES = 'exclude-files'
     EXCLUDE_DIRS = 'exclude-directories'
+    THREADS = 'threads'
+    COMPRESSOR = 'compressor'
+    COMPRESS_LEVEL = 'compress-level'
+    JOBS = 'jobs'
+    PACK = 'pack'
+    WORKERS = 'workers'
+    SHARDS = 'shards'
+    PROGRESS = 'progress'
+    TIMEOUT = 'timeout'
+    CACHE_DIR = 'cache_dir'
+    CACHE_SIZE = 'cache_size'
+    INCREMENTAL = 'incremental'
+    SEGMENT_SIZE = 'segment_size'
+    SEEK_INDEX = 'seek_index'
+    GRACE = 'grace'
 
     def __init__(self, name):
         self._name = name
@@ -9,6 +9,7 @@ def register_sub_commands(subparser):
     """
     from backbacker.commands import backup_rotation
     from backbacker.commands import compress
+    from backbacker.commands import dedup
     from backbacker.commands import example
     from backbacker.commands import file_sync
     from backbacker.commands import git
@@ -17,20 +18,29 @@ def register_sub_commands(subparser):
     from backbacker.commands import mv_timestamp
     from backbacker.commands import mysql
     from backbacker.commands import pgsql
+    from backbacker.commands import restore
     from backbacker.commands import service
 
     backup_rotation.BackupRotationCliCommand.init_subparser(subparser)
+    dedup.DedupStoreCliCommand.init_subparser(subparser)
+    dedup.DedupRestoreCliCommand.init_subparser(subparser)
+    dedup.DedupGcCliCommand.init_subparser(subparser)
     example.ExampleCliCommand.init_subparser(subparser)
     file_sync.RsyncCliCommand.init_subparser(subparser)
     file_sync.RobocopyCliCommand.init_subparser(subparser)
+    file_sync.PySyncCliCommand.init_subparser(subparser)
     git.GitBundleCliCommand.init_subparser(subparser)
+    git.GitBundleRestoreCliCommand.init_subparser(subparser)
     git.GitCloneCliCommand.init_subparser(subparser)
     github.GithubBundleCliCommand.init_subparser(subparser)
     compress.GZipCliCommand.init_subparser(subparser)
+    restore.RestoreCliCommand.init_subparser(subparser)
     mount.MountSambaCliCommand.init_subparser(subparser)
     mount.UmountCliCommand.init_subparser(subparser)
     mv_timestamp.MoveTimestampCliCommand.init_subparser(subparser)
     mysql.MySqlDumpGzipCliCommand.init_subparser(subparser)
+    mysql.MySqlDumpAllCliCommand.init_subparser(subparser)
     pgsql.PgSqlDumpGzipCliCommand.init_subparser(subparser)
+    pgsql.PgSqlDumpAllCliCommand.init_subparser(subparser)
     service.ServiceStartCliCommand.init_subparser(subparser)
     service.ServiceStopCliCommand.init_subparser(subparser)
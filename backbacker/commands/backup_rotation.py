@@ -1,6 +1,6 @@
+import collections
 from datetime import datetime
 import logging
-from glob import glob
 import os
 import sys
 
@@ -22,7 +22,8 @@ class BackupRotation(command.Command):
         super().__init__()
         self._dir = None
         self.date_pattern = constants.FILE_DATE_FORMAT
-        self._keep_backups = sys.maxsize
+        self.policy = RetentionPolicy()
+        self.dry_run = False
 
     @property
     def dir(self):
@@ -34,16 +35,13 @@ class BackupRotation(command.Command):
 
     @property
     def keep_backups(self):
-        return self._keep_backups
+        """Number of newest backups to keep, a shortcut for policy.last."""
+        return self.policy.last if self.policy.last else sys.maxsize
 
     @keep_backups.setter
     def keep_backups(self, value):
-        try:
-            self._keep_backups = int(value)
-        except ValueError:
-            raise ValueError('Could not cast "keep_backups" to int: {}'.format(value))
-
-        if self._keep_backups <= 0:
+        self.policy.last = _to_count(value, 'keep_backups')
+        if self.policy.last <= 0:
             raise ValueError('Invalid value of "keep_backups". Must be greater than 0, but it is: {}'.format(value))
 
     def execute(self):
@@ -52,21 +50,115 @@ class BackupRotation(command.Command):
         if not os.access(self.dir, os.W_OK):
             raise PermissionError('No write access to: {}'.format(self.dir))
 
-        dates = [x.split(BackupRotation.DATE_PREFIX_SEP)[0] for x in os.listdir(self.dir)
-                 if os.path.isfile(os.path.join(self.dir, x))]
-        dates = set(dates)
-        dates = [datetime.strptime(x, self.date_pattern) for x in dates]
-
-        if len(dates) > self.keep_backups:
-            dates.sort()
-            files = []
-
-            for dpfx in dates[:-self.keep_backups]:
-                spfx = dpfx.strftime(self.date_pattern) + BackupRotation.DATE_PREFIX_SEP + '*'
-                files.extend(glob(os.path.join(self.dir, spfx)))
+        if self.policy.is_empty():
+            logger.info('No retention rule, keeping all backups in: %s', self.dir)
+            return
 
+        index = self.build_index()
+        keep = self.policy.select(index.keys())
+        expired = sorted(dpfx for dpfx in index if dpfx not in keep)
+        files = [dfile for dpfx in expired for dfile in index[dpfx]]
+        if self.dry_run:
             for dfile in files:
-                os.remove(dfile)
+                logger.info('Would delete: %s', dfile)
+            logger.info('Would delete %d files of %d backups, keeping %d backups in: %s',
+                        len(files), len(expired), len(keep), self.dir)
+            return
+
+        logger.info('Deleting %d files of %d backups in: %s', len(files), len(expired), self.dir)
+        for dfile in files:
+            os.remove(dfile)
+
+    def build_index(self):
+        """
+        Scan the directory once and group the backup files by their date prefix.
+        Entries without a parsable date prefix are skipped.
+
+        :return: Dictionary of date prefix to list of file paths.
+        :rtype: dict
+        """
+        index = collections.defaultdict(list)
+        prefixes = dict()  # cache, each prefix is parsed only once
+        with os.scandir(self.dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+
+                spfx, sep, _ = entry.name.partition(BackupRotation.DATE_PREFIX_SEP)
+                if not sep:
+                    logger.debug('Skipping file without date prefix: %s', entry.name)
+                    continue
+
+                if spfx not in prefixes:
+                    try:
+                        prefixes[spfx] = datetime.strptime(spfx, self.date_pattern)
+                    except ValueError:
+                        prefixes[spfx] = None
+                if prefixes[spfx] is None:
+                    logger.debug('Skipping file with unknown date prefix: %s', entry.name)
+                    continue
+
+                index[prefixes[spfx]].append(entry.path)
+        return index
+
+
+class RetentionPolicy:
+    """
+    Grandfather-father-son retention policy.
+
+    A backup is kept if one of the rules selects it:
+    the newest backups (last), and the newest backup of each of the most recent days, ISO weeks, months and years.
+    A policy without any rule keeps all backups.
+    """
+
+    def __init__(self, last=0, daily=0, weekly=0, monthly=0, yearly=0):
+        self.last = _to_count(last, 'last')
+        self.daily = _to_count(daily, 'daily')
+        self.weekly = _to_count(weekly, 'weekly')
+        self.monthly = _to_count(monthly, 'monthly')
+        self.yearly = _to_count(yearly, 'yearly')
+
+    def is_empty(self):
+        return not any([self.last, self.daily, self.weekly, self.monthly, self.yearly])
+
+    def select(self, dates):
+        """
+        Select the backups to keep.
+
+        :param dates: Iterable of datetime, the date prefixes of the backups.
+        :return: Set of datetime to keep.
+        :rtype: set
+        """
+        dates = sorted(set(dates), reverse=True)
+        if self.is_empty():
+            return set(dates)
+
+        keep = set(dates[:self.last])
+        periods = [(self.daily, lambda d: d.date()),
+                   (self.weekly, lambda d: d.isocalendar()[:2]),
+                   (self.monthly, lambda d: (d.year, d.month)),
+                   (self.yearly, lambda d: d.year)]
+        for count, period in periods:
+            seen = set()
+            for date in dates:
+                if len(seen) >= count:
+                    break
+                key = period(date)
+                if key not in seen:  # dates are descending, so this is the newest backup of the period
+                    seen.add(key)
+                    keep.add(date)
+        return keep
+
+
+def _to_count(value, name):
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('Could not cast "{}" to int: {}'.format(name, value))
+
+    if count < 0:
+        raise ValueError('Invalid value of "{}". Must not be negative, but it is: {}'.format(name, value))
+    return count
 
 
 class BackupRotationCliCommand(command.CliCommand):
@@ -77,8 +169,18 @@ class BackupRotationCliCommand(command.CliCommand):
                             help='Directory which contains the backups with a date prefix.')
         parser.add_argument(command.Argument.DATE_FORMAT.long_arg, default=constants.FILE_DATE_FORMAT,
                             help='Date format of the date prefix.')
-        parser.add_argument(command.Argument.ROTATE.long_arg, type=int, default=5,
-                            help='Number of backups to keep.')
+        parser.add_argument(command.Argument.ROTATE.long_arg, type=int,
+                            help='Number of newest backups to keep. Default is 5, if no other --keep-* is given.')
+        parser.add_argument(command.Argument.KEEP_DAILY.long_arg, type=int,
+                            help='Number of days to keep the newest backup of.')
+        parser.add_argument(command.Argument.KEEP_WEEKLY.long_arg, type=int,
+                            help='Number of weeks to keep the newest backup of.')
+        parser.add_argument(command.Argument.KEEP_MONTHLY.long_arg, type=int,
+                            help='Number of months to keep the newest backup of.')
+        parser.add_argument(command.Argument.KEEP_YEARLY.long_arg, type=int,
+                            help='Number of years to keep the newest backup of.')
+        parser.add_argument(command.Argument.DRY_RUN.long_arg, action='store_true',
+                            help='Print the files which would be deleted, without deleting them.')
 
     @classmethod
     def _name(cls):
@@ -96,4 +198,15 @@ class BackupRotationCliCommand(command.CliCommand):
             instance.date_pattern = command.Argument.DATE_FORMAT.get_value(args)
         if command.Argument.ROTATE.has_value(args):
             instance.keep_backups = command.Argument.ROTATE.get_value(args)
+        if command.Argument.KEEP_DAILY.has_value(args):
+            instance.policy.daily = _to_count(command.Argument.KEEP_DAILY.get_value(args), 'keep-daily')
+        if command.Argument.KEEP_WEEKLY.has_value(args):
+            instance.policy.weekly = _to_count(command.Argument.KEEP_WEEKLY.get_value(args), 'keep-weekly')
+        if command.Argument.KEEP_MONTHLY.has_value(args):
+            instance.policy.monthly = _to_count(command.Argument.KEEP_MONTHLY.get_value(args), 'keep-monthly')
+        if command.Argument.KEEP_YEARLY.has_value(args):
+            instance.policy.yearly = _to_count(command.Argument.KEEP_YEARLY.get_value(args), 'keep-yearly')
+        if instance.policy.is_empty():
+            instance.keep_backups = 5
+        instance.dry_run = command.Argument.DRY_RUN.get_value(args)
         return instance
@@ -1,8 +1,20 @@
+import abc
+import bisect
+import collections
+import concurrent.futures
+import gzip
+import json
 import logging
+import lzma
 import os
+import re
+import shutil
+import subprocess
 import tarfile
+import time
 
 from backbacker import command
+from backbacker import sub_commands
 
 
 __author__ = 'Christof Pieloth'
@@ -11,12 +23,32 @@ logger = logging.getLogger(__name__)
 
 
 class GZip(command.Command):
-    """Compresses a folder to a tar.gz archive."""
+    """
+    Compresses a folder to a tar archive, gzip by default or any other compressor, e.g. zstd.
+
+    In incremental mode, the first run creates a full archive and a manifest of the archived entries.
+    Subsequent runs create <name>.<N>.tar.gz, which contains only new or changed entries.
+
+    In segmented mode, the tree is split into archives <name>.gen<GGGG>.seg<NNNN>.tar.gz of about segment_size
+    uncompressed bytes, which are compressed in parallel by workers. Each segment has an index of its members.
+    A journal records each completed segment, so a failed run is resumed after the last completed segment.
+    Each run writes a new generation and replaces the journal <name>.journal.json when it is complete,
+    so the previous archive is kept until then.
+
+    With a seek index, the archive is written as independent gzip blocks and a sidecar <archive>.index.json.gz
+    maps each member to its block, so a single file is restored without decompressing the whole archive.
+    """
 
     def __init__(self):
         super().__init__()
         self._src_dir = None
         self._dst_dir = None
+        self._threads = 1
+        self.incremental = False
+        self.compressor = None
+        self._segment_size = None
+        self._workers = 1
+        self.seek_index = False
 
     @property
     def src_dir(self):
@@ -34,23 +66,1096 @@ class GZip(command.Command):
     def dst_dir(self, value):
         self._dst_dir = os.path.expanduser(value)
 
+    @property
+    def threads(self):
+        """Number of threads for the default in-process gzip compression."""
+        return self._threads
+
+    @threads.setter
+    def threads(self, value):
+        try:
+            self._threads = int(value)
+        except ValueError:
+            raise ValueError('Could not cast "threads" to int: {}'.format(value))
+
+        if self._threads <= 0:
+            raise ValueError('Invalid value of "threads". Must be greater than 0, but it is: {}'.format(value))
+
+    @property
+    def segment_size(self):
+        """Uncompressed bytes per segment, None to create a single archive. A larger file is not split."""
+        return self._segment_size
+
+    @segment_size.setter
+    def segment_size(self, value):
+        if value is None:
+            self._segment_size = None
+            return
+        try:
+            self._segment_size = int(value)
+        except ValueError:
+            raise ValueError('Could not cast "segment_size" to int: {}'.format(value))
+
+        if self._segment_size <= 0:
+            raise ValueError('Invalid value of "segment_size". Must be greater than 0, but it is: {}'.format(value))
+
+    @property
+    def workers(self):
+        """Number of segments, which are compressed in parallel."""
+        return self._workers
+
+    @workers.setter
+    def workers(self, value):
+        try:
+            self._workers = int(value)
+        except ValueError:
+            raise ValueError('Could not cast "workers" to int: {}'.format(value))
+
+        if self._workers <= 0:
+            raise ValueError('Invalid value of "workers". Must be greater than 0, but it is: {}'.format(value))
+
+    @property
+    def codec(self):
+        """The compressor, default is in-process gzip with level 9."""
+        if self.compressor is not None:
+            return self.compressor
+        return PythonGZipCompressor(self.threads, 9)
+
+    @property
+    def dst_file(self):
+        return os.path.join(self.dst_dir, '{}.tar{}'.format(os.path.basename(self.src_dir), self.codec.extension))
+
+    @property
+    def manifest_file(self):
+        return os.path.join(self.dst_dir, '{}{}'.format(os.path.basename(self.src_dir), ArchiveManifest.SUFFIX))
+
+    @property
+    def journal_file(self):
+        return os.path.join(self.dst_dir, '{}{}'.format(os.path.basename(self.src_dir), SegmentJournal.SUFFIX))
+
+    @property
+    def pending_journal_file(self):
+        """Journal of the segmented run in progress, it replaces journal_file when the run is complete."""
+        return self.journal_file + '.part'
+
+    def segment_file(self, generation, index):
+        return os.path.join(self.dst_dir, '{}.gen{:04d}.seg{:04d}.tar{}'.format(
+            os.path.basename(self.src_dir), generation, index, self.codec.extension))
+
     def execute(self):
         if not os.access(self.src_dir, os.R_OK):
             raise PermissionError('No read access to: {}'.format(self.src_dir))
         if not os.access(self.dst_dir, os.W_OK):
             raise PermissionError('No write access to: {}'.format(self.dst_dir))
 
-        dest_file = '{}.tar.gz'.format(os.path.basename(self.src_dir))
-        dest = os.path.join(self.dst_dir, dest_file)
-        tar = None
+        if self.incremental and self.segment_size:
+            raise ValueError('Incremental mode does not support segments.')
+        if self.seek_index and self.incremental:
+            raise ValueError('Incremental mode does not support a seek index.')
+        if self.seek_index and not isinstance(self.codec, PythonGZipCompressor):
+            raise ValueError('Seek index requires the python compressor, but it is: {}'.format(self.codec.name))
+        if self.incremental:
+            self._execute_incremental()
+            return
+        if self.segment_size:
+            self._execute_segmented()
+            return
+
+        index_file = SeekIndex.index_file(self.dst_file)
+        if self.seek_index:
+            entries = scan_tree(self.src_dir)
+            self._archive_segment(self.dst_file, [''] + sorted(entries, key=_member_key))
+        else:
+            self._archive(self.dst_file, lambda tar: tar.add(self.src_dir))
+            if os.path.exists(index_file):
+                logger.info('Removing outdated index: %s', index_file)
+                os.remove(index_file)
+        if os.path.exists(self.manifest_file):
+            # A full archive breaks the chain of a previous incremental run.
+            logger.info('Removing outdated manifest: %s', self.manifest_file)
+            os.remove(self.manifest_file)
+
+    def _execute_incremental(self):
+        # The tree is scanned before archiving, files changed in between are archived again by the next run.
+        entries = scan_tree(self.src_dir)
+        manifest = None
+        if os.path.exists(self.manifest_file):
+            manifest = ArchiveManifest.load(self.manifest_file)
+            if not os.path.isfile(self.dst_file):
+                logger.warning('Full archive is missing, creating a new one: %s', self.dst_file)
+                manifest = None
+
+        if manifest is None:
+            self._archive(self.dst_file, lambda tar: tar.add(self.src_dir))
+            manifest = ArchiveManifest(self.manifest_file, _arc_root(self.src_dir))
+            manifest.append(self.dst_file, entries)
+            manifest.save()
+            logger.info('Created full archive with %d entries: %s', len(entries), self.dst_file)
+            return
+
+        changed, deleted = manifest.diff(entries)
+        if not changed and not deleted:
+            logger.info('Tree is unchanged since last archive: %s', self.src_dir)
+            return
+        dest = os.path.join(self.dst_dir, '{}.{}.tar{}'.format(os.path.basename(self.src_dir), len(manifest.archives),
+                                                               self.codec.extension))
+
+        def add_changed(tar):
+            for rel in changed:
+                tar.add(os.path.join(self.src_dir, rel.rstrip('/')), recursive=False)
+
+        self._archive(dest, add_changed)
+        manifest.append(dest, entries, deleted)
+        manifest.save()
+        logger.info('Created incremental archive with %d changed and %d deleted entries: %s',
+                    len(changed), len(deleted), dest)
+
+    def _execute_segmented(self):
+        root = _arc_root(self.src_dir)
+        # The archive of the last complete run stays untouched until this run is complete.
+        previous = SegmentJournal.load(self.journal_file) if os.path.exists(self.journal_file) else None
+        journal = None
+        if os.path.exists(self.pending_journal_file):
+            journal = SegmentJournal.load(self.pending_journal_file)
+            if journal.root != root or journal.extension != self.codec.extension or \
+                    (previous and journal.generation == previous.generation):
+                journal = None
+            elif not journal.verify():
+                logger.warning('Segments do not match the journal, creating a new archive: %s',
+                               self.pending_journal_file)
+                journal = None
+            else:
+                logger.info('Resuming after %d segments: %s', len(journal.segments), self.pending_journal_file)
+        if journal is None:
+            generation = previous.generation + 1 if previous else 0
+            journal = SegmentJournal(self.pending_journal_file, root, self.codec.extension, generation)
+        self._remove_stale_segments([journal, previous] if previous else [journal])
+
+        # A resumed run continues with the entries after the last archived one, in the order of _member_key().
+        entries = scan_tree(self.src_dir)
+        last_key = journal.last_key
+        pending = sorted((rel for rel in entries if last_key is None or _member_key(rel) > last_key), key=_member_key)
+        if last_key is None:
+            pending.insert(0, '')
+
+        segments = list()
+        if last_key is not None:
+            # Entries, which were created after the failed run before the last archived one, are not in a segment.
+            archived = journal.archived_entries()
+            missing = sorted((rel for rel in entries if _member_key(rel) <= last_key and rel not in archived),
+                             key=_member_key)
+            if missing:
+                logger.warning('Archiving %d entries, which were added before the last archived entry: %s',
+                               len(missing), self.pending_journal_file)
+                segments.extend(self._split(missing, entries))
+        segments.extend(self._split(pending, entries))
+
+        # Segments are committed to the journal in order, so the journal stays a resumable prefix.
+        index = len(journal.segments)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._archive_segment, self.segment_file(journal.generation, index + i),
+                                       segment)
+                       for i, segment in enumerate(segments)]
+            try:
+                for future, segment in zip(futures, segments):
+                    dest = future.result()
+                    journal.append(dest, segment[0], segment[-1], len(segment))
+                    journal.save()
+                    logger.info('Completed segment %d with %d entries: %s', index, len(segment), dest)
+                    index += 1
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        journal.complete = True
+        journal.save()
+        os.replace(self.pending_journal_file, self.journal_file)
+        logger.info('Completed archive with %d segments: %s', len(journal.segments), self.journal_file)
+        if previous:
+            self._remove_stale_segments([journal])
+
+    def _split(self, rels, entries):
+        pending = collections.deque(rels)
+        segments = list()
+        while pending:
+            size = 0
+            segment = list()
+            while pending and size < self.segment_size:
+                rel = pending.popleft()
+                segment.append(rel)
+                size += entries[rel][0] if rel and not rel.endswith('/') else 0
+            segments.append(segment)
+        return segments
+
+    def _archive_segment(self, dest, segment):
+        members = list()
+
+        def add_segment(tar):
+            for rel in segment:
+                offset = tar.offset
+                self._add_member(tar, rel)
+                members.append([rel, offset, tar.offset - offset])
+
+        writer = self._archive(dest, add_segment)
+        blocks = writer.blocks if self.seek_index else None
+        SeekIndex(_arc_root(self.src_dir), members, blocks).save(dest)
+        return dest
+
+    def _add_member(self, tar, rel):
+        tar.add(os.path.join(self.src_dir, rel.rstrip('/')) if rel else self.src_dir, recursive=False)
+
+    def _remove_stale_segments(self, journals):
+        # Segments and partial files of an interrupted or previous run, which are not part of the journals.
+        pattern = re.compile(r'{}\.(gen\d+\.)?seg\d+\.'.format(re.escape(os.path.basename(self.src_dir))))
+        committed = {name for journal in journals for segment in journal.segments
+                     for name in (segment['file'], os.path.basename(SeekIndex.index_file(segment['file'])))}
+        for fname in os.listdir(self.dst_dir):
+            if pattern.match(fname) and fname not in committed:
+                logger.info('Removing stale segment: %s', fname)
+                os.remove(os.path.join(self.dst_dir, fname))
+
+    def _archive(self, dest, add):
+        codec = self.codec
+        if not codec.is_available():
+            raise OSError('Compressor not available: {}'.format(codec.name))
+
+        # A failed run, e.g. disk full, must not leave a truncated archive.
+        tmp_dest = dest + '.part'
         try:
-            tar = tarfile.open(dest, 'w|gz')
-            tar.add(self.src_dir)
+            with open(tmp_dest, 'wb') as file, self._open_writer(codec, file) as writer:
+                with tarfile.open(fileobj=writer, mode='w|') as tar:
+                    add(tar)
+            os.replace(tmp_dest, dest)
         except Exception as ex:
+            if os.path.exists(tmp_dest):
+                os.remove(tmp_dest)
             raise RuntimeError('Could not compress: {}'.format(self.src_dir)) from ex
+        return writer
+
+    def _open_writer(self, codec, file):
+        if self.seek_index:
+            # Independent blocks are the restart points of the seek index, also with a single thread.
+            return ParallelGZipWriter(file, codec.threads, level=codec.level)
+        return codec.open(file)
+
+
+def scan_tree(src_dir):
+    """
+    Collect size, mtime and inode of all entries below a directory. Symbolic links are not followed.
+
+    :param src_dir: Root directory.
+    :return: Dictionary of relative path to [size, mtime in ns, inode], paths of directories end with '/'.
+    :rtype: dict
+    """
+    entries = dict()
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(src_dir, rel_dir)) as it:
+            for entry in it:
+                stat = entry.stat(follow_symlinks=False)
+                rel = rel_dir + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    rel += '/'
+                    stack.append(rel)
+                entries[rel] = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+    return entries
+
+
+def _arc_root(src_dir):
+    # Same name as tarfile uses for the root folder of tar.add(src_dir).
+    return src_dir.replace(os.sep, '/').strip('/')
+
+
+class ArchiveManifest:
+    """
+    Index of the entries of the last archived tree and chain of a full archive and incremental archives.
+    Each incremental archive contains new or changed entries and a tombstone list of the deleted entries,
+    i.e. the chain must be restored in order.
+    """
+
+    SUFFIX = '.manifest.json.gz'
+
+    def __init__(self, manifest_file, root):
+        """
+        :param manifest_file: Path to the manifest.
+        :param root: Name of the archived folder in the tar files.
+        """
+        self.manifest_file = os.path.abspath(os.path.expanduser(manifest_file))
+        self.root = root
+        self.archives = list()
+        self.entries = dict()
+
+    @classmethod
+    def load(cls, manifest_file):
+        with gzip.open(os.path.expanduser(manifest_file), 'rt') as file:
+            data = json.load(file)
+        manifest = cls(manifest_file, data['root'])
+        manifest.archives = data['archives']
+        manifest.entries = data['entries']
+        return manifest
+
+    def save(self):
+        tmp_file = self.manifest_file + '.tmp'
+        with gzip.open(tmp_file, 'wt') as file:
+            json.dump({'root': self.root, 'archives': self.archives, 'entries': self.entries}, file,
+                      separators=(',', ':'))
+        os.replace(tmp_file, self.manifest_file)
+
+    def diff(self, entries):
+        """
+        Compare entries with the last archived entries.
+
+        :param entries: Entries of scan_tree().
+        :return: Sorted lists of new or changed paths and of deleted paths.
+        """
+        changed = sorted(rel for rel, stat in entries.items() if self.entries.get(rel) != stat)
+        deleted = sorted(rel for rel in self.entries if rel not in entries)
+        return changed, deleted
+
+    def append(self, archive_file, entries, deleted=None):
+        """
+        Add an archive to the chain.
+
+        :param archive_file: Path to the archive, must be in the same folder as the manifest.
+        :param entries: Entries of the tree, which are contained by the chain up to this archive.
+        :param deleted: Paths, which were deleted since the previous archive.
+        """
+        self.archives.append({'file': os.path.basename(archive_file), 'deleted': list(deleted or [])})
+        self.entries = entries
+
+    def files(self):
+        """Absolute paths of all archives in order."""
+        return [os.path.join(os.path.dirname(self.manifest_file), archive['file']) for archive in self.archives]
+
+    def restore(self, dst_dir):
+        """
+        Extract the chain into a directory and apply the deletions of each archive.
+
+        :param dst_dir: Destination directory, the tree is restored to dst_dir/root.
+        """
+        for fname in self.files():
+            if not os.path.isfile(fname):
+                raise FileNotFoundError('Archive of chain is missing: {}'.format(fname))
+
+        for fname, archive in zip(self.files(), self.archives):
+            # Deletions before extraction, a path which changed its type is deleted and added by the same archive.
+            # Children before parents.
+            for rel in reversed(archive['deleted']):
+                path = os.path.join(dst_dir, self.root, rel.rstrip('/'))
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                elif os.path.lexists(path):
+                    os.remove(path)
+            extract_archive(fname, dst_dir)
+
+
+def _member_key(rel):
+    # Sort order of the segmented mode: a directory before its content, like a depth-first walk.
+    return tuple(rel.rstrip('/').split('/')) if rel else tuple()
+
+
+class SeekIndex:
+    """
+    Sidecar index of the members of a tar archive.
+
+    Members are listed with offset and size in the uncompressed tar stream. If the archive consists of
+    independent gzip blocks, see ParallelGZipWriter, the blocks are listed with their uncompressed and compressed
+    offset. Then a member is extracted by seeking to the block, which contains the start of the member.
+    """
+
+    SUFFIX = '.index.json.gz'
+
+    def __init__(self, root, members=None, blocks=None):
+        """
+        :param root: Name of the archived folder in the tar file.
+        :param members: List of [relative path, offset, size] in the uncompressed tar stream.
+        :param blocks: List of [uncompressed offset, compressed offset] of the gzip blocks, None if not seekable.
+        """
+        self.root = root
+        self.members = members if members else list()
+        self.blocks = blocks
+
+    @classmethod
+    def index_file(cls, archive_file):
+        return archive_file + cls.SUFFIX
+
+    @classmethod
+    def load(cls, archive_file):
+        """
+        Read the index of an archive.
+
+        :param archive_file: Path to the archive.
+        :rtype: SeekIndex
+        """
+        with gzip.open(cls.index_file(archive_file), 'rt') as file:
+            data = json.load(file)
+        return cls(data.get('root', ''), data['members'], data.get('blocks'))
+
+    def save(self, archive_file):
+        index_file = self.index_file(archive_file)
+        tmp_file = index_file + '.tmp'
+        with gzip.open(tmp_file, 'wt') as file:
+            json.dump({'root': self.root, 'members': self.members, 'blocks': self.blocks}, file,
+                      separators=(',', ':'))
+        os.replace(tmp_file, index_file)
+
+    def arc_name(self, rel):
+        """Name of a member in the tar file."""
+        return '/'.join((self.root, rel.rstrip('/'))) if rel else self.root
+
+    def select(self, paths):
+        """
+        Select the members of paths and the entries below them.
+
+        :param paths: Paths relative to the archived folder, e.g. 'foo/bar.txt'.
+        :return: Relative paths of the members and the paths, which were found.
+        """
+        keys = {_member_key(path.strip('/')): path for path in paths}
+        selected = list()
+        found = set()
+        for rel, _, _ in self.members:
+            member = _member_key(rel)
+            for key, path in keys.items():
+                if member[:len(key)] == key:
+                    selected.append(rel)
+                    found.add(path)
+                    break
+        return selected, found
+
+    def extract(self, archive_file, rels, dst_dir):
+        """
+        Extract members of the archive, seeking to their blocks if the archive is seekable.
+
+        :param archive_file: Path to the archive.
+        :param rels: Relative paths of the members.
+        :param dst_dir: Destination directory, the members are restored to dst_dir/root.
+        :return: Number of extracted members.
+        """
+        if not self.blocks:
+            return extract_members(archive_file, dst_dir, {self.arc_name(rel) for rel in rels})
+
+        # Members close to each other are read in one pass, others after a seek.
+        selected = set(rels)
+        groups = list()
+        end = None
+        for member in sorted((member for member in self.members if member[0] in selected), key=lambda m: m[1]):
+            if end is None or member[1] - end > ParallelGZipWriter.DEFAULT_BLOCK_SIZE:
+                groups.append(list())
+            groups[-1].append(member)
+            end = member[1] + member[2]
+
+        count = 0
+        block_offsets = [block[0] for block in self.blocks]
+        with open(archive_file, 'rb') as file:
+            for group in groups:
+                block = self.blocks[bisect.bisect_right(block_offsets, group[0][1]) - 1]
+                file.seek(block[1])
+                with gzip.GzipFile(fileobj=file, mode='rb') as reader:
+                    # Seeking forward decompresses only the rest of the block.
+                    reader.seek(group[0][1] - block[0])
+                    count += _extract_stream(reader, dst_dir, {self.arc_name(member[0]) for member in group})
+        return count
+
+
+class SegmentJournal:
+    """
+    Journal of the completed segments of an archive.
+    A segment is recorded after it was written completely, so the journal never references a truncated file.
+
+    The entries of each segment are sorted by _member_key(), so the first and last entry of each segment locate
+    a path without reading the segments. Each segment has a SeekIndex.
+    The segments are in order, except for segments of entries, which were added before the last archived entry
+    while a failed run was resumed.
+    """
+
+    SUFFIX = '.journal.json'
+
+    def __init__(self, journal_file, root, extension, generation=0):
+        """
+        :param journal_file: Path to the journal.
+        :param root: Name of the archived folder in the tar files.
+        :param extension: File extension of the compressor.
+        :param generation: Number of the run, which wrote the segments.
+        """
+        self.journal_file = os.path.abspath(os.path.expanduser(journal_file))
+        self.root = root
+        self.extension = extension
+        self.generation = generation
+        self.segments = list()
+        self.complete = False
+
+    @classmethod
+    def load(cls, journal_file):
+        with open(os.path.expanduser(journal_file), 'r') as file:
+            data = json.load(file)
+        journal = cls(journal_file, data['root'], data['extension'], data.get('generation', 0))
+        journal.segments = data['segments']
+        journal.complete = data['complete']
+        return journal
+
+    def save(self):
+        tmp_file = self.journal_file + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump({'root': self.root, 'extension': self.extension, 'generation': self.generation,
+                       'complete': self.complete, 'segments': self.segments}, file, indent=1)
+        os.replace(tmp_file, self.journal_file)
+
+    @property
+    def last_key(self):
+        """Sort key of the last archived entry, None if there is no segment."""
+        if not self.segments:
+            return None
+        return max(_member_key(segment['last']) for segment in self.segments)
+
+    def archived_entries(self):
+        """Relative paths of all entries in the segments, read from their indexes."""
+        return {member[0] for fname in self.files() for member in SeekIndex.load(fname).members}
+
+    def append(self, segment_file, first, last, count):
+        """
+        Add a completed segment.
+
+        :param segment_file: Path to the segment, must be in the same folder as the journal.
+        :param first: Relative path of the first entry of the segment.
+        :param last: Relative path of the last entry of the segment.
+        :param count: Number of entries in the segment.
+        """
+        self.segments.append({'file': os.path.basename(segment_file), 'first': first, 'last': last,
+                              'entries': count, 'size': os.path.getsize(segment_file)})
+
+    def files(self):
+        """Absolute paths of all segments in order."""
+        return [os.path.join(os.path.dirname(self.journal_file), segment['file']) for segment in self.segments]
+
+    def verify(self):
+        """Check that all segments and their indexes exist and the segments have the recorded size."""
+        for fname, segment in zip(self.files(), self.segments):
+            if not os.path.isfile(fname) or os.path.getsize(fname) != segment['size']:
+                return False
+            if not os.path.isfile(SeekIndex.index_file(fname)):
+                return False
+        return True
+
+    def locate(self, path):
+        """
+        Find the segments, which may contain a path or entries below it, by the first and last entry of each segment.
+
+        :param path: Path relative to the archived folder, e.g. 'foo/bar.txt'.
+        :return: Paths of the segments.
+        """
+        key = _member_key(path.strip('/'))
+        located = list()
+        for fname, segment in zip(self.files(), self.segments):
+            first = _member_key(segment.get('first', ''))
+            last = _member_key(segment['last'])
+            # All entries below a path follow the path itself in the sort order.
+            if last >= key and (first <= key or first[:len(key)] == key):
+                located.append(fname)
+        return located
+
+    def extract(self, paths, dst_dir):
+        """
+        Extract paths and the entries below them, reading only the segments which contain them.
+
+        :param paths: Paths relative to the archived folder, e.g. 'foo/bar.txt'.
+        :param dst_dir: Destination directory, the paths are restored to dst_dir/root.
+        :return: Number of extracted entries.
+        """
+        segment_files = sorted({fname for path in paths for fname in self.locate(path)})
+        found = set()
+        count = 0
+        for fname in segment_files:
+            index = SeekIndex.load(fname)
+            rels, found_in_segment = index.select(paths)
+            found.update(found_in_segment)
+            if rels:
+                count += index.extract(fname, rels, dst_dir)
+
+        missing = [path for path in paths if path not in found]
+        if missing:
+            raise FileNotFoundError('Not found in archive: {}'.format(', '.join(missing)))
+        return count
+
+    def restore(self, dst_dir):
+        """
+        Extract all segments into a directory.
+
+        :param dst_dir: Destination directory, the tree is restored to dst_dir/root.
+        """
+        if not self.complete:
+            logger.warning('Archive is incomplete, restoring %d segments: %s', len(self.segments), self.journal_file)
+        for fname in self.files():
+            if not os.path.isfile(fname):
+                raise FileNotFoundError('Segment is missing: {}'.format(fname))
+            extract_archive(fname, dst_dir)
+
+
+class ParallelGZipWriter:
+    """
+    File-like object, which compresses written data in independent blocks on a thread pool.
+
+    Each block is written as a complete gzip member. A concatenation of gzip members is a valid gzip file,
+    so the output can be read by gzip, tar and Python's gzip module.
+    The offsets of the blocks are restart points: decompression can start at any block.
+    zlib releases the GIL while compressing, hence threads scale over multiple cores without copying
+    the blocks to other processes.
+    """
+
+    DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, fileobj, threads, block_size=DEFAULT_BLOCK_SIZE, level=9):
+        """
+        :param fileobj: Binary file object to write the compressed data to.
+        :param threads: Number of compression threads.
+        :param block_size: Size of an uncompressed block in bytes.
+        :param level: Compression level, 1 (fastest) to 9 (best).
+        """
+        self._fileobj = fileobj
+        self._block_size = block_size
+        self._level = level
+        self._max_pending = 2 * threads
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self._closed = False
+        self._uncompressed = 0
+        self._compressed = 0
+        # [uncompressed offset, compressed offset] of the written blocks, relative to the start of the output
+        self.blocks = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError('write to closed file')
+
+        self._buffer.extend(data)
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[:self._block_size])
+            del self._buffer[:self._block_size]
+            self._submit(block)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Compresses the remaining data and waits for all blocks to be written. Does not close fileobj."""
+        if self._closed:
+            return
+
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._write_next()
+            self._fileobj.flush()
         finally:
-            if tar:
-                tar.close()
+            self._closed = True
+            self._executor.shutdown()
+
+    def _submit(self, block):
+        # Keep the number of in-flight blocks bounded and write them in submission order.
+        while len(self._pending) >= self._max_pending:
+            self._write_next()
+        self._pending.append((self._uncompressed, self._executor.submit(_compress_block, block, self._level)))
+        self._uncompressed += len(block)
+
+    def _write_next(self):
+        offset, future = self._pending.popleft()
+        data = future.result()
+        self.blocks.append([offset, self._compressed])
+        self._fileobj.write(data)
+        self._compressed += len(data)
+
+    def _abort(self):
+        self._closed = True
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown()
+
+
+def _compress_block(block, level):
+    # mtime=0 keeps the output reproducible for identical input.
+    return gzip.compress(block, compresslevel=level, mtime=0)
+
+
+class Compressor(abc.ABC):
+    """Compresses a byte stream into a file object and decompresses it."""
+
+    def __init__(self, name, extension, level=None):
+        self.name = name
+        self.extension = extension
+        self.level = level
+
+    def is_available(self):
+        return True
+
+    @abc.abstractmethod
+    def open(self, fileobj):
+        """
+        Open a writer, which compresses the written data into fileobj.
+        close() of the writer raises an exception, if the compression failed.
+
+        :param fileobj: Binary file object for the compressed data.
+        :return: File-like object with write() and close().
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def open_reader(self, fileobj):
+        """
+        Open a reader, which decompresses the data of fileobj.
+        close() of the reader raises an exception, if the decompression failed.
+
+        :param fileobj: Binary file object with the compressed data.
+        :return: File-like object with read() and close().
+        """
+        raise NotImplementedError()
+
+
+class PythonGZipCompressor(Compressor):
+    """In-process gzip compression, uses the ParallelGZipWriter for more than one thread."""
+
+    def __init__(self, threads=1, level=9):
+        super().__init__('python', '.gz', level)
+        self.threads = threads
+
+    def open(self, fileobj):
+        if self.threads > 1:
+            return ParallelGZipWriter(fileobj, self.threads, level=self.level)
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=self.level, mtime=0)
+
+    def open_reader(self, fileobj):
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+
+
+class LzmaCompressor(Compressor):
+    """In-process xz compression."""
+
+    def __init__(self, level=6):
+        super().__init__('xz', '.xz', level)
+
+    def open(self, fileobj):
+        return lzma.LZMAFile(fileobj, mode='wb', preset=self.level)
+
+    def open_reader(self, fileobj):
+        return lzma.LZMAFile(fileobj, mode='rb')
+
+
+class NoneCompressor(Compressor):
+    """No compression, passes the data through."""
+
+    def __init__(self):
+        super().__init__('none', '')
+
+    def open(self, fileobj):
+        return _Passthrough(fileobj)
+
+    def open_reader(self, fileobj):
+        return _Passthrough(fileobj)
+
+
+class _Passthrough:
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def read(self, size=-1):
+        return self._fileobj.read(size)
+
+    def write(self, data):
+        return self._fileobj.write(data)
+
+    def close(self):
+        """Does not close the file object."""
+        if not self._fileobj.closed and self._fileobj.writable():
+            self._fileobj.flush()
+
+
+class ExternalCompressor(Compressor):
+    """Compression by an external program, which reads from stdin and writes to stdout."""
+
+    def __init__(self, name, extension, cmd, decompress_cmd=None, level=None):
+        """
+        :param name: Name of the compressor.
+        :param extension: File extension, e.g. '.gz'.
+        :param cmd: Command line of the program.
+        :param decompress_cmd: Command line to decompress, default is the program with '-d -c'.
+        :param level: Compression level, which is part of cmd.
+        """
+        super().__init__(name, extension, level)
+        self.cmd = cmd
+        self.decompress_cmd = decompress_cmd if decompress_cmd else [cmd[0], '-d', '-c']
+
+    def is_available(self):
+        return command.SystemCommand.check_version(self.cmd[0])
+
+    def open(self, fileobj):
+        return _ProcessWriter(self.cmd, fileobj)
+
+    def open_reader(self, fileobj):
+        return _ProcessReader(self.decompress_cmd, fileobj)
+
+
+class _ProcessWriter:
+
+    def __init__(self, cmd, fileobj):
+        self._cmd = cmd
+        self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=fileobj)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._process.kill()
+            self._process.wait()
+
+    def write(self, data):
+        try:
+            return self._process.stdin.write(data)
+        except BrokenPipeError as ex:
+            raise RuntimeError('Compressor terminated with: {}'.format(self._process.wait())) from ex
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        rc = self._process.wait()
+        if rc != 0:
+            raise subprocess.CalledProcessError(rc, self._cmd)
+
+
+class _ProcessReader:
+
+    def __init__(self, cmd, fileobj):
+        self._cmd = cmd
+        self._process = subprocess.Popen(cmd, stdin=fileobj, stdout=subprocess.PIPE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._process.kill()
+            self._process.wait()
+            self._process.stdout.close()
+
+    def read(self, size=-1):
+        return self._process.stdout.read(size)
+
+    def close(self):
+        # Read to the end, otherwise the decompressor fails with a broken pipe.
+        while self._process.stdout.read(1024 * 1024):
+            pass
+        self._process.stdout.close()
+        rc = self._process.wait()
+        if rc != 0:
+            raise subprocess.CalledProcessError(rc, self._cmd)
+
+
+# name: (default level, min level, max level)
+_LEVELS = {
+    'gzip': (6, 1, 9),
+    'pigz': (6, 1, 9),
+    'python': (9, 0, 9),
+    'xz': (6, 0, 9),
+    'zstd': (3, 1, 19),
+    'lz4': (1, 1, 12),
+    'none': (0, 0, 0),
+}
+
+CODECS = ('gzip', 'xz', 'zstd', 'lz4', 'none')
+COMPRESSORS = ('gzip', 'pigz', 'zstd', 'python', 'xz', 'lz4', 'none')
+
+_EXTENSIONS = {'.gz': 'python', '.tgz': 'python', '.xz': 'xz', '.zst': 'zstd', '.lz4': 'lz4'}
+
+
+def create_compressor(name, threads=1, level=None):
+    """
+    Create a compressor by name.
+
+    gzip, pigz, zstd and lz4 use the external programs, python and xz compress in-process.
+    xz with more than one thread uses the external program.
+
+    :param name: One of COMPRESSORS.
+    :param threads: Number of compression threads, if supported by the compressor.
+    :param level: Compression level, None for the default level of the compressor.
+    :rtype: Compressor
+    """
+    if name not in _LEVELS:
+        raise ValueError('Unknown compressor: {}'.format(name))
+    if name == 'none':
+        return NoneCompressor()
+
+    default, low, high = _LEVELS[name]
+    if level is None:
+        level = default
+    try:
+        level = int(level)
+    except ValueError:
+        raise ValueError('Could not cast "level" to int: {}'.format(level))
+    if not low <= level <= high:
+        raise ValueError('Invalid level of {}. Must be in [{}, {}], but it is: {}'.format(name, low, high, level))
+
+    if name == 'gzip':
+        return ExternalCompressor(name, '.gz', ['gzip', '-c', '-{}'.format(level)], level=level)
+    if name == 'pigz':
+        return ExternalCompressor(name, '.gz', ['pigz', '-c', '-p', str(threads), '-{}'.format(level)], level=level)
+    if name == 'zstd':
+        return ExternalCompressor(name, '.zst', ['zstd', '-q', '-c', '-T{}'.format(threads), '-{}'.format(level)],
+                                  ['zstd', '-q', '-d', '-c'], level)
+    if name == 'lz4':
+        return ExternalCompressor(name, '.lz4', ['lz4', '-q', '-c', '-{}'.format(level)], ['lz4', '-q', '-d', '-c'],
+                                  level)
+    if name == 'xz':
+        if threads > 1:
+            return ExternalCompressor(name, '.xz', ['xz', '-c', '-T{}'.format(threads), '-{}'.format(level)],
+                                      level=level)
+        return LzmaCompressor(level)
+    return PythonGZipCompressor(threads, level)
+
+
+def compressor_for_file(fname):
+    """
+    Select a compressor to read a file by its extension, e.g. foo.tar.zst.
+
+    :param fname: Path of a compressed file.
+    :return: Compressor, NoneCompressor for an unknown extension.
+    :rtype: Compressor
+    """
+    return create_compressor(_EXTENSIONS.get(os.path.splitext(fname)[1], 'none'))
+
+
+def extract_members(fname, dst_dir, names):
+    """
+    Extract members of a tar archive, which is compressed by any of the compressors.
+    The archive is read until all members are extracted.
+
+    :param fname: Path of the archive.
+    :param dst_dir: Destination directory.
+    :param names: Names of the members in the archive.
+    :return: Number of extracted members.
+    """
+    compressor = compressor_for_file(fname)
+    with open(fname, 'rb') as file, compressor.open_reader(file) as reader:
+        return _extract_stream(reader, dst_dir, names)
+
+
+def _extract_stream(reader, dst_dir, names):
+    pending = set(names)
+    with tarfile.open(fileobj=reader, mode='r|') as tar:
+        for tarinfo in tar:
+            if tarinfo.name in pending:
+                tar.extract(tarinfo, dst_dir)
+                pending.remove(tarinfo.name)
+                if not pending:
+                    break
+    return len(names) - len(pending)
+
+
+def extract_archive(fname, dst_dir):
+    """
+    Extract a tar archive, which is compressed by any of the compressors.
+
+    :param fname: Path of the archive.
+    :param dst_dir: Destination directory.
+    """
+    compressor = compressor_for_file(fname)
+    with open(fname, 'rb') as file, compressor.open_reader(file) as reader:
+        with tarfile.open(fileobj=reader, mode='r|') as tar:
+            tar.extractall(dst_dir)
+
+
+class PipeStats:
+    """Statistics of a pipe_to_file() call."""
+
+    def __init__(self, bytes_in, bytes_out, seconds):
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+        self.seconds = seconds
+
+    @property
+    def throughput(self):
+        """Uncompressed bytes per second."""
+        return self.bytes_in / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        ratio = 100.0 * self.bytes_out / self.bytes_in if self.bytes_in else 0.0
+        return '{} bytes, compressed to {} bytes ({:.1f}%) in {:.1f} s, {:.1f} MiB/s'.format(
+            self.bytes_in, self.bytes_out, ratio, self.seconds, self.throughput / 1024 / 1024)
+
+
+def pipe_to_file(cmd, dest, compressor, env=None, chunk_size=1024 * 1024):
+    """
+    Run a program and compress its stdout into a file, without a shell.
+
+    The output is written to a temporary file, which is renamed to dest on success.
+    If the program or the compressor fails, the temporary file is removed and an exception is raised.
+
+    :param cmd: Command line of the program.
+    :param dest: Destination file.
+    :param compressor: Compressor instance.
+    :param env: Environment of the program.
+    :param chunk_size: Size of the chunks to read from the program.
+    :return: Statistics of the transfer.
+    :rtype: PipeStats
+    """
+    tmp_dest = dest + '.part'
+    start = time.monotonic()
+    bytes_in = 0
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, env=env)
+    try:
+        with open(tmp_dest, 'wb') as file, compressor.open(file) as writer:
+            while True:
+                chunk = process.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                bytes_in += len(chunk)
+
+        rc = process.wait()
+        if rc != 0:
+            raise subprocess.CalledProcessError(rc, cmd[0])
+        os.replace(tmp_dest, dest)
+    except BaseException:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        if os.path.exists(tmp_dest):
+            os.remove(tmp_dest)
+        raise
+    finally:
+        process.stdout.close()
+
+    return PipeStats(bytes_in, os.path.getsize(dest), time.monotonic() - start)
 
 
 class GZipCliCommand(command.CliCommand):
@@ -59,7 +1164,21 @@ class GZipCliCommand(command.CliCommand):
     def _add_arguments(cls, parser):
         parser.add_argument(command.Argument.SRC_DIR.long_arg, help='Folder to compress.', required=True)
         parser.add_argument(command.Argument.DST_DIR.long_arg, required=True,
-                            help='Destination directory to store tar.gz.')
+                            help='Destination directory to store the archive.')
+        parser.add_argument(command.Argument.THREADS.long_arg, type=sub_commands.positive_int, default=1,
+                            help='Number of compression threads.')
+        parser.add_argument(command.Argument.COMPRESSOR.long_arg, choices=COMPRESSORS, default='python',
+                            help='Compressor, default is in-process gzip.')
+        parser.add_argument(command.Argument.COMPRESS_LEVEL.long_arg, type=int,
+                            help='Compression level, default depends on the compressor.')
+        parser.add_argument(command.Argument.INCREMENTAL.long_arg, action='store_true',
+                            help='Archive only new or changed files since the previous run.')
+        parser.add_argument(command.Argument.SEGMENT_SIZE.long_arg, type=sub_commands.positive_int,
+                            help='Split the archive into resumable segments of this size in MiB.')
+        parser.add_argument(command.Argument.WORKERS.long_arg, type=sub_commands.positive_int, default=1,
+                            help='Number of segments to compress in parallel.')
+        parser.add_argument(command.Argument.SEEK_INDEX.long_arg, action='store_true',
+                            help='Write a seek index to restore single files quickly, requires the python compressor.')
 
     @classmethod
     def _name(cls):
@@ -74,4 +1193,16 @@ class GZipCliCommand(command.CliCommand):
         instance = GZip()
         instance.src_dir = command.Argument.SRC_DIR.get_value(args)
         instance.dst_dir = command.Argument.DST_DIR.get_value(args)
+        if command.Argument.THREADS.has_value(args):
+            instance.threads = command.Argument.THREADS.get_value(args)
+        instance.incremental = command.Argument.INCREMENTAL.get_value(args)
+        instance.seek_index = command.Argument.SEEK_INDEX.get_value(args)
+        if command.Argument.SEGMENT_SIZE.has_value(args):
+            instance.segment_size = command.Argument.SEGMENT_SIZE.get_value(args) * 1024 * 1024
+        if command.Argument.WORKERS.has_value(args):
+            instance.workers = command.Argument.WORKERS.get_value(args)
+        if command.Argument.COMPRESSOR.get_value(args) != 'python' or \
+                command.Argument.COMPRESS_LEVEL.get_value(args) is not None:
+            instance.compressor = create_compressor(command.Argument.COMPRESSOR.get_value(args), instance.threads,
+                                                    command.Argument.COMPRESS_LEVEL.get_value(args))
         return instance
@@ -0,0 +1,148 @@
+import abc
+import concurrent.futures
+import fnmatch
+import json
+import logging
+import os
+import time
+
+from backbacker import command
+
+
+__author__ = 'Christof Pieloth'
+
+logger = logging.getLogger(__name__)
+
+
+class MultiDatabaseDump(command.SystemCommand, metaclass=abc.ABCMeta):
+    """
+    Abstract base class to dump all databases of a server concurrently.
+
+    Databases are dumped largest first, so that the longest dump does not start last.
+    A report with size and duration of each dump is written to the destination directory.
+    """
+
+    def __init__(self, cmd, engine):
+        """
+        :param cmd: Client command, which is used to list the databases.
+        :param engine: Name of the database engine, used for the report file.
+        """
+        super().__init__(cmd)
+        self.engine = engine
+        self._dst_dir = ''
+        self.db_user = ''
+        self.db_passwd = ''
+        self.db_pattern = '*'
+        self._workers = 1
+        self.report = list()
+
+    @property
+    def dst_dir(self):
+        return self._dst_dir
+
+    @dst_dir.setter
+    def dst_dir(self, value):
+        self._dst_dir = os.path.expanduser(value)
+
+    @property
+    def workers(self):
+        """Number of databases, which are dumped concurrently."""
+        return self._workers
+
+    @workers.setter
+    def workers(self, value):
+        try:
+            self._workers = int(value)
+        except ValueError:
+            raise ValueError('Could not cast "workers" to int: {}'.format(value))
+
+        if self._workers <= 0:
+            raise ValueError('Invalid value of "workers". Must be greater than 0, but it is: {}'.format(value))
+
+    @property
+    def report_file(self):
+        return os.path.join(self.dst_dir, '{}_dump_report.json'.format(self.engine))
+
+    @abc.abstractmethod
+    def list_databases(self):
+        """
+        List the databases of the server.
+
+        :return: List of tuples (name, size in bytes).
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def _create_dump(self, db_name):
+        """
+        Create the command to dump a single database.
+
+        :param db_name: Name of the database.
+        :return: A ready-to-use Command instance.
+        """
+        raise NotImplementedError()
+
+    def _execute_command(self):
+        if not os.access(self.dst_dir, os.W_OK):
+            raise PermissionError('No write access to: {}'.format(self.dst_dir))
+
+        databases = [db for db in self.list_databases() if fnmatch.fnmatchcase(db[0], self.db_pattern)]
+        databases.sort(key=lambda db: db[1], reverse=True)
+        logger.info('Dumping %d databases with %d workers.', len(databases), self.workers)
+
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._dump, name, size, start) for name, size in databases]
+            self.report = [future.result() for future in futures]
+
+        self._write_report(start)
+        failures = [entry['name'] for entry in self.report if entry['error']]
+        if failures:
+            raise RuntimeError('Could not dump {} of {} databases: {}'
+                               .format(len(failures), len(databases), ', '.join(failures)))
+
+    def _dump(self, name, size, start):
+        entry = {'name': name, 'size': size, 'started': time.time() - start, 'seconds': 0.0, 'error': None}
+        dump_start = time.monotonic()
+        try:
+            self._create_dump(name).execute()
+        except Exception as ex:  # pylint: disable=broad-except
+            logger.error('Could not dump database %s: %s', name, ex)
+            entry['error'] = str(ex)
+        entry['seconds'] = time.monotonic() - dump_start
+        logger.info('Dumped database %s in %.1f s.', name, entry['seconds'])
+        return entry
+
+    def _write_report(self, start):
+        report = {'started': start, 'seconds': time.time() - start, 'workers': self.workers,
+                  'databases': self.report}
+        tmp_file = self.report_file + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(report, file, indent=1)
+        os.replace(tmp_file, self.report_file)
+
+
+# pylint: disable=W0223
+class MultiDatabaseDumpCliCommand(command.CliCommand, metaclass=abc.ABCMeta):
+    """Abstract base class for multi database dump commands, which provides an interface on CLI level."""
+
+    @classmethod
+    def _add_arguments(cls, parser):
+        parser.add_argument(command.Argument.DST_DIR.long_arg, required=True, help='Destination directory for dumps.')
+        parser.add_argument(command.Argument.DB_USER.long_arg, required=True, help='Database user.')
+        parser.add_argument(command.Argument.DB_PASSWD.long_arg, required=True, help='Password for database user.')
+        parser.add_argument(command.Argument.DB_NAME.long_arg, default='*',
+                            help='Glob pattern of the database names to dump.')
+        parser.add_argument(command.Argument.WORKERS.long_arg, type=int, default=1,
+                            help='Number of databases to dump concurrently.')
+
+    @classmethod
+    def _init_instance(cls, instance, args):
+        instance.dst_dir = command.Argument.DST_DIR.get_value(args)
+        instance.db_user = command.Argument.DB_USER.get_value(args)
+        instance.db_passwd = command.Argument.DB_PASSWD.get_value(args)
+        if command.Argument.DB_NAME.has_value(args):
+            instance.db_pattern = command.Argument.DB_NAME.get_value(args)
+        if command.Argument.WORKERS.has_value(args):
+            instance.workers = command.Argument.WORKERS.get_value(args)
+        return instance
@@ -1,8 +1,17 @@
 import abc
+import concurrent.futures
+import errno
+import fnmatch
 import logging
 import os
+import re
+import shutil
 import subprocess
+import sys
+import tempfile
+import time
 
+from backbacker import availability
 from backbacker.command import SystemCommand, CliCommand, Argument
 
 __author__ = 'Christof Pieloth'
@@ -118,15 +127,11 @@ class Robocopy(FileSync):
     @classmethod
     def check_version(cls, cmd):
         """
-        Checks if  'cmd /?' is callable.
+        Checks if 'cmd' is installed. robocopy has no version argument and returns a non-zero code for '/?'.
 
-        :return True 'cmd /?' raises no exception
+        :return True if 'cmd' is found
         """
-        try:
-            subprocess.Popen([cmd, '/?'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return True
-        except OSError:
-            return False
+        return availability.lookup(cmd, '/?').path is not None
 
 
 class RobocopyCliCommand(FileSyncCliCommand):
@@ -172,11 +177,16 @@ class Rsync(FileSync):
     BACKUP_DELETE_DIR = '--backup-dir='
     REMOTE_SHELL = '-e'
     EXCLUDE = '--exclude'
+    STATS = '--stats'
+    PROGRESS = '--info=progress2'  # rsync >= 3.1
 
     def __init__(self):
         super().__init__('rsync')
         self._backup_dir = ''
         self.rsh = ''
+        self._shards = 1
+        self.progress = False
+        self.stats = None
 
     @property
     def backup_dir(self):
@@ -186,6 +196,24 @@ class Rsync(FileSync):
     def backup_dir(self, value):
         self._backup_dir = os.path.expanduser(value)
 
+    @property
+    def shards(self):
+        """
+        Number of concurrent rsync processes for local syncs.
+        The top-level entries of src_dir are partitioned by the number of their direct entries.
+        """
+        return self._shards
+
+    @shards.setter
+    def shards(self, value):
+        try:
+            self._shards = int(value)
+        except ValueError:
+            raise ValueError('Could not cast "shards" to int: {}'.format(value))
+
+        if self._shards <= 0:
+            raise ValueError('Invalid value of "shards". Must be greater than 0, but it is: {}'.format(value))
+
     def _execute_command(self):
         if self.rsh == '':
             if not os.access(self.src_dir, os.R_OK):
@@ -193,7 +221,29 @@ class Rsync(FileSync):
             if not os.access(self.dst_dir, os.W_OK):
                 raise PermissionError('No write access to: {}'.format(self.dst_dir))
 
-        cmd = [self.cmd, self.ALL]
+        if self.shards > 1:
+            if self.rsh == '':
+                self._execute_sharded()
+                return
+            logger.info('Sharding is only supported for local paths, using a single rsync.')
+
+        cmd = self._options(self.ALL)
+        cmd.append(self.src_dir)
+        cmd.append(self.dst_dir)
+
+        logger.info('execute: %s', cmd)
+        self.stats = self._run(cmd)
+        self._log_stats()
+
+    def _options(self, *args):
+        cmd = [self.cmd]
+        cmd.extend(args)
+        cmd.append(self.STATS)
+        if self.progress:
+            if self.tool.at_least(3, 1):
+                cmd.append(self.PROGRESS)
+            else:
+                logger.warning('Progress requires rsync 3.1 or newer, found: %s', self.tool.version)
         if self.mirror:
             cmd.append(self.DELETE_DEST)
             if self.backup_dir != '':
@@ -206,12 +256,203 @@ class Rsync(FileSync):
         for exclude in self.exclude_files:
             cmd.append(self.EXCLUDE)
             cmd.append(exclude)
+        return cmd
+
+    def _execute_sharded(self):
+        # Same target as rsync: without trailing '/' the source folder itself is copied into dst_dir.
+        src_dir = os.path.join(self.src_dir, '')
+        dst_dir = self.dst_dir
+        if not self.src_dir.endswith(os.sep):
+            dst_dir = os.path.join(self.dst_dir, os.path.basename(self.src_dir))
+            os.makedirs(dst_dir, exist_ok=True)
+        dst_dir = os.path.join(dst_dir, '')
+
+        # Only one level below the top-level entries is scanned, the full walk is left to the rsync of each shard.
+        with os.scandir(src_dir) as it:
+            weights = {entry.name: _entry_weight(entry) for entry in it}
+        shards = partition(weights, self.shards)
+
+        with tempfile.TemporaryDirectory(prefix='rsync') as tmp_dir:
+            cmds = list()
+            for i, shard in enumerate(shards):
+                files_from = os.path.join(tmp_dir, 'shard{}'.format(i))
+                with open(files_from, 'wb') as file:
+                    file.write(b'\0'.join(os.fsencode(name) for name in shard))
+                # --files-from disables the recursion of -a
+                cmd = self._options(self.ALL, '-r', '--from0', '--files-from=' + files_from)
+                cmd.extend([src_dir, dst_dir])
+                logger.info('execute shard %d with %d entries, weight %d: %s', i, len(shard),
+                            sum(weights[name] for name in shard), cmd)
+                cmds.append(cmd)
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(cmds) or 1) as executor:
+                futures = [executor.submit(self._run, cmd) for cmd in cmds]
+                concurrent.futures.wait(futures)
+
+        self.stats = RsyncStats()
+        failed = list()
+        for future in futures:
+            try:
+                self.stats.merge(future.result())
+            except subprocess.CalledProcessError as ex:
+                logger.error('rsync shard returned with %d: %s', ex.returncode, ex.cmd)
+                failed.append(ex)
+        if failed:
+            raise failed[0]
 
-        cmd.append(self.src_dir)
-        cmd.append(self.dst_dir)
+        if self.mirror:
+            # The shards only delete inside their entries, extraneous top-level entries are deleted by one
+            # non-recursive run.
+            cmd = self._options('-lptgoD', '-d')
+            cmd.extend([src_dir, dst_dir])
+            logger.info('execute: %s', cmd)
+            self.stats.merge(self._run(cmd), files=False)
+        self._log_stats()
+
+    def _run(self, cmd):
+        """
+        Run rsync and parse its output while it is running.
 
-        logger.info('execute: %s', cmd)
-        subprocess.check_call(cmd)
+        :return: Statistics of the transfer.
+        :rtype: RsyncStats
+        :raise CalledProcessError if rsync fails
+        """
+        stats = RsyncStats()
+        start = time.monotonic()
+        last_progress = start
+        # Universal newlines, progress2 updates its line with '\r'.
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True, errors='replace')
+        with process.stdout:
+            for line in process.stdout:
+                if stats.parse_line(line):
+                    continue
+                line = line.strip()
+                if self.progress and RsyncStats.PROGRESS.match(line):
+                    now = time.monotonic()
+                    if now - last_progress >= 10:
+                        logger.info('rsync progress: %s', line)
+                        last_progress = now
+                elif line:
+                    logger.debug('rsync: %s', line)
+        rc = process.wait()
+        stats.seconds = time.monotonic() - start
+        if rc != 0:
+            raise subprocess.CalledProcessError(rc, cmd)
+        return stats
+
+    def _log_stats(self):
+        logger.info('rsync transferred %d of %d files, sent %d bytes, speedup %.2f in %.1f s.',
+                    self.stats.files_transferred, self.stats.files_total, self.stats.bytes_sent,
+                    self.stats.speedup, self.stats.seconds,
+                    extra={'rsync_' + key: value for key, value in self.stats.as_dict().items()})
+
+
+class RsyncStats:
+    """Transfer statistics of rsync --stats."""
+
+    PROGRESS = re.compile(r'^[\d,.]+[KMG]?\s+\d+%\s')
+
+    _FIELDS = [
+        ('files_total', re.compile(r'^Number of files: ([\d,]+)')),
+        ('files_transferred', re.compile(r'^Number of (?:regular )?files transferred: ([\d,]+)')),
+        ('files_deleted', re.compile(r'^Number of deleted files: ([\d,]+)')),
+        ('bytes_total', re.compile(r'^Total file size: ([\d,]+)')),
+        ('bytes_transferred', re.compile(r'^Total transferred file size: ([\d,]+)')),
+        ('bytes_literal', re.compile(r'^Literal data: ([\d,]+)')),
+        ('bytes_sent', re.compile(r'^Total bytes sent: ([\d,]+)')),
+        ('bytes_received', re.compile(r'^Total bytes received: ([\d,]+)')),
+    ]
+
+    def __init__(self):
+        self.files_total = 0
+        self.files_transferred = 0
+        self.files_deleted = 0
+        self.bytes_total = 0
+        self.bytes_transferred = 0
+        self.bytes_literal = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+
+    @property
+    def speedup(self):
+        """Total file size divided by the bytes on the wire, as reported by rsync."""
+        wire = self.bytes_sent + self.bytes_received
+        return self.bytes_total / wire if wire else 0.0
+
+    def parse_line(self, line):
+        """
+        Parse a line of the output.
+
+        :param line: A line of the output.
+        :return: True if the line contained a statistic.
+        """
+        line = line.strip()
+        for name, pattern in self._FIELDS:
+            match = pattern.match(line)
+            if match:
+                setattr(self, name, int(match.group(1).replace(',', '')))
+                return True
+        return False
+
+    @classmethod
+    def parse(cls, output):
+        stats = cls()
+        for line in output.splitlines():
+            stats.parse_line(line)
+        return stats
+
+    def merge(self, other, files=True):
+        """
+        Add the statistics of a concurrent run.
+
+        :param other: RsyncStats of another run.
+        :param files: Add the file counts and sizes, False for a run over the same files.
+        """
+        if files:
+            self.files_total += other.files_total
+            self.bytes_total += other.bytes_total
+        self.files_transferred += other.files_transferred
+        self.files_deleted += other.files_deleted
+        self.bytes_transferred += other.bytes_transferred
+        self.bytes_literal += other.bytes_literal
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.seconds = max(self.seconds, other.seconds) if files else self.seconds + other.seconds
+
+    def as_dict(self):
+        result = {name: getattr(self, name) for name, _ in self._FIELDS}
+        result['speedup'] = self.speedup
+        result['seconds'] = self.seconds
+        return result
+
+
+def _entry_weight(entry):
+    # A folder weighs 1 plus the number of its direct entries, without a recursive walk.
+    if not entry.is_dir(follow_symlinks=False):
+        return 1
+    try:
+        with os.scandir(entry.path) as it:
+            return 1 + sum(1 for _ in it)
+    except OSError:
+        return 1
+
+
+def partition(weights, n):
+    """
+    Partition items into at most n groups of similar total weight, the largest items are assigned first.
+
+    :param weights: Dictionary of item to weight.
+    :param n: Number of groups.
+    :return: List of non-empty lists of items.
+    :rtype: list
+    """
+    groups = [[0, list()] for _ in range(n)]
+    for item in sorted(weights, key=lambda item: (-weights[item], item)):
+        group = min(groups, key=lambda group: group[0])
+        group[0] += weights[item]
+        group[1].append(item)
+    return [sorted(items) for _, items in groups if items]
 
 
 class RsyncCliCommand(FileSyncCliCommand):
@@ -221,6 +462,10 @@ class RsyncCliCommand(FileSyncCliCommand):
         FileSyncCliCommand._add_arguments(parser)
         parser.add_argument(Argument.BACKUP_DIR.long_arg, help='Backup directory for rsync.')
         parser.add_argument(Argument.SHELL.long_arg, help='Remote shell to use.')
+        parser.add_argument(Argument.SHARDS.long_arg, type=int, default=1,
+                            help='Number of concurrent rsync processes, only for local paths.')
+        parser.add_argument(Argument.PROGRESS.long_arg, action='store_true',
+                            help='Log the overall progress, requires rsync 3.1 or newer.')
 
     @classmethod
     def _name(cls):
@@ -246,4 +491,213 @@ class RsyncCliCommand(FileSyncCliCommand):
         if Argument.SHELL.has_value(args):
             instance.rsh = Argument.SHELL.get_value(args)
 
+        if Argument.SHARDS.has_value(args):
+            instance.shards = Argument.SHARDS.get_value(args)
+
+        instance.progress = Argument.PROGRESS.get_value(args)
+
+        return instance
+
+
+class PySync(FileSync):
+    """
+    File sync in pure Python, does not require an external program.
+    Copies the content of the source directory into the destination directory, like rsync with a trailing '/'.
+    Files are compared by size and modification time and copied in parallel.
+    """
+
+    def __init__(self):
+        super().__init__('pysync')
+        self._workers = 8
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.deleted = 0
+
+    @property
+    def workers(self):
+        """Number of files, which are copied concurrently."""
+        return self._workers
+
+    @workers.setter
+    def workers(self, value):
+        try:
+            self._workers = int(value)
+        except ValueError:
+            raise ValueError('Could not cast "workers" to int: {}'.format(value))
+
+        if self._workers <= 0:
+            raise ValueError('Invalid value of "workers". Must be greater than 0, but it is: {}'.format(value))
+
+    def is_available(self):
+        return True
+
+    def _execute_command(self):
+        if not os.access(self.src_dir, os.R_OK):
+            raise PermissionError('No read access to: {}'.format(self.src_dir))
+        if not os.access(self.dst_dir, os.W_OK):
+            raise PermissionError('No write access to: {}'.format(self.dst_dir))
+
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.deleted = 0
+        dirs = list()
+        futures = dict()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            stack = [(self.src_dir, self.dst_dir)]
+            while stack:
+                src_dir, dst_dir = stack.pop()
+                dirs.append((src_dir, dst_dir))
+                for src, dst, size in self._sync_dir(src_dir, dst_dir, stack):
+                    futures[executor.submit(_copy_file, src, dst)] = (src, size)
+
+        errors = 0
+        for future, (src, size) in futures.items():
+            try:
+                future.result()
+                self.copied_files += 1
+                self.copied_bytes += size
+            except OSError as ex:
+                logger.error('Could not copy %s: %s', src, ex)
+                errors += 1
+
+        # Copying files changes the modification time of the directory, so it is restored afterwards.
+        for src_dir, dst_dir in reversed(dirs[1:]):
+            shutil.copystat(src_dir, dst_dir)
+
+        logger.info('Copied %d files, %d bytes, deleted %d entries.', self.copied_files, self.copied_bytes,
+                    self.deleted)
+        if errors:
+            raise RuntimeError('Could not copy {} files to: {}'.format(errors, self.dst_dir))
+
+    def _is_excluded(self, entry):
+        return not entry.is_dir(follow_symlinks=False) and \
+            any(fnmatch.fnmatch(entry.name, pattern) for pattern in self.exclude_files)
+
+    def _sync_dir(self, src_dir, dst_dir, stack):
+        """
+        Compare a directory, create sub directories and delete extraneous entries in mirror mode.
+
+        :return: List of (source, destination, size) of files to copy.
+        """
+        with os.scandir(src_dir) as it:
+            src_entries = {entry.name: entry for entry in it if not self._is_excluded(entry)}
+        with os.scandir(dst_dir) as it:
+            dst_entries = {entry.name: entry for entry in it}
+
+        copies = list()
+        for name, src in sorted(src_entries.items()):
+            dst = dst_entries.get(name)
+            dst_path = os.path.join(dst_dir, name)
+            if src.is_symlink():
+                target = os.readlink(src.path)
+                if dst is not None and dst.is_symlink() and os.readlink(dst.path) == target:
+                    continue
+                self._remove(dst)
+                os.symlink(target, dst_path)
+            elif src.is_dir():
+                if dst is None or dst.is_symlink() or not dst.is_dir():
+                    self._remove(dst)
+                    os.mkdir(dst_path)
+                stack.append((src.path, dst_path))
+            elif src.is_file():
+                stat = src.stat()
+                if dst is not None and not dst.is_symlink() and dst.is_file():
+                    dst_stat = dst.stat()
+                    if dst_stat.st_size == stat.st_size and int(dst_stat.st_mtime) == int(stat.st_mtime):
+                        continue
+                elif dst is not None:
+                    self._remove(dst)
+                copies.append((src.path, dst_path, stat.st_size))
+            else:
+                logger.warning('Skipping special file: %s', src.path)
+
+        if self.mirror:
+            for name, dst in dst_entries.items():
+                if name not in src_entries and not self._is_excluded(dst):
+                    self._remove(dst)
+        return copies
+
+    def _remove(self, entry):
+        if entry is None:
+            return
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+        self.deleted += 1
+
+
+def _copy_file(src, dst):
+    # Write to a temporary file in the same directory, so an interrupted copy never leaves a truncated file.
+    tmp_dst = os.path.join(os.path.dirname(dst), '.{}.pysync'.format(os.path.basename(dst)))
+    try:
+        with open(src, 'rb') as fsrc, open(tmp_dst, 'wb') as fdst:
+            _copy_data(fsrc, fdst)
+        shutil.copystat(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+    except BaseException:
+        if os.path.exists(tmp_dst):
+            os.remove(tmp_dst)
+        raise
+
+
+_COPY_CHUNK = 64 * 1024 * 1024
+_COPY_FALLBACK = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+
+def _copy_data(fsrc, fdst):
+    """
+    Copy file content in the kernel, if possible.
+    copy_file_range() allows reflinks and server-side copies, sendfile() avoids copies to user space.
+    Both advance the file offsets, i.e. a fallback continues at the current position.
+    """
+    src_fd = fsrc.fileno()
+    dst_fd = fdst.fileno()
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while os.copy_file_range(src_fd, dst_fd, _COPY_CHUNK) > 0:
+                pass
+            return
+        except OSError as ex:
+            if ex.errno not in _COPY_FALLBACK:
+                raise
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        try:
+            while os.sendfile(dst_fd, src_fd, None, _COPY_CHUNK) > 0:
+                pass
+            return
+        except OSError as ex:
+            if ex.errno not in _COPY_FALLBACK:
+                raise
+    shutil.copyfileobj(fsrc, fdst)
+
+
+class PySyncCliCommand(FileSyncCliCommand):
+
+    @classmethod
+    def _add_arguments(cls, parser):
+        FileSyncCliCommand._add_arguments(parser)
+        parser.add_argument(Argument.WORKERS.long_arg, type=int, default=8, help='Number of concurrent copies.')
+
+    @classmethod
+    def _name(cls):
+        return 'pysync'
+
+    @classmethod
+    def _help(cls):
+        return PySync.__doc__
+
+    @classmethod
+    def _instance(cls, args):
+        instance = PySync()
+        instance.src_dir = Argument.SRC_DIR.get_value(args)
+        instance.dst_dir = Argument.DST_DIR.get_value(args)
+        instance.mirror = Argument.MIRROR.get_value(args)
+
+        if Argument.EXCLUDE_FILES.has_value(args):
+            instance.exclude_files = Argument.EXCLUDE_FILES.get_value(args)
+
+        if Argument.WORKERS.has_value(args):
+            instance.workers = Argument.WORKERS.get_value(args)
+
         return instance
@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 import subprocess
@@ -12,10 +13,13 @@ logger = logging.getLogger(__name__)
 class GitBundle(command.SystemCommand):
     """Bundle a git repository."""
 
-    def __init__(self, repo=None, dst_dir=None):
+    def __init__(self, repo=None, dst_dir=None, timeout=None, name=None, incremental=False):
         super().__init__('git')
         self._repo = repo
         self._dst_dir = dst_dir
+        self.timeout = timeout
+        self.name = name
+        self.incremental = incremental
 
         # perform checks
         self.repo = self._repo
@@ -43,20 +47,177 @@ class GitBundle(command.SystemCommand):
     def dst_file(self):
         """
         Generated FQN to bundle file.
-        Takes folder name of the repository and add '.git.bundle'
+        Takes name or folder name of the repository and add '.git.bundle'
         """
         if not self.repo or not os.path.isdir(self.repo):
             raise NotADirectoryError('repo is None or not a directory: {}'.format(self.repo))
-        dst_file = '{}.{}'.format(os.path.basename(self.repo), 'git.bundle')
+        dst_file = '{}.{}'.format(self.name or os.path.basename(self.repo), 'git.bundle')
         return os.path.join(self.dst_dir, dst_file)
 
+    @property
+    def chain_file(self):
+        """FQN to the chain file of incremental bundles."""
+        return self.dst_file + GitBundleChain.SUFFIX
+
     def _execute_command(self):
         if not os.access(self.repo, os.R_OK):
             raise PermissionError('No read access to: {}'.format(self.repo))
         if not os.access(self.dst_dir, os.W_OK):
             raise PermissionError('No write access to: {}'.format(self.dst_dir))
 
-        subprocess.check_call([self.cmd, 'bundle', 'create', self.dst_file, '--all'], cwd=self.repo)
+        if self.incremental:
+            self._execute_incremental()
+            return
+
+        subprocess.check_call([self.cmd, 'bundle', 'create', self.dst_file, '--all'], cwd=self.repo,
+                              timeout=self.timeout)
+        if os.path.isfile(self.chain_file):
+            # The full bundle of the chain was replaced, hence its incremental bundles are not usable anymore.
+            logger.info('Removing outdated chain file: %s', self.chain_file)
+            os.remove(self.chain_file)
+
+    def _execute_incremental(self):
+        refs = self._read_refs()
+        head = self._read_head()
+
+        chain = None
+        if os.path.isfile(self.chain_file) and os.path.isfile(self.dst_file):
+            chain = GitBundleChain.load(self.chain_file)
+        if not chain or not chain.bundles:
+            subprocess.check_call([self.cmd, 'bundle', 'create', self.dst_file, '--all'], cwd=self.repo,
+                                  timeout=self.timeout)
+            chain = GitBundleChain(self.chain_file)
+            chain.append(self.dst_file, refs, head)
+            chain.save()
+            return
+
+        last_refs = chain.bundles[-1]['refs']
+        if refs == last_refs:
+            logger.info('Repository is unchanged since last bundle: %s', self.repo)
+            return
+
+        prerequisites = self._existing_commits(set(last_refs.values()))
+        revs = ''.join('^{}\n'.format(sha) for sha in sorted(prerequisites))
+        # Objects instead of commits, because an annotated tag on an existing commit adds a tag object only.
+        new_objects = subprocess.run([self.cmd, 'rev-list', '--count', '--objects', '--all', '--stdin'],
+                                     cwd=self.repo, input=revs.encode(), stdout=subprocess.PIPE, check=True,
+                                     timeout=self.timeout).stdout
+        if int(new_objects) == 0:
+            # git refuses to create an empty bundle, but the moved, added or deleted refs must be restored.
+            logger.info('No new objects since last bundle, recording refs only: %s', self.repo)
+            chain.append(None, refs, head)
+            chain.save()
+            return
+
+        dst_file = '{}.{}{}'.format(self.dst_file[:-len('.git.bundle')], len(chain.bundles), '.git.bundle')
+        subprocess.run([self.cmd, 'bundle', 'create', dst_file, '--all', '--stdin'], cwd=self.repo,
+                       input=revs.encode(), check=True, timeout=self.timeout)
+        chain.append(dst_file, refs, head)
+        chain.save()
+
+    def _read_refs(self):
+        output = subprocess.check_output([self.cmd, 'for-each-ref', '--format=%(objectname) %(refname)'],
+                                         cwd=self.repo, timeout=self.timeout)
+        return dict(reversed(line.split(' ', 1)) for line in output.decode().splitlines())
+
+    def _read_head(self):
+        result = subprocess.run([self.cmd, 'symbolic-ref', '-q', 'HEAD'], cwd=self.repo, stdout=subprocess.PIPE,
+                                timeout=self.timeout)
+        return result.stdout.decode().strip() if result.returncode == 0 else None
+
+    def _existing_commits(self, shas):
+        # Objects of previous tips can be gone, e.g. after a force-push and gc. They can not be prerequisites.
+        query = ''.join('{}^{{commit}}\n'.format(sha) for sha in shas)
+        output = subprocess.run([self.cmd, 'cat-file', '--batch-check=%(objectname)'], cwd=self.repo,
+                                input=query.encode(), stdout=subprocess.PIPE, check=True,
+                                timeout=self.timeout).stdout.decode()
+        return {line for line in output.splitlines() if not line.endswith(' missing')}
+
+
+class GitBundleChain:
+    """
+    Chain of a full bundle and incremental bundles.
+    Each incremental bundle requires the commits of its predecessors, i.e. the chain must be restored in order.
+    """
+
+    SUFFIX = '.chain'
+
+    def __init__(self, chain_file):
+        self.chain_file = os.path.abspath(os.path.expanduser(chain_file))
+        self.bundles = list()
+
+    @classmethod
+    def load(cls, chain_file):
+        chain = cls(chain_file)
+        with open(chain.chain_file, 'r') as file:
+            chain.bundles = json.load(file)['bundles']
+        return chain
+
+    def save(self):
+        tmp_file = self.chain_file + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump({'bundles': self.bundles}, file, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.chain_file)
+
+    def append(self, bundle_file, refs, head=None):
+        """
+        Add a bundle to the chain.
+
+        :param bundle_file: Path to the bundle, must be in the same folder as the chain file.
+                            None if only refs were changed, i.e. there are no new objects to bundle.
+        :param refs: Dictionary of all refs of the repository, which are contained by the chain up to this bundle.
+        :param head: Symbolic ref of HEAD.
+        """
+        self.bundles.append({'file': os.path.basename(bundle_file) if bundle_file else None, 'refs': refs,
+                             'head': head})
+
+    def files(self):
+        """Absolute paths of all bundles in order, entries with refs only are skipped."""
+        return [os.path.join(os.path.dirname(self.chain_file), bundle['file']) for bundle in self.bundles
+                if bundle['file']]
+
+    def check_files(self):
+        """
+        Checks if all bundles of the chain exist.
+
+        :raise FileNotFoundError if a bundle is missing
+        """
+        if not self.bundles or not self.bundles[0]['file']:
+            raise FileNotFoundError('Chain contains no bundle: {}'.format(self.chain_file))
+        for fname in self.files():
+            if not os.path.isfile(fname):
+                raise FileNotFoundError('Bundle of chain is missing: {}'.format(fname))
+
+    def restore(self, dst_dir, cmd='git'):
+        """
+        Restore the chain to a new bare repository.
+        Each bundle is verified against the already restored commits before it is fetched.
+
+        :param dst_dir: Path for the new bare repository.
+        :param cmd: git command.
+        """
+        self.check_files()
+        subprocess.check_call([cmd, 'init', '--quiet', '--bare', dst_dir])
+        for fname in self.files():
+            subprocess.check_call([cmd, 'bundle', 'verify', '--quiet', fname], cwd=dst_dir)
+            subprocess.check_call([cmd, 'fetch', '--quiet', fname, '+refs/*:refs/*'], cwd=dst_dir)
+
+        # Unchanged refs are not part of incremental bundles and refs can be moved without new objects.
+        # Hence all refs are set to the last state explicitly and deleted refs are removed.
+        last = self.bundles[-1]
+        output = subprocess.check_output([cmd, 'for-each-ref', '--format=%(refname)'], cwd=dst_dir)
+        for ref in output.decode().splitlines():
+            if ref not in last['refs']:
+                subprocess.check_call([cmd, 'update-ref', '-d', ref], cwd=dst_dir)
+        updates = ''.join('update {} {}\n'.format(ref, sha) for ref, sha in sorted(last['refs'].items()))
+        subprocess.run([cmd, 'update-ref', '--stdin'], cwd=dst_dir, input=updates.encode(), check=True)
+        if last.get('head'):
+            subprocess.check_call([cmd, 'symbolic-ref', 'HEAD', last['head']], cwd=dst_dir)
+
+        output = subprocess.check_output([cmd, 'for-each-ref', '--format=%(objectname) %(refname)'], cwd=dst_dir)
+        refs = dict(reversed(line.split(' ', 1)) for line in output.decode().splitlines())
+        if refs != last['refs']:
+            raise RuntimeError('Restored refs differ from the chain: {}'.format(self.chain_file))
 
 
 class GitBundleCliCommand(command.CliCommand):
@@ -66,6 +227,8 @@ class GitBundleCliCommand(command.CliCommand):
         parser.add_argument(command.Argument.SRC_DIR.long_arg, help='git repository to bundle.', required=True)
         parser.add_argument(command.Argument.DST_DIR.long_arg, help='Destination directory to store the bundle.',
                             required=True)
+        parser.add_argument(command.Argument.INCREMENTAL.long_arg, action='store_true',
+                            help='Bundle only new commits since the last bundle of the chain.')
 
     @classmethod
     def _help(cls):
@@ -77,16 +240,67 @@ class GitBundleCliCommand(command.CliCommand):
 
     @classmethod
     def _instance(cls, args):
-        return GitBundle(command.Argument.SRC_DIR.get_value(args), command.Argument.DST_DIR.get_value(args))
+        return GitBundle(command.Argument.SRC_DIR.get_value(args), command.Argument.DST_DIR.get_value(args),
+                         incremental=command.Argument.INCREMENTAL.get_value(args))
+
+
+class GitBundleRestore(command.SystemCommand):
+    """Restore a chain of a full and incremental git bundles to a bare repository."""
+
+    def __init__(self, chain_file=None, dst_dir=None):
+        super().__init__('git')
+        self.chain_file = chain_file
+        self._dst_dir = dst_dir
+
+        # perform checks
+        self.dst_dir = self._dst_dir
+
+    @property
+    def dst_dir(self):
+        """Absolute path of the new bare repository."""
+        return self._dst_dir
+
+    @dst_dir.setter
+    def dst_dir(self, value):
+        self._dst_dir = os.path.abspath(os.path.expanduser(value))
+
+    def _execute_command(self):
+        if os.path.exists(self.dst_dir) and os.listdir(self.dst_dir):
+            raise FileExistsError('Destination is not empty: {}'.format(self.dst_dir))
+
+        GitBundleChain.load(self.chain_file).restore(self.dst_dir, self.cmd)
+
+
+class GitBundleRestoreCliCommand(command.CliCommand):
+
+    @classmethod
+    def _add_arguments(cls, parser):
+        parser.add_argument(command.Argument.FILE.long_arg, help='Chain file of the bundles.', required=True)
+        parser.add_argument(command.Argument.DST_DIR.long_arg, help='Directory for the bare repository.',
+                            required=True)
+
+    @classmethod
+    def _help(cls):
+        return GitBundleRestore.__doc__
+
+    @classmethod
+    def _name(cls):
+        return 'git_bundle_restore'
+
+    @classmethod
+    def _instance(cls, args):
+        return GitBundleRestore(command.Argument.FILE.get_value(args), command.Argument.DST_DIR.get_value(args))
 
 
 class GitClone(command.SystemCommand):
     """Clone a git repository."""
 
-    def __init__(self, repo=None, dst_dir=None):
+    def __init__(self, repo=None, dst_dir=None, timeout=None, mirror=False):
         super().__init__('git')
         self.repo = repo
         self._dst_dir = dst_dir
+        self.timeout = timeout
+        self.mirror = mirror
 
         # perform checks
         self.dst_dir = self._dst_dir
@@ -100,8 +314,12 @@ class GitClone(command.SystemCommand):
     def dst_dir(self, value):
         self._dst_dir = os.path.abspath(os.path.expanduser(value))
 
-    def _execute_command(self):
-        subprocess.check_call([self.cmd, 'clone', self.repo, self.dst_dir])
+    def _command_line(self):
+        cmd = [self.cmd, 'clone']
+        if self.mirror:
+            cmd.append('--mirror')
+        cmd.extend([self.repo, self.dst_dir])
+        return cmd
 
 
 class GitCloneCliCommand(command.CliCommand):
@@ -1,8 +1,15 @@
+import concurrent.futures
+import email.utils
+import hashlib
+import json
 import logging
 import os
 import shutil
 import stat
+import subprocess
 import tempfile
+import threading
+import time
 import urllib.parse
 
 from backbacker import command
@@ -14,14 +21,22 @@ logger = logging.getLogger(__name__)
 
 
 class GithubBundle(command.Command):
-    """Bundle all git repositories from a Github account."""
+    """
+    Bundle all git repositories from a Github account.
+    An access token for authenticated API requests is read from the environment variable GITHUB_TOKEN.
+    """
 
-    def __init__(self, username=None, dst_dir=None):
+    def __init__(self, username=None, dst_dir=None, workers=1, timeout=None):
         self.username = username
         self._dst_dir = dst_dir
+        self._workers = 1
+        self.timeout = timeout
+        self.cache = None
+        self.listing = None
 
         # perform checks
         self.dst_dir = self._dst_dir
+        self.workers = workers
 
     @property
     def dst_dir(self):
@@ -32,51 +47,346 @@ class GithubBundle(command.Command):
     def dst_dir(self, value):
         self._dst_dir = os.path.abspath(os.path.expanduser(value))
 
+    @property
+    def workers(self):
+        """Number of repositories, which are cloned and bundled concurrently."""
+        return self._workers
+
+    @workers.setter
+    def workers(self, value):
+        try:
+            self._workers = int(value)
+        except ValueError:
+            raise ValueError('Could not cast "workers" to int: {}'.format(value))
+
+        if self._workers <= 0:
+            raise ValueError('Invalid value of "workers". Must be greater than 0, but it is: {}'.format(value))
+
     def execute(self):
         if not os.access(self.dst_dir, os.W_OK):
             raise PermissionError('No write access to: {}'.format(self.dst_dir))
 
-        for name, url in self.collect_repository_urls(self.username):
-            self.clone_and_bundle(name, url)
-
-    @classmethod
-    def collect_repository_urls(cls, username):
-        import requests
+        failures = dict()
+        total = 0
+        listed = False
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = dict()
+            try:
+                # Repositories are submitted while the next pages are requested.
+                for name, url in self.collect_repository_urls(self.username, self.listing):
+                    futures[executor.submit(self.clone_and_bundle, name, url)] = name
+                listed = True
+            finally:
+                total = len(futures)
+                for future in concurrent.futures.as_completed(futures):
+                    name = futures[future]
+                    try:
+                        future.result()
+                    except Exception as ex:  # pylint: disable=broad-except
+                        logger.error('Could not bundle repository %s: %s', name, ex)
+                        failures[name] = ex
 
-        # https://docs.github.com/en/rest/repos/repos?apiVersion=2022-11-28
-        request_url = 'https://api.github.com/users/{}/repos'.format(urllib.parse.quote(username))
+                if self.cache:
+                    self.cache.save()
+                    if listed:
+                        # Only a complete listing tells which repositories were deleted upstream.
+                        self.cache.evict(set(futures.values()))
 
-        # https://docs.github.com/en/rest/about-the-rest-api/api-versions?apiVersion=2022-11-2
-        request_headers = {'X-GitHub-Api-Version': '2022-11-28'}
+        logger.info('Bundled %d of %d repositories.', total - len(failures), total)
+        if failures:
+            raise RuntimeError('Could not bundle {} of {} repositories: {}'
+                               .format(len(failures), total, ', '.join(sorted(failures))))
 
-        while request_url:
-            response = requests.get(request_url, headers=request_headers)
-            if not response.ok:
-                raise IOError('Unsuccessful request: {}, {}'.format(request_url, response.text))
-
-            for repo_dict in response.json():
-                yield repo_dict['name'], repo_dict['clone_url']
+    @classmethod
+    def collect_repository_urls(cls, username, listing=None):
+        """
+        Collect name and clone URL of all repositories of an account.
 
-            # https://docs.github.com/en/rest/using-the-rest-api/using-pagination-in-the-rest-api?apiVersion=2022-11-2
-            if 'next' in response.links:
-                request_url = response.links['next']['url']
-            else:
-                break
-        else:  # no-break
-            logger.error('Link header contains empty next URL.')
+        :param username: Github account.
+        :param listing: RepositoryListing to use, a default listing without cache is used if None.
+        """
+        listing = listing or RepositoryListing()
+        yield from listing.repositories(username)
 
     def clone_and_bundle(self, name, url):
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        if self.cache:
+            self._mirror_and_bundle(name, url, deadline)
+            return
+
         with tempfile.TemporaryDirectory(prefix='githubBundle') as tmp_dir:
             dst_dir = os.path.join(tmp_dir, name)
             try:
-                git_clone = git.GitClone(url, dst_dir)
+                git_clone = git.GitClone(url, dst_dir, timeout=_remaining(deadline))
                 git_clone.execute()
 
-                git_bundle = git.GitBundle(dst_dir, self.dst_dir)
+                git_bundle = git.GitBundle(dst_dir, self.dst_dir, timeout=_remaining(deadline))
                 git_bundle.execute()
             finally:
                 shutil.rmtree(dst_dir, onerror=_on_rm_error)
 
+    def _mirror_and_bundle(self, name, url, deadline):
+        mirror_dir = self.cache.update(name, url, timeout=_remaining(deadline))
+        refs_hash = self.cache.refs_hash(mirror_dir)
+
+        git_bundle = git.GitBundle(mirror_dir, self.dst_dir, timeout=_remaining(deadline), name=name)
+        if not self.cache.changed(name, refs_hash) and os.path.isfile(git_bundle.dst_file):
+            logger.info('Skipping unchanged repository: %s', name)
+            self.cache.commit(name, url, refs_hash)
+            return
+
+        git_bundle.execute()
+        self.cache.commit(name, url, refs_hash)
+
+
+class RepositoryListing:
+    """
+    Lists the repositories of a Github account.
+
+    Uses one HTTP session for all requests. If a cache directory is given, responses are stored with their ETag and
+    revalidated by conditional requests. Unchanged pages are answered with 304, which does not count against the
+    rate limit of authenticated requests, i.e. if a token is given. If the rate limit is exceeded, the listing waits
+    for the reset.
+    """
+
+    API_URL = 'https://api.github.com'
+    PER_PAGE = 100
+    TOKEN_ENV = 'GITHUB_TOKEN'
+
+    def __init__(self, api_url=API_URL, cache_dir=None, retries=3, max_wait=900, token=None, timeout=60):
+        """
+        :param api_url: Base URL of the Github REST API.
+        :param cache_dir: Directory for cached responses, None disables caching.
+        :param retries: Number of retries on rate limit or server errors.
+        :param max_wait: Maximum time in seconds to wait before a retry.
+        :param token: Access token for authenticated requests, None for anonymous requests.
+        :param timeout: Timeout in seconds to connect and to wait for data of a single request.
+        """
+        self.api_url = api_url.rstrip('/')
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir)) if cache_dir else None
+        self.retries = retries
+        self.max_wait = max_wait
+        self.token = token
+        self.timeout = timeout
+        self._session = None
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @property
+    def session(self):
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+            # https://docs.github.com/en/rest/about-the-rest-api/api-versions?apiVersion=2022-11-2
+            self._session.headers.update({'X-GitHub-Api-Version': '2022-11-28',
+                                          'Accept': 'application/vnd.github+json'})
+            if self.token:
+                self._session.headers['Authorization'] = 'Bearer {}'.format(self.token)
+        return self._session
+
+    def repositories(self, username):
+        """
+        Yield name and clone URL of all repositories of an account.
+
+        :param username: Github account.
+        """
+        # https://docs.github.com/en/rest/repos/repos?apiVersion=2022-11-28
+        request_url = '{}/users/{}/repos?per_page={}'.format(
+            self.api_url, urllib.parse.quote(username), self.PER_PAGE)
+        while request_url:
+            repos, request_url = self._get_page(request_url)
+            for repo_dict in repos:
+                yield repo_dict['name'], repo_dict['clone_url']
+
+    def _get_page(self, request_url):
+        cached = self._read_cache(request_url)
+        headers = {'If-None-Match': cached['etag']} if cached else {}
+
+        response = self._request(request_url, headers)
+        if response.status_code == 304 and cached:
+            logger.debug('Not modified: %s', request_url)
+            return cached['body'], cached['next']
+        if not response.ok:
+            raise IOError('Unsuccessful request: {}, {}'.format(request_url, response.text))
+
+        # https://docs.github.com/en/rest/using-the-rest-api/using-pagination-in-the-rest-api?apiVersion=2022-11-2
+        next_url = response.links.get('next', {}).get('url')
+        body = response.json()
+        if 'ETag' in response.headers:
+            self._write_cache(request_url, {'etag': response.headers['ETag'], 'body': body, 'next': next_url})
+        return body, next_url
+
+    def _request(self, request_url, headers):
+        attempt = 0
+        while True:
+            response = self.session.get(request_url, headers=headers, timeout=self.timeout)
+            wait = self._retry_after(response, attempt)
+            if wait is None or attempt >= self.retries:
+                return response
+
+            attempt += 1
+            logger.warning('Request failed with %d, retrying in %.0f seconds: %s', response.status_code, wait,
+                           request_url)
+            time.sleep(wait)
+
+    def _retry_after(self, response, attempt):
+        """Returns the time to wait before a retry or None, if the request should not be retried."""
+        # https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api?apiVersion=2022-11-28
+        if response.status_code in (403, 429):
+            retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                wait = retry_after
+            elif response.headers.get('X-RateLimit-Remaining') == '0' and 'X-RateLimit-Reset' in response.headers:
+                wait = float(response.headers['X-RateLimit-Reset']) - time.time() + 1
+            else:
+                return None
+        elif response.status_code >= 500:
+            wait = 2 ** attempt
+        else:
+            return None
+
+        if wait > self.max_wait:
+            logger.error('Rate limit reset is too far in the future: %.0f seconds', wait)
+            return None
+        return max(wait, 0)
+
+    def _cache_file(self, request_url):
+        return os.path.join(self.cache_dir, hashlib.sha256(request_url.encode()).hexdigest() + '.json')
+
+    def _read_cache(self, request_url):
+        if not self.cache_dir or not os.path.isfile(self._cache_file(request_url)):
+            return None
+        try:
+            with open(self._cache_file(request_url), 'r') as file:
+                return json.load(file)
+        except ValueError:
+            logger.warning('Ignoring corrupt cache entry for: %s', request_url)
+            return None
+
+    def _write_cache(self, request_url, entry):
+        if not self.cache_dir:
+            return
+        cache_file = self._cache_file(request_url)
+        with open(cache_file + '.tmp', 'w') as file:
+            json.dump(entry, file)
+        os.replace(cache_file + '.tmp', cache_file)
+
+
+class MirrorCache:
+    """
+    Persistent cache of bare mirror repositories.
+
+    Mirrors are updated with 'git fetch' instead of cloning the full history on each run.
+    An index stores a hash of all refs per repository, to detect repositories which did not change since the
+    last run.
+    """
+
+    INDEX_FILE = 'index.json'
+    MIRROR_SUFFIX = '.git'
+
+    def __init__(self, cache_dir, max_size=None):
+        """
+        :param cache_dir: Directory for mirrors and index.
+        :param max_size: Maximum size of the cache in bytes. If exceeded, mirrors of repositories which do not
+                         exist upstream anymore are evicted, least recently seen first. None disables eviction.
+        """
+        self._cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(self._cache_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @property
+    def index_file(self):
+        return os.path.join(self.cache_dir, self.INDEX_FILE)
+
+    def mirror_dir(self, name):
+        return os.path.join(self.cache_dir, name + self.MIRROR_SUFFIX)
+
+    def update(self, name, url, timeout=None):
+        """
+        Create or update the mirror of a repository.
+
+        :return: Path to the mirror.
+        """
+        mirror_dir = self.mirror_dir(name)
+        if os.path.isdir(mirror_dir):
+            subprocess.check_call(['git', 'fetch', '--prune', '--quiet', url, '+refs/*:refs/*'], cwd=mirror_dir,
+                                  timeout=timeout)
+        else:
+            git.GitClone(url, mirror_dir, timeout=timeout, mirror=True).execute()
+        return mirror_dir
+
+    @staticmethod
+    def refs_hash(mirror_dir):
+        """Hash of all refs and the objects they point to."""
+        refs = subprocess.check_output(['git', 'for-each-ref', '--format=%(objectname) %(refname)'], cwd=mirror_dir)
+        return hashlib.sha256(refs).hexdigest()
+
+    def changed(self, name, refs_hash):
+        """Checks if the refs of a repository changed since the last commit()."""
+        with self._lock:
+            entry = self._index.get(name)
+        return entry is None or entry['refs'] != refs_hash
+
+    def commit(self, name, url, refs_hash):
+        """Record the refs of a bundled repository."""
+        with self._lock:
+            self._index[name] = {'url': url, 'refs': refs_hash, 'last_seen': time.time()}
+
+    def save(self):
+        """Write the index atomically."""
+        with self._lock:
+            data = json.dumps(self._index, indent=1, sort_keys=True)
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w') as file:
+            file.write(data)
+        os.replace(tmp_file, self.index_file)
+
+    def evict(self, existing_names):
+        """
+        Remove mirrors of repositories, which do not exist upstream anymore, until the cache fits into max_size.
+
+        :param existing_names: Names of all repositories, which exist upstream.
+        :return: List of evicted names.
+        """
+        if self.max_size is None:
+            return list()
+
+        with self._lock:
+            candidates = [name for name in self._index if name not in existing_names]
+            candidates.sort(key=lambda name: self._index[name]['last_seen'])
+
+        evicted = list()
+        size = _dir_size(self.cache_dir)
+        for name in candidates:
+            if size <= self.max_size:
+                break
+            mirror_dir = self.mirror_dir(name)
+            mirror_size = _dir_size(mirror_dir)
+            logger.info('Evicting mirror of deleted repository: %s (%d bytes)', name, mirror_size)
+            shutil.rmtree(mirror_dir, onerror=_on_rm_error)
+            size -= mirror_size
+            with self._lock:
+                del self._index[name]
+            evicted.append(name)
+
+        if evicted:
+            self.save()
+        return evicted
+
+    def _load_index(self):
+        if not os.path.isfile(self.index_file):
+            return dict()
+        with open(self.index_file, 'r') as file:
+            return json.load(file)
+
 
 class GithubBundleCliCommand(command.CliCommand):
 
@@ -84,6 +394,15 @@ class GithubBundleCliCommand(command.CliCommand):
     def _add_arguments(cls, parser):
         parser.add_argument(command.Argument.USER.long_arg, help='Username of the Github account.', required=True)
         parser.add_argument(command.Argument.DST_DIR.long_arg, help='Destination directory.', required=True)
+        parser.add_argument(command.Argument.WORKERS.long_arg, type=int, default=1,
+                            help='Number of repositories to clone and bundle concurrently.')
+        parser.add_argument(command.Argument.TIMEOUT.long_arg, type=float,
+                            help='Timeout in seconds to clone and bundle a single repository.')
+        parser.add_argument(command.Argument.CACHE_DIR.long_arg,
+                            help='Directory for persistent mirrors and API responses, '
+                                 'only changed repositories are bundled.')
+        parser.add_argument(command.Argument.CACHE_SIZE.long_arg, type=int,
+                            help='Maximum cache size in MiB, exceeding mirrors of deleted repositories are evicted.')
 
     @classmethod
     def _help(cls):
@@ -95,7 +414,59 @@ class GithubBundleCliCommand(command.CliCommand):
 
     @classmethod
     def _instance(cls, args):
-        return GithubBundle(command.Argument.USER.get_value(args), command.Argument.DST_DIR.get_value(args))
+        instance = GithubBundle(command.Argument.USER.get_value(args), command.Argument.DST_DIR.get_value(args))
+        if command.Argument.WORKERS.has_value(args):
+            instance.workers = command.Argument.WORKERS.get_value(args)
+        if command.Argument.TIMEOUT.has_value(args):
+            instance.timeout = command.Argument.TIMEOUT.get_value(args)
+        if command.Argument.CACHE_DIR.has_value(args):
+            max_size = None
+            if command.Argument.CACHE_SIZE.has_value(args):
+                max_size = command.Argument.CACHE_SIZE.get_value(args) * 1024 * 1024
+            instance.cache = MirrorCache(command.Argument.CACHE_DIR.get_value(args), max_size)
+        # The token is passed by environment to not appear in the process list or a batch file.
+        cache_dir = os.path.join(instance.cache.cache_dir, 'api') if instance.cache else None
+        instance.listing = RepositoryListing(cache_dir=cache_dir, token=os.environ.get(RepositoryListing.TOKEN_ENV))
+        return instance
+
+
+def _parse_retry_after(value):
+    """
+    Parse a Retry-After header, which is either seconds or a HTTP date.
+
+    :return: Seconds to wait or None, if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        logger.warning('Ignoring invalid Retry-After header: %s', value)
+        return None
+
+
+def _remaining(deadline):
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError('Timeout exceeded.')
+    return remaining
+
+
+def _dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for fname in files:
+            try:
+                size += os.lstat(os.path.join(root, fname)).st_size
+            except OSError:
+                pass
+    return size
 
 
 def _on_rm_error(_, path, exc_info):
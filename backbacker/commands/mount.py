@@ -1,6 +1,5 @@
 import logging
 import os
-from subprocess import call
 
 from backbacker import command
 
@@ -35,15 +34,13 @@ class MountSamba(command.SystemCommand):
     def dst(self, value):
         self._dst = os.path.expanduser(value)
 
-    def _execute_command(self):
+    def _command_line(self):
         if not os.access(self.cfg, os.R_OK):
             raise PermissionError('No read access to: {}'.format(self.cfg))
         if not os.access(self.dst, os.W_OK):
             raise PermissionError('No write access to: {}'.format(self.dst))
 
-        cmd = [self.cmd, '-t', 'cifs', '-o', 'credentials={}'.format(self.cfg), self.url, self.dst]
-        if call(cmd) != 0:
-            raise RuntimeError('Error calling: {}'.format(' '.join(cmd)))
+        return [self.cmd, '-t', 'cifs', '-o', 'credentials={}'.format(self.cfg), self.url, self.dst]
 
 
 class UMount(command.SystemCommand):
@@ -61,13 +58,11 @@ class UMount(command.SystemCommand):
     def dir(self, value):
         self._dir = value
 
-    def _execute_command(self):
+    def _command_line(self):
         if not os.access(self.dir, os.W_OK):
             raise PermissionError('No write access to: {}'.format(self.dir))
 
-        cmd = [self.cmd, self.dir]
-        if call(cmd) != 0:
-            raise RuntimeError('Error calling: {}'.format(' '.join(cmd)))
+        return [self.cmd, self.dir]
 
 
 class MountSambaCliCommand(command.CliCommand):
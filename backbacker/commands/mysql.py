@@ -1,8 +1,12 @@
+import contextlib
 import logging
 import os
 import subprocess
+import tempfile
 
 from backbacker import command
+from backbacker.commands import compress
+from backbacker.commands import db_dump
 
 
 __author__ = 'Christof Pieloth'
@@ -11,9 +15,7 @@ logger = logging.getLogger(__name__)
 
 
 class MySqlDumpGZip(command.SystemCommand):
-    """Does a MySQL database dump and gzips the output."""
-
-    CMD_GZIP = 'gzip'
+    """Does a MySQL database dump and compresses the output."""
 
     def __init__(self):
         super().__init__('mysqldump')
@@ -21,6 +23,8 @@ class MySqlDumpGZip(command.SystemCommand):
         self.db_name = ''
         self.db_user = ''
         self.db_passwd = ''
+        self.compressor = compress.create_compressor('gzip')
+        self.stats = None
 
     @property
     def dst_dir(self):
@@ -30,21 +34,85 @@ class MySqlDumpGZip(command.SystemCommand):
     def dst_dir(self, value):
         self._dst_dir = os.path.expanduser(value)
 
+    @property
+    def dst_file(self):
+        return os.path.join(self.dst_dir, self.db_name + '.sql' + self.compressor.extension)
+
     def is_available(self):
-        success = super().is_available()
-        # TODO(cpieloth): Use command of compress module.
-        success = success and command.SystemCommand.check_version(MySqlDumpGZip.CMD_GZIP)
-        return success
+        return super().is_available() and self.compressor.is_available()
 
     def _execute_command(self):
         if not os.access(self.dst_dir, os.W_OK):
             raise PermissionError('No write access to: {}'.format(self.dst_dir))
-        dest = os.path.join(self.dst_dir, self.db_name + '.sql.gz')
 
-        mysqldump = 'mysqldump -u ' + self.db_user + ' --password=' + self.db_passwd + ' ' + self.db_name
-        gzip = 'gzip > ' + dest
+        with _option_file(self.db_user, self.db_passwd) as defaults:
+            # --defaults-extra-file must be the first option
+            cmd = [self.cmd, defaults, self.db_name]
+            logger.info('execute: %s | %s > %s', cmd, self.compressor.name, self.dst_file)
+            self.stats = compress.pipe_to_file(cmd, self.dst_file, self.compressor)
+
+        logger.info('Dumped %s: %s', self.db_name, self.stats)
 
-        subprocess.check_call([mysqldump + ' | ' + gzip], shell=True)
+
+class MySqlDumpAll(db_dump.MultiDatabaseDump):
+    """Dumps all or matching MySQL databases concurrently, largest first, and compresses the output."""
+
+    SYSTEM_DATABASES = ('information_schema', 'performance_schema', 'mysql', 'sys')
+
+    LIST_QUERY = ('SELECT s.schema_name, COALESCE(SUM(t.data_length + t.index_length), 0) '
+                  'FROM information_schema.schemata s '
+                  'LEFT JOIN information_schema.tables t ON t.table_schema = s.schema_name '
+                  'GROUP BY s.schema_name')
+
+    def __init__(self):
+        super().__init__('mysql', 'mysql')
+        self.compressor_name = 'gzip'
+        self.threads = 1
+        self.compress_level = None
+
+    def is_available(self):
+        return super().is_available() and self._create_dump('').is_available()
+
+    def list_databases(self):
+        with _option_file(self.db_user, self.db_passwd) as defaults:
+            cmd = [self.cmd, defaults, '-N', '-B', '-e', self.LIST_QUERY]
+            logger.info('execute: %s', cmd)
+            output = subprocess.check_output(cmd, universal_newlines=True)
+
+        databases = list()
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            name, size = line.split('\t')
+            if name not in self.SYSTEM_DATABASES:
+                databases.append((name, int(size)))
+        return databases
+
+    def _create_dump(self, db_name):
+        dump = MySqlDumpGZip()
+        dump.dst_dir = self.dst_dir
+        dump.db_name = db_name
+        dump.db_user = self.db_user
+        dump.db_passwd = self.db_passwd
+        dump.compressor = compress.create_compressor(self.compressor_name, self.threads, self.compress_level)
+        return dump
+
+
+@contextlib.contextmanager
+def _option_file(user, passwd):
+    """
+    Credentials are passed by an option file, so they do not appear in the process list.
+
+    :return: The --defaults-extra-file option for the temporary option file.
+    """
+    with tempfile.NamedTemporaryFile('w', prefix='mysql', suffix='.cnf') as cnf:
+        cnf.write('[client]\nuser={}\npassword={}\n'.format(_quote(user), _quote(passwd)))
+        cnf.flush()
+        yield '--defaults-extra-file={}'.format(cnf.name)
+
+
+def _quote(value):
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
 
 
 class MySqlDumpGzipCliCommand(command.CliCommand):
@@ -55,6 +123,12 @@ class MySqlDumpGzipCliCommand(command.CliCommand):
         parser.add_argument(command.Argument.DB_NAME.long_arg, required=True, help='Database name to dump.')
         parser.add_argument(command.Argument.DB_USER.long_arg, required=True, help='Database user.')
         parser.add_argument(command.Argument.DB_PASSWD.long_arg, required=True, help='Password for database user.')
+        parser.add_argument(command.Argument.COMPRESSOR.long_arg, choices=compress.COMPRESSORS, default='gzip',
+                            help='Compressor for the dump.')
+        parser.add_argument(command.Argument.THREADS.long_arg, type=int, default=1,
+                            help='Number of compression threads, if supported by the compressor.')
+        parser.add_argument(command.Argument.COMPRESS_LEVEL.long_arg, type=int,
+                            help='Compression level, default depends on the compressor.')
 
     @classmethod
     def _name(cls):
@@ -71,4 +145,36 @@ class MySqlDumpGzipCliCommand(command.CliCommand):
         instance.db_name = command.Argument.DB_NAME.get_value(args)
         instance.db_user = command.Argument.DB_USER.get_value(args)
         instance.db_passwd = command.Argument.DB_PASSWD.get_value(args)
+        instance.compressor = compress.create_compressor(command.Argument.COMPRESSOR.get_value(args),
+                                                         command.Argument.THREADS.get_value(args),
+                                                         command.Argument.COMPRESS_LEVEL.get_value(args))
+        return instance
+
+
+class MySqlDumpAllCliCommand(db_dump.MultiDatabaseDumpCliCommand):
+
+    @classmethod
+    def _add_arguments(cls, parser):
+        super()._add_arguments(parser)
+        parser.add_argument(command.Argument.COMPRESSOR.long_arg, choices=compress.COMPRESSORS, default='gzip',
+                            help='Compressor for the dumps.')
+        parser.add_argument(command.Argument.THREADS.long_arg, type=int, default=1,
+                            help='Number of compression threads per dump, if supported by the compressor.')
+        parser.add_argument(command.Argument.COMPRESS_LEVEL.long_arg, type=int,
+                            help='Compression level, default depends on the compressor.')
+
+    @classmethod
+    def _name(cls):
+        return 'mysqldump_all'
+
+    @classmethod
+    def _help(cls):
+        return MySqlDumpAll.__doc__
+
+    @classmethod
+    def _instance(cls, args):
+        instance = cls._init_instance(MySqlDumpAll(), args)
+        instance.compressor_name = command.Argument.COMPRESSOR.get_value(args)
+        instance.threads = command.Argument.THREADS.get_value(args)
+        instance.compress_level = command.Argument.COMPRESS_LEVEL.get_value(args)
         return instance
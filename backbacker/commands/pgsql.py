@@ -1,8 +1,12 @@
 import logging
 import os
+import shutil
 import subprocess
+import tarfile
 
 from backbacker import command
+from backbacker.commands import compress
+from backbacker.commands import db_dump
 
 
 __author__ = 'Christof Pieloth'
@@ -11,7 +15,7 @@ logger = logging.getLogger(__name__)
 
 
 class PgSqlDumpGZip(command.SystemCommand):
-    """Does a PostgreSQL database dump and gzips the output."""
+    """Does a PostgreSQL database dump and compresses the output, by pg_dump or by a compressor."""
 
     def __init__(self):
         super().__init__('pg_dump')
@@ -21,6 +25,11 @@ class PgSqlDumpGZip(command.SystemCommand):
         self.db_passwd = ''
         self.db_schema = ''
         self.db_table = ''
+        self._jobs = 1
+        self._compress_level = 9
+        self.pack = False
+        self.compressor = None
+        self.stats = None
 
     @property
     def dst_dir(self):
@@ -30,26 +39,176 @@ class PgSqlDumpGZip(command.SystemCommand):
     def dst_dir(self, value):
         self._dst_dir = os.path.expanduser(value)
 
+    @property
+    def jobs(self):
+        """Number of parallel jobs. More than one job uses the directory format, one file per table."""
+        return self._jobs
+
+    @jobs.setter
+    def jobs(self, value):
+        try:
+            self._jobs = int(value)
+        except ValueError:
+            raise ValueError('Could not cast "jobs" to int: {}'.format(value))
+
+        if self._jobs <= 0:
+            raise ValueError('Invalid value of "jobs". Must be greater than 0, but it is: {}'.format(value))
+
+    @property
+    def compress_level(self):
+        """Compression level of pg_dump, 0 (none) to 9 (best, slowest)."""
+        return self._compress_level
+
+    @compress_level.setter
+    def compress_level(self, value):
+        try:
+            self._compress_level = int(value)
+        except ValueError:
+            raise ValueError('Could not cast "compress_level" to int: {}'.format(value))
+
+        if not 0 <= self._compress_level <= 9:
+            raise ValueError('Invalid value of "compress_level". Must be in [0, 9], but it is: {}'.format(value))
+
+    @property
+    def dst_file(self):
+        """
+        Destination of the dump: a file in plain format, a directory or a tar file in directory format.
+        With a compressor, pg_dump does not compress and the directory format is always packed into a compressed tar.
+        """
+        if self.jobs == 1:
+            extension = self.compressor.extension if self.compressor else '.gz'
+            return os.path.join(self.dst_dir, self.db_name + '.sql' + extension)
+        dump_dir = os.path.join(self.dst_dir, self.db_name + '.dir')
+        if self.compressor:
+            return dump_dir + '.tar' + self.compressor.extension
+        return dump_dir + '.tar' if self.pack else dump_dir
+
+    def is_available(self):
+        return super().is_available() and (self.compressor is None or self.compressor.is_available())
+
     def _execute_command(self):
         if not os.access(self.dst_dir, os.W_OK):
             raise PermissionError('No write access to: {}'.format(self.dst_dir))
-        dest = os.path.join(self.dst_dir, self.db_name + '.sql.gz')
 
-        # auth
-        pg_dump = 'PGPASSWORD="' + self.db_passwd + '" pg_dump -U ' + self.db_user
+        # auth, password is passed by environment to not appear in the process list
+        env = dict(os.environ, PGPASSWORD=self.db_passwd)
+        pg_dump = [self.cmd, '--no-password', '-U', self.db_user]
         # schema & table
         if self.db_schema != '':
-            pg_dump += ' -n ' + self.db_schema
+            pg_dump.extend(['-n', self.db_schema])
         if self.db_table != '':
-            pg_dump += ' -t ' + self.db_table
+            pg_dump.extend(['-t', self.db_table])
         # compression
-        pg_dump += ' -Z 9'
-        # database and output
-        pg_dump += ' ' + self.db_name
-        pg_dump += ' > ' + dest
-        logger.info(pg_dump)
+        pg_dump.extend(['-Z', '0' if self.compressor else str(self.compress_level)])
+
+        if self.jobs == 1 and self.compressor:
+            pg_dump.append(self.db_name)
+            logger.info('execute: %s | %s > %s', pg_dump, self.compressor.name, self.dst_file)
+            self.stats = compress.pipe_to_file(pg_dump, self.dst_file, self.compressor, env=env)
+            logger.info('Dumped %s: %s', self.db_name, self.stats)
+            return
+
+        if self.jobs == 1:
+            pg_dump.extend(['-f', self.dst_file, self.db_name])
+            logger.info('execute: %s', pg_dump)
+            subprocess.check_call(pg_dump, env=env)
+            return
+
+        # pg_dump requires a new directory. A failed dump must not destroy the dump of a previous run,
+        # hence it is written to a partial directory, which replaces the previous dump on success.
+        dump_dir = os.path.join(self.dst_dir, self.db_name + '.dir')
+        part_dir = dump_dir + '.part'
+        if os.path.exists(part_dir):
+            logger.info('Removing partial dump: %s', part_dir)
+            shutil.rmtree(part_dir)
+        pg_dump.extend(['-F', 'd', '-j', str(self.jobs), '-f', part_dir, self.db_name])
+        logger.info('execute: %s', pg_dump)
+        try:
+            subprocess.check_call(pg_dump, env=env)
+        except BaseException:
+            shutil.rmtree(part_dir, ignore_errors=True)
+            raise
+
+        if self.pack or self.compressor:
+            self._pack(part_dir, dump_dir)
+        else:
+            self._replace_dir(part_dir, dump_dir)
+
+    def _pack(self, part_dir, dump_dir):
+        # Without a compressor the table files are already compressed, therefore the tar file is not.
+        codec = self.compressor if self.compressor else compress.NoneCompressor()
+        dest = dump_dir + '.tar' + codec.extension
+        tmp_dest = dest + '.part'
+        try:
+            with open(tmp_dest, 'wb') as file, codec.open(file) as writer:
+                with tarfile.open(fileobj=writer, mode='w|') as tar:
+                    tar.add(part_dir, arcname=os.path.basename(dump_dir))
+            os.replace(tmp_dest, dest)
+        except Exception as ex:
+            if os.path.exists(tmp_dest):
+                os.remove(tmp_dest)
+            raise RuntimeError('Could not pack: {}'.format(dump_dir)) from ex
+        shutil.rmtree(part_dir)
+
+    @staticmethod
+    def _replace_dir(part_dir, dump_dir):
+        # A non-empty directory can not be replaced atomically, the previous dump is moved aside until then.
+        old_dir = dump_dir + '.old'
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+        if os.path.exists(dump_dir):
+            os.rename(dump_dir, old_dir)
+        os.rename(part_dir, dump_dir)
+        if os.path.exists(old_dir):
+            logger.info('Removing previous dump: %s', old_dir)
+            shutil.rmtree(old_dir)
+
+
+class PgSqlDumpAll(db_dump.MultiDatabaseDump):
+    """Dumps all or matching PostgreSQL databases concurrently, largest first, and compresses the output."""
+
+    LIST_QUERY = ('SELECT datname, pg_database_size(datname) FROM pg_database '
+                  'WHERE datallowconn AND NOT datistemplate')
 
-        subprocess.check_call([pg_dump], shell=True)
+    def __init__(self):
+        super().__init__('psql', 'pgsql')
+        self.jobs = 1
+        self.compress_level = None
+        self.pack = False
+        self.compressor_name = None
+        self.threads = 1
+
+    def is_available(self):
+        return super().is_available() and self._create_dump('').is_available()
+
+    def list_databases(self):
+        env = dict(os.environ, PGPASSWORD=self.db_passwd)
+        cmd = [self.cmd, '--no-password', '-U', self.db_user, '-d', 'postgres', '-A', '-t', '-F', '|',
+               '-c', self.LIST_QUERY]
+        logger.info('execute: %s', cmd)
+        output = subprocess.check_output(cmd, env=env, universal_newlines=True)
+
+        databases = list()
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            name, size = line.rsplit('|', 1)
+            databases.append((name, int(size)))
+        return databases
+
+    def _create_dump(self, db_name):
+        dump = PgSqlDumpGZip()
+        dump.dst_dir = self.dst_dir
+        dump.db_name = db_name
+        dump.db_user = self.db_user
+        dump.db_passwd = self.db_passwd
+        dump.jobs = self.jobs
+        dump.pack = self.pack
+        if self.compressor_name:
+            dump.compressor = compress.create_compressor(self.compressor_name, self.threads, self.compress_level)
+        elif self.compress_level is not None:
+            dump.compress_level = self.compress_level
+        return dump
 
 
 class PgSqlDumpGzipCliCommand(command.CliCommand):
@@ -63,6 +222,17 @@ class PgSqlDumpGzipCliCommand(command.CliCommand):
         parser.add_argument(command.Argument.DB_PASSWD.long_arg, help='Password for database user.', required=True)
         parser.add_argument(command.Argument.DB_SCHEMA.long_arg, help='Database schema.')
         parser.add_argument(command.Argument.DB_TABLE.long_arg, help='Database table.')
+        parser.add_argument(command.Argument.JOBS.long_arg, type=int, default=1,
+                            help='Number of tables to dump in parallel, uses the directory format if greater 1.')
+        parser.add_argument(command.Argument.COMPRESS_LEVEL.long_arg, type=int,
+                            help='Compression level, pg_dump: 0 (none) to 9 (best, slowest), default is 9. '
+                                 'Default of a compressor depends on the compressor.')
+        parser.add_argument(command.Argument.PACK.long_arg, action='store_true',
+                            help='Pack the dump directory into a tar file.')
+        parser.add_argument(command.Argument.COMPRESSOR.long_arg, choices=compress.COMPRESSORS,
+                            help='Compressor for the dump instead of the compression of pg_dump.')
+        parser.add_argument(command.Argument.THREADS.long_arg, type=int, default=1,
+                            help='Number of compression threads, if supported by the compressor.')
 
     @classmethod
     def _name(cls):
@@ -84,5 +254,52 @@ class PgSqlDumpGzipCliCommand(command.CliCommand):
             instance.db_schema = command.Argument.DB_SCHEMA.get_value(args)
         if command.Argument.DB_TABLE.has_value(args):
             instance.db_table = command.Argument.DB_TABLE.get_value(args)
+        if command.Argument.JOBS.has_value(args):
+            instance.jobs = command.Argument.JOBS.get_value(args)
+        instance.pack = command.Argument.PACK.get_value(args)
+        if command.Argument.COMPRESSOR.get_value(args):
+            instance.compressor = compress.create_compressor(command.Argument.COMPRESSOR.get_value(args),
+                                                             command.Argument.THREADS.get_value(args),
+                                                             command.Argument.COMPRESS_LEVEL.get_value(args))
+        elif command.Argument.COMPRESS_LEVEL.get_value(args) is not None:
+            instance.compress_level = command.Argument.COMPRESS_LEVEL.get_value(args)
+
+        return instance
+
+
+class PgSqlDumpAllCliCommand(db_dump.MultiDatabaseDumpCliCommand):
+
+    @classmethod
+    def _add_arguments(cls, parser):
+        super()._add_arguments(parser)
+        parser.add_argument(command.Argument.JOBS.long_arg, type=int, default=1,
+                            help='Number of tables to dump in parallel per database, uses the directory format '
+                                 'if greater 1.')
+        parser.add_argument(command.Argument.COMPRESS_LEVEL.long_arg, type=int,
+                            help='Compression level, pg_dump: 0 (none) to 9 (best, slowest), default is 9. '
+                                 'Default of a compressor depends on the compressor.')
+        parser.add_argument(command.Argument.PACK.long_arg, action='store_true',
+                            help='Pack the dump directories into tar files.')
+        parser.add_argument(command.Argument.COMPRESSOR.long_arg, choices=compress.COMPRESSORS,
+                            help='Compressor for the dumps instead of the compression of pg_dump.')
+        parser.add_argument(command.Argument.THREADS.long_arg, type=int, default=1,
+                            help='Number of compression threads per dump, if supported by the compressor.')
+
+    @classmethod
+    def _name(cls):
+        return 'pgsqldump_all'
 
+    @classmethod
+    def _help(cls):
+        return PgSqlDumpAll.__doc__
+
+    @classmethod
+    def _instance(cls, args):
+        instance = cls._init_instance(PgSqlDumpAll(), args)
+        if command.Argument.JOBS.has_value(args):
+            instance.jobs = command.Argument.JOBS.get_value(args)
+        instance.pack = command.Argument.PACK.get_value(args)
+        instance.compressor_name = command.Argument.COMPRESSOR.get_value(args)
+        instance.threads = command.Argument.THREADS.get_value(args)
+        instance.compress_level = command.Argument.COMPRESS_LEVEL.get_value(args)
         return instance
@@ -0,0 +1,94 @@
+"""
+Restore of the archives of the gzip command.
+
+The type of the archive is detected by the file name:
+
+* <name>.journal.json: segmented archive, single paths are read from the segments which contain them.
+* <name>.manifest.json.gz: chain of a full archive and incremental archives.
+* Any other file: a single tar archive, e.g. <name>.tar.zst. Single paths are restored, if the archive has a
+  seek index <name>.tar.gz.index.json.gz. Only the gzip blocks of the paths are decompressed.
+"""
+
+import logging
+import os
+
+from backbacker import command
+from backbacker.commands import compress
+
+
+__author__ = 'Christof Pieloth'
+
+logger = logging.getLogger(__name__)
+
+
+class Restore(command.Command):
+    """Restores an archive of the gzip command, all of it or single paths of a segmented or indexed archive."""
+
+    def __init__(self, fname, dst_dir, paths=None):
+        """
+        :param fname: Journal, manifest or archive file.
+        :param dst_dir: Destination folder.
+        :param paths: Paths relative to the archived folder to restore, None to restore all.
+        """
+        super().__init__()
+        self.fname = os.path.expanduser(fname)
+        self.dst_dir = os.path.expanduser(dst_dir)
+        self.paths = paths if paths else list()
+
+    def execute(self):
+        if not os.access(self.fname, os.R_OK):
+            raise PermissionError('No read access to: {}'.format(self.fname))
+        os.makedirs(self.dst_dir, exist_ok=True)
+
+        if self.fname.endswith(compress.SegmentJournal.SUFFIX):
+            journal = compress.SegmentJournal.load(self.fname)
+            if self.paths:
+                count = journal.extract(self.paths, self.dst_dir)
+                logger.info('Restored %d entries to: %s', count, self.dst_dir)
+            else:
+                journal.restore(self.dst_dir)
+                logger.info('Restored %d segments to: %s', len(journal.segments), self.dst_dir)
+            return
+
+        if self.paths and not os.path.isfile(compress.SeekIndex.index_file(self.fname)):
+            raise ValueError('Restoring single paths requires a segmented archive or a seek index: {}'.format(
+                self.fname))
+        if self.paths:
+            index = compress.SeekIndex.load(self.fname)
+            rels, found = index.select(self.paths)
+            missing = [path for path in self.paths if path not in found]
+            if missing:
+                raise FileNotFoundError('Not found in archive: {}'.format(', '.join(missing)))
+            count = index.extract(self.fname, rels, self.dst_dir)
+            logger.info('Restored %d entries to: %s', count, self.dst_dir)
+        elif self.fname.endswith(compress.ArchiveManifest.SUFFIX):
+            manifest = compress.ArchiveManifest.load(self.fname)
+            manifest.restore(self.dst_dir)
+            logger.info('Restored %d archives to: %s', len(manifest.archives), self.dst_dir)
+        else:
+            compress.extract_archive(self.fname, self.dst_dir)
+            logger.info('Restored archive to: %s', self.dst_dir)
+
+
+class RestoreCliCommand(command.CliCommand):
+
+    @classmethod
+    def _add_arguments(cls, parser):
+        parser.add_argument(command.Argument.FILE.long_arg, required=True,
+                            help='Journal of a segmented archive, manifest of an incremental archive or an archive.')
+        parser.add_argument(command.Argument.DST_DIR.long_arg, required=True, help='Destination folder.')
+        parser.add_argument(command.Argument.PATH.long_arg, action='append',
+                            help='Path relative to the archived folder to restore, can be repeated.')
+
+    @classmethod
+    def _name(cls):
+        return 'restore'
+
+    @classmethod
+    def _help(cls):
+        return Restore.__doc__
+
+    @classmethod
+    def _instance(cls, args):
+        return Restore(command.Argument.FILE.get_value(args), command.Argument.DST_DIR.get_value(args),
+                       command.Argument.PATH.get_value(args))
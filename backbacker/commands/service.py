@@ -1,5 +1,4 @@
 import logging
-import subprocess
 
 from backbacker import command
 
@@ -19,14 +18,14 @@ class Service(command.SystemCommand):
     def command(self):
         return self._command
 
-    def _execute_command(self):
+    def _command_line(self):
         if not self.service:
             raise ValueError('Empty service name.')
 
         if not self.command == 'start' and not self.command == 'stop':
             raise ValueError('Bad command: {}'.format(self.command))
 
-        subprocess.check_call([self.cmd, self.service, self.command], stdout=subprocess.PIPE)
+        return [self.cmd, self.service, self.command]
 
 
 class ServiceStart(Service):
@@ -16,14 +16,20 @@ class Config:
     def __init__(self, initialized=True):
         if not initialized:
             self._log = _CfgLogging()
+            self._tools = _CfgTools()
 
     def parse_cfg(self, parser):
         self.log.parse_cfg(parser)
+        self.tools.parse_cfg(parser)
 
     @property
     def log(self):
         return self._log
 
+    @property
+    def tools(self):
+        return self._tools
+
     @classmethod
     def read_config(cls, fname):
         """Reads and creates a config from a file."""
@@ -86,3 +92,26 @@ class _CfgLogging:
     def file(self, value):
         if value:
             self._file = os.path.expanduser(value)
+
+
+class _CfgTools:
+
+    CFG_SECTION = 'tools'
+
+    def __init__(self):
+        self._cache_file = None
+        self.cache_ttl = 24 * 3600
+
+    def parse_cfg(self, parser, section=CFG_SECTION):
+        self.cache_file = parser.get(section, 'cache_file', fallback=self.cache_file)
+        self.cache_ttl = parser.getint(section, 'cache_ttl', fallback=self.cache_ttl)
+
+    @property
+    def cache_file(self):
+        """File to persist the availability and versions of external programs."""
+        return self._cache_file
+
+    @cache_file.setter
+    def cache_file(self, value):
+        if value:
+            self._cache_file = os.path.expanduser(value)
@@ -0,0 +1,256 @@
+"""
+Timing and resource usage of command executions.
+
+Each execute() of a Command is measured: wall time, CPU time of the process and of its terminated child
+processes and peak RSS of the child processes.
+A measurement is logged with its values as measurement_* extra attributes and added to the collector.
+
+Within output_measured(), e.g. for a report or a textfile, the bytes added to dst_dir are measured for top-level
+commands, which requires a scan of dst_dir before and after. It is the net change of dst_dir, i.e. files deleted
+by a mirror reduce it, and it includes the output of concurrent commands with the same dst_dir.
+
+The resource usage is process-wide. If commands run concurrently, e.g. batch --jobs, their CPU times overlap.
+"""
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+__author__ = 'Christof Pieloth'
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class Measurement:
+    """Timing and resource usage of a single execute() call."""
+
+    def __init__(self, command, job=None, depth=0):
+        """
+        :param command: Name of the command class.
+        :param job: Name of the enclosing job, e.g. the label or line of a batch file.
+        :param depth: Nesting level, 0 for a command which is not executed by another command.
+        """
+        self.command = command
+        self.job = job
+        self.depth = depth
+        self.started = time.time()
+        self.seconds = 0.0
+        self.cpu_user = 0.0
+        self.cpu_system = 0.0
+        self.children_user = 0.0
+        self.children_system = 0.0
+        self.children_max_rss_kb = None
+        self.bytes_written = None
+        self.error = None
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        return '{} {} in {:.1f} s, cpu {:.1f} s, children cpu {:.1f} s, bytes written {}'.format(
+            self.command, 'failed' if self.error else 'finished', self.seconds, self.cpu_user + self.cpu_system,
+            self.children_user + self.children_system, self.bytes_written)
+
+
+class Collector:
+    """Thread-safe collection of measurements."""
+
+    def __init__(self, measure_output=False):
+        """
+        :param measure_output: Measure the bytes added to dst_dir by top-level commands,
+                               requires a scan of dst_dir before and after.
+        """
+        self.measure_output = measure_output
+        self._lock = threading.Lock()
+        self._records = list()
+
+    def add(self, measurement):
+        with self._lock:
+            self._records.append(measurement)
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def write_report(self, fname, **fields):
+        """
+        Write all measurements to a JSON file.
+
+        :param fname: Path of the report.
+        :param fields: Additional top-level fields of the report.
+        """
+        report = dict(fields)
+        report['commands'] = [record.as_dict() for record in self.records()]
+        tmp_file = fname + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(report, file, indent=1)
+        os.replace(tmp_file, fname)
+
+
+collector = Collector()
+
+
+@contextlib.contextmanager
+def output_measured():
+    """Measure the bytes added to dst_dir by top-level commands, e.g. if a report is requested."""
+    previous = collector.measure_output
+    collector.measure_output = True
+    try:
+        yield
+    finally:
+        collector.measure_output = previous
+
+
+@contextlib.contextmanager
+def job(name):
+    """
+    Name the measurements of the current thread, e.g. with a label of a batch file.
+
+    :param name: Name of the job.
+    """
+    previous = getattr(_local, 'job', None)
+    _local.job = name
+    try:
+        yield
+    finally:
+        _local.job = previous
+
+
+def instrument(execute):
+    """
+    Wrap an execute() method to measure it.
+    A re-entrant call on the same instance, e.g. by super().execute(), is not measured twice.
+
+    :param execute: execute() method of a command.
+    :return: Wrapped method.
+    """
+    @functools.wraps(execute)
+    def wrapper(self, *args, **kwargs):
+        active = _active()
+        if id(self) in active:
+            return execute(self, *args, **kwargs)
+
+        active.add(id(self))
+        measurement = Measurement(type(self).__name__, getattr(_local, 'job', None), len(active) - 1)
+        start = _snapshot(self, measurement.depth)
+        try:
+            return execute(self, *args, **kwargs)
+        except BaseException as ex:
+            measurement.error = str(ex) or type(ex).__name__
+            raise
+        finally:
+            active.discard(id(self))
+            _finish(self, measurement, start)
+
+    return wrapper
+
+
+def instrument_async(execute_async):
+    """
+    Wrap a coroutine method to measure it, e.g. an asyncio subprocess of a command.
+    Concurrent coroutines share a thread, hence their measurements are not nested.
+
+    :param execute_async: Coroutine method of a command.
+    :return: Wrapped coroutine method.
+    """
+    @functools.wraps(execute_async)
+    async def wrapper(self, *args, **kwargs):
+        measurement = Measurement(type(self).__name__, getattr(_local, 'job', None))
+        start = _snapshot(self, measurement.depth)
+        try:
+            return await execute_async(self, *args, **kwargs)
+        except BaseException as ex:
+            measurement.error = str(ex) or type(ex).__name__
+            raise
+        finally:
+            _finish(self, measurement, start)
+
+    return wrapper
+
+
+def pop_last_measurement():
+    """
+    Return and reset the last finished measurement of a top-level command in the current thread.
+
+    :return: Measurement or None.
+    """
+    measurement = getattr(_local, 'last', None)
+    _local.last = None
+    return measurement
+
+
+def _active():
+    if not hasattr(_local, 'active'):
+        _local.active = set()
+    return _local.active
+
+
+def _snapshot(command, depth):
+    usage = None
+    if resource is not None:
+        usage = (resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN))
+    # Nested commands write into the output of the top-level command, scanning it again is not worth it.
+    return time.monotonic(), usage, _output_size(command) if depth == 0 else None
+
+
+def _finish(command, measurement, start):
+    start_time, start_usage, start_size = start
+    measurement.seconds = time.monotonic() - start_time
+    if start_usage is not None:
+        usage_self = resource.getrusage(resource.RUSAGE_SELF)
+        usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        measurement.cpu_user = usage_self.ru_utime - start_usage[0].ru_utime
+        measurement.cpu_system = usage_self.ru_stime - start_usage[0].ru_stime
+        measurement.children_user = usage_children.ru_utime - start_usage[1].ru_utime
+        measurement.children_system = usage_children.ru_stime - start_usage[1].ru_stime
+        measurement.children_max_rss_kb = usage_children.ru_maxrss
+    if start_size is not None:
+        end_size = _output_size(command)
+        if end_size is not None:
+            measurement.bytes_written = end_size - start_size
+
+    collector.add(measurement)
+    if measurement.depth == 0:
+        _local.last = measurement
+    logger.info('%s', measurement,
+                extra={'measurement_' + key: value for key, value in measurement.as_dict().items()})
+
+
+def _output_size(command):
+    if not collector.measure_output:
+        return None
+    dst_dir = getattr(command, 'dst_dir', None)
+    if not isinstance(dst_dir, str) or not os.path.isdir(dst_dir):
+        return None
+    try:
+        return _tree_size(dst_dir)
+    except OSError:
+        return None
+
+
+def _tree_size(path):
+    size = 0
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    size += entry.stat(follow_symlinks=False).st_size
+    return size
@@ -0,0 +1,117 @@
+"""
+Export of command results as textfile for the Prometheus node_exporter.
+
+The textfile collector of node_exporter reads all *.prom files of a folder. The file is written to a temporary
+file and renamed, so a scrape never sees a partial file. The last success timestamp of a command is carried
+forward from the previous file, if the command failed or was skipped.
+"""
+
+import os
+import re
+import time
+
+__author__ = 'Christof Pieloth'
+
+PREFIX = 'backbacker_command_'
+
+# Exit status of a command, which was not executed, e.g. because a dependency failed.
+SKIPPED = -1
+
+_METRICS = [
+    ('duration_seconds', 'Duration of the last run in seconds.'),
+    ('exit_status', 'Exit status of the last run, 0 on success, -1 if it was skipped.'),
+    ('last_success_timestamp_seconds', 'Unix time of the last successful run.'),
+    ('output_bytes', 'Bytes written to the destination directory by the last run.'),
+]
+
+_LAST_SUCCESS = re.compile(r'^' + PREFIX + r'last_success_timestamp_seconds\{(.*)\} (\S+)$')
+
+
+class Result:
+    """Result of a command run."""
+
+    def __init__(self, name, command, seconds, rc, output_bytes=None, finished=None):
+        """
+        :param name: Name of the run, e.g. a label of a batch file.
+        :param command: Name of the sub-command.
+        :param seconds: Duration in seconds, None if the command was not executed.
+        :param rc: Exit status, 0 on success, SKIPPED if the command was not executed.
+        :param output_bytes: Bytes written to the destination directory, None if unknown.
+        :param finished: Unix time of the end of the run, default is now.
+        """
+        self.name = name
+        self.command = command
+        self.seconds = seconds
+        self.rc = rc
+        self.output_bytes = output_bytes
+        self.finished = finished if finished is not None else time.time()
+
+    @property
+    def labels(self):
+        return 'name="{}",command="{}"'.format(_escape(self.name), _escape(self.command))
+
+
+def write_textfile(fname, results):
+    """
+    Write the results to a textfile.
+
+    :param fname: Path of the file, should end with .prom.
+    :param results: List of Result.
+    """
+    last_success = read_last_success(fname)
+    values = {metric: list() for metric, _ in _METRICS}
+    for result in results:
+        if result.seconds is not None:
+            values['duration_seconds'].append((result.labels, result.seconds))
+        values['exit_status'].append((result.labels, result.rc))
+        if result.rc == 0:
+            values['last_success_timestamp_seconds'].append((result.labels, result.finished))
+        elif result.labels in last_success:
+            values['last_success_timestamp_seconds'].append((result.labels, last_success[result.labels]))
+        if result.output_bytes is not None:
+            values['output_bytes'].append((result.labels, result.output_bytes))
+
+    lines = list()
+    for metric, help_text in _METRICS:
+        lines.append('# HELP {}{} {}'.format(PREFIX, metric, help_text))
+        lines.append('# TYPE {}{} gauge'.format(PREFIX, metric))
+        for labels, value in values[metric]:
+            lines.append('{}{}{{{}}} {}'.format(PREFIX, metric, labels, _format_value(value)))
+
+    # The temporary file does not end with .prom, so it is ignored by the textfile collector.
+    tmp_file = fname + '.tmp'
+    with open(tmp_file, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    os.replace(tmp_file, fname)
+
+
+def read_last_success(fname):
+    """
+    Read the last success timestamps of a previous textfile.
+
+    :param fname: Path of the file.
+    :return: Dictionary of labels to Unix time, empty if the file does not exist.
+    :rtype: dict
+    """
+    last_success = dict()
+    if not os.path.isfile(fname):
+        return last_success
+    with open(fname, 'r') as file:
+        for line in file:
+            match = _LAST_SUCCESS.match(line.strip())
+            if match:
+                try:
+                    last_success[match.group(1)] = float(match.group(2))
+                except ValueError:
+                    continue
+    return last_success
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -1,8 +1,11 @@
 """Module for CLI command implementations."""
 
 import abc
+import argparse
 import logging
+import os
 import sys
+import time
 
 __author__ = 'christof.pieloth'
 
@@ -19,6 +22,23 @@ def init_logging():
         logging.basicConfig(level=logging.DEBUG, filename=cfg.log.file, format=cfg.log.format, datefmt=cfg.log.datefmt)
 
 
+def positive_int(value):
+    """
+    Argument type of an int, which must be greater than 0.
+
+    :param value: Value of the argument.
+    :return: Value as int.
+    :raise argparse.ArgumentTypeError if the value is invalid, i.e. a usage error
+    """
+    try:
+        result = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Could not cast "{}" to int.'.format(value))
+    if result <= 0:
+        raise argparse.ArgumentTypeError('Must be greater than 0, but it is: {}'.format(value))
+    return result
+
+
 class SubCommand(abc.ABC):
     """
     Abstract base class for sub commands.
@@ -72,7 +92,18 @@ class SubCommand(abc.ABC):
         """
         parser = subparsers.add_parser(cls._name().strip(), help=cls._help().strip())
         cls._add_arguments(parser)
-        parser.set_defaults(func=cls.exec)
+        parser.set_defaults(func=cls.exec, prepare=cls.prepare)
+
+    @classmethod
+    def prepare(cls, args):
+        """
+        Validate the arguments and prepare the execution, without executing the command.
+
+        :param args: argparse arguments.
+        :return: Callable without arguments, which executes the command and returns 0 on success.
+        :raise Exception on invalid arguments
+        """
+        return lambda: cls.exec(args)
 
     @classmethod
     @abc.abstractmethod
@@ -89,7 +120,7 @@ class SubCommand(abc.ABC):
 
 
 class BatchCmd(SubCommand):
-    """A batch is a collection of commands and tasks which are executed sequentially."""
+    """A batch is a collection of commands and tasks which are executed sequentially or concurrently."""
 
     @classmethod
     def _name(cls):
@@ -99,47 +130,92 @@ class BatchCmd(SubCommand):
     def _add_arguments(cls, parser):
         parser.add_argument('-c', '--config', help='Config file.')
         parser.add_argument('-i', '--ignore_errors', help='Continue on error.', action='store_true')
+        parser.add_argument('-j', '--jobs', type=positive_int, default=1,
+                            help='Number of commands to run concurrently, respecting "after:" dependencies.')
+        parser.add_argument('--check', action='store_true',
+                            help='Validate all lines of the batch file without executing them.')
+        parser.add_argument('--report', help='Write timing and resource usage of all commands to a JSON file.')
+        parser.add_argument('--prom_file', help='Write duration, exit status and output bytes of all commands '
+                                                'to a node_exporter textfile.')
         parser.add_argument('batch_file', help='Batch file.')
         return parser
 
     @classmethod
     def exec(cls, args):
         """Execute the command."""
-        from backbacker.backbacker import main
+        from backbacker import batch
+        from backbacker import instrumentation
         from backbacker.config import Config
 
-        Config.read_config(args.config)
+        cfg = Config.read_config(args.config)
         init_logging()
-
-        commands = cls.read_batch_file(args.batch_file)
-        error_count = 0
-        for command in commands:
-            argv = ['nop']
-            argv.extend(command.split(' '))
-            rc = main(argv)
-
-            if rc > 0:
-                error_count += 1
-                logger.error('Error executing command: %s. Returned with: %d', command, rc)
-                if args.ignore_errors:
-                    continue
-                else:
-                    return rc
-
-        return error_count
-
-    @staticmethod
-    def read_batch_file(fname):
-        commands = list()
-        with open(fname, 'r') as file:
-            for line in file:
-                stripped = line.strip()
-                if not stripped:  # skip empty lines
-                    continue
-                if stripped.startswith('#'):  # skip comments
-                    continue
-                commands.append(stripped)
-        return commands
+        if cfg.tools.cache_file:
+            from backbacker import availability
+            availability.cache.configure(cfg.tools.cache_file, cfg.tools.cache_ttl)
+
+        try:
+            jobs = batch.load_batch_file(args.batch_file)
+        except batch.BatchFileError as ex:
+            for error in ex.errors:
+                logger.error('Invalid batch file: %s', error)
+            return 2
+
+        if args.check:
+            logger.info('Batch file is valid: %s (%d commands)', args.batch_file, len(jobs))
+            return 0
+
+        if not args.report and not args.prom_file:
+            return batch.run_jobs(jobs, batch.BatchJob.execute, workers=args.jobs, ignore_errors=args.ignore_errors)
+
+        instrumentation.collector.clear()
+        results = list()
+        started = time.time()
+        with instrumentation.output_measured():
+            rc = batch.run_jobs(jobs, lambda job: _execute_measured(job, results), workers=args.jobs,
+                                ignore_errors=args.ignore_errors)
+        seconds = time.time() - started
+
+        if args.report:
+            instrumentation.collector.write_report(args.report, batch_file=args.batch_file, started=started,
+                                                   seconds=seconds, rc=rc)
+            logger.info('Wrote report: %s', args.report)
+        if args.prom_file:
+            from backbacker import prometheus
+            # Jobs, which were not executed, keep their last success timestamp, i.e. staleness stays visible.
+            executed = {result.name for result in results}
+            results.extend(prometheus.Result(_job_name(job), job.argv[0], None, prometheus.SKIPPED)
+                           for job in jobs if _job_name(job) not in executed)
+            results.append(prometheus.Result(os.path.basename(args.batch_file), cls._name(), seconds, rc))
+            try:
+                prometheus.write_textfile(args.prom_file, results)
+                logger.info('Wrote textfile: %s', args.prom_file)
+            except OSError as ex:
+                logger.error('Could not write textfile %s: %s', args.prom_file, ex)
+        return rc
+
+
+def _job_name(job):
+    return job.label if job.label else 'line {}'.format(job.line_no)
+
+
+def _execute_measured(job, results):
+    """Execute a batch job and append its prometheus.Result to results."""
+    from backbacker import instrumentation
+    from backbacker import prometheus
+
+    name = _job_name(job)
+    with instrumentation.job(name):
+        instrumentation.pop_last_measurement()
+        start = time.monotonic()
+        rc = 1
+        try:
+            rc = job.execute()
+        finally:
+            measurement = instrumentation.pop_last_measurement()
+            # list.append is atomic, jobs may run concurrently
+            results.append(prometheus.Result(name, job.argv[0], time.monotonic() - start, rc,
+                                             measurement.bytes_written if measurement else None))
+    return rc
 
 
 def register_sub_commands(subparser):
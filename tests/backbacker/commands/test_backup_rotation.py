@@ -0,0 +1,108 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import backbacker.commands.backup_rotation as backup_rotation
+
+
+class BackupRotationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir_tmp = tempfile.TemporaryDirectory(prefix='backupRotationTest')
+        self._dir = self._dir_tmp.name
+
+    def tearDown(self):
+        self._dir_tmp.cleanup()
+
+    def _touch(self, *fnames):
+        for fname in fnames:
+            with open(os.path.join(self._dir, fname), 'w'):
+                pass
+
+    def test_execute(self):
+        self._touch('20200101T000000_db.sql.gz', '20200101T000000_www.tar.gz',
+                    '20200102T000000_db.sql.gz', '20200102T000000_www.tar.gz',
+                    '20200103T000000_db.sql.gz')
+        os.mkdir(os.path.join(self._dir, '20190101T000000_dir'))
+
+        rotation = backup_rotation.BackupRotation()
+        rotation.dir = self._dir
+        rotation.keep_backups = 2
+        rotation.execute()
+
+        self.assertEqual(['20190101T000000_dir', '20200102T000000_db.sql.gz', '20200102T000000_www.tar.gz',
+                          '20200103T000000_db.sql.gz'], sorted(os.listdir(self._dir)))
+
+    def test_execute_skip_unknown(self):
+        self._touch('20200101T000000_db.sql.gz', '20200102T000000_db.sql.gz', 'README', 'foo_bar.txt')
+
+        rotation = backup_rotation.BackupRotation()
+        rotation.dir = self._dir
+        rotation.keep_backups = 1
+        rotation.execute()
+
+        self.assertEqual(['20200102T000000_db.sql.gz', 'README', 'foo_bar.txt'], sorted(os.listdir(self._dir)))
+
+    def test_keep_backups_invalid(self):
+        rotation = backup_rotation.BackupRotation()
+        with self.assertRaises(ValueError):
+            rotation.keep_backups = 0
+
+    def test_execute_dry_run(self):
+        self._touch('20200101T000000_db.sql.gz', '20200102T000000_db.sql.gz')
+
+        rotation = backup_rotation.BackupRotation()
+        rotation.dir = self._dir
+        rotation.keep_backups = 1
+        rotation.dry_run = True
+        with self.assertLogs(backup_rotation.logger, 'INFO') as logs:
+            rotation.execute()
+
+        self.assertEqual(2, len(os.listdir(self._dir)))
+        self.assertIn('Would delete: {}'.format(os.path.join(self._dir, '20200101T000000_db.sql.gz')),
+                      logs.output[0])
+
+    def test_execute_policy(self):
+        self._touch('20200101T000000_a', '20200101T120000_a', '20200102T000000_a', '20200103T000000_a')
+
+        rotation = backup_rotation.BackupRotation()
+        rotation.dir = self._dir
+        rotation.policy.daily = 2
+        rotation.execute()
+
+        self.assertEqual(['20200102T000000_a', '20200103T000000_a'], sorted(os.listdir(self._dir)))
+
+
+class RetentionPolicyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # one backup per day for two years
+        start = datetime.datetime(2019, 1, 1, 3, 0)
+        self._dates = [start + datetime.timedelta(days=i) for i in range(730)]
+
+    def test_empty(self):
+        policy = backup_rotation.RetentionPolicy()
+        self.assertEqual(set(self._dates), policy.select(self._dates))
+
+    def test_last(self):
+        policy = backup_rotation.RetentionPolicy(last=3)
+        self.assertEqual(set(self._dates[-3:]), policy.select(self._dates))
+
+    def test_gfs(self):
+        policy = backup_rotation.RetentionPolicy(daily=7, weekly=4, monthly=12, yearly=5)
+        keep = policy.select(self._dates)
+
+        self.assertTrue(set(self._dates[-7:]).issubset(keep))
+        # newest backup of each month
+        self.assertIn(datetime.datetime(2020, 1, 31, 3, 0), keep)
+        self.assertNotIn(datetime.datetime(2020, 1, 30, 3, 0), keep)
+        # newest backup of 2019
+        self.assertIn(datetime.datetime(2019, 12, 31, 3, 0), keep)
+        self.assertNotIn(datetime.datetime(2019, 11, 30, 3, 0), keep)
+        # 7 days + 3 older weeks + 11 older months + 1 older year, some overlap
+        self.assertLessEqual(len(keep), 7 + 4 + 12 + 2)
+
+    def test_negative(self):
+        with self.assertRaises(ValueError):
+            backup_rotation.RetentionPolicy(daily=-1)
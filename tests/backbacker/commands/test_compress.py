@@ -0,0 +1,490 @@
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import unittest
+import unittest.mock
+
+import backbacker.commands.compress as compress
+from backbacker.backbacker import create_parser
+
+
+class GZipTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='gzipTest')
+        self._test_dir = self._test_dir_tmp.name
+        self._src_dir = os.path.join(self._test_dir, 'src')
+        self._dst_dir = os.path.join(self._test_dir, 'dst')
+        fixtures_dir = os.path.join(os.path.dirname(__file__), 'fixtures', 'file_sync')
+
+        shutil.copytree(fixtures_dir, self._src_dir)
+        with open(os.path.join(self._src_dir, 'random.bin'), 'wb') as file:
+            file.write(os.urandom(300 * 1024))
+        os.mkdir(self._dst_dir)
+
+    def tearDown(self):
+        self._test_dir_tmp.cleanup()
+
+    def _assert_archive(self, fname):
+        with tarfile.open(fname, 'r:gz') as tar:
+            names = {os.path.basename(name) for name in tar.getnames()}
+            self.assertIn('foo.txt', names)
+            self.assertIn('bar.txt', names)
+            member = next(m for m in tar.getmembers() if m.name.endswith('random.bin'))
+            with open(os.path.join(self._src_dir, 'random.bin'), 'rb') as file:
+                self.assertEqual(file.read(), tar.extractfile(member).read())
+
+    def test_execute(self):
+        cmd = compress.GZip()
+        cmd.src_dir = self._src_dir
+        cmd.dst_dir = self._dst_dir
+        cmd.execute()
+
+        self._assert_archive(os.path.join(self._dst_dir, 'src.tar.gz'))
+
+    def test_execute_threads(self):
+        cmd = compress.GZip()
+        cmd.src_dir = self._src_dir
+        cmd.dst_dir = self._dst_dir
+        cmd.threads = 4
+        cmd.execute()
+
+        self._assert_archive(os.path.join(self._dst_dir, 'src.tar.gz'))
+
+    def test_execute_compressor(self):
+        cmd = compress.GZip()
+        cmd.src_dir = self._src_dir
+        cmd.dst_dir = self._dst_dir
+        cmd.compressor = compress.create_compressor('xz', level=1)
+        cmd.execute()
+
+        self.assertEqual(os.path.join(self._dst_dir, 'src.tar.xz'), cmd.dst_file)
+        extract_dir = os.path.join(self._test_dir, 'extract')
+        compress.extract_archive(cmd.dst_file, extract_dir)
+        with open(os.path.join(extract_dir, self._src_dir.lstrip(os.sep), 'random.bin'), 'rb') as actual, \
+                open(os.path.join(self._src_dir, 'random.bin'), 'rb') as expected:
+            self.assertEqual(expected.read(), actual.read())
+
+    def test_threads_invalid(self):
+        cmd = compress.GZip()
+        with self.assertRaises(ValueError):
+            cmd.threads = 0
+
+    def test_cli_arguments_invalid(self):
+        parser = create_parser('test')
+        args = ['gzip', '--src_dir', self._src_dir, '--dst_dir', self._dst_dir]
+        self.assertEqual(4, parser.parse_args(args + ['--threads', '4']).threads)
+        for arg in ('--threads', '--workers', '--segment_size'):
+            for value in ('0', '-1', 'x'):
+                with self.assertRaises(SystemExit) as ctx, contextlib.redirect_stderr(io.StringIO()):
+                    parser.parse_args(args + [arg, value])
+                self.assertEqual(2, ctx.exception.code)
+
+
+class GZipIncrementalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='gzipIncrementalTest')
+        self._test_dir = self._test_dir_tmp.name
+        self._src_dir = os.path.join(self._test_dir, 'src')
+        self._dst_dir = os.path.join(self._test_dir, 'dst')
+        os.makedirs(os.path.join(self._src_dir, 'sub', 'deep'))
+        os.mkdir(self._dst_dir)
+        self._write('keep.txt', 'keep')
+        self._write('change.txt', 'old')
+        self._write('sub/deep/remove.txt', 'remove')
+
+    def tearDown(self):
+        self._test_dir_tmp.cleanup()
+
+    def _write(self, rel, content):
+        with open(os.path.join(self._src_dir, rel), 'w') as file:
+            file.write(content)
+
+    def _execute(self):
+        cmd = compress.GZip()
+        cmd.src_dir = self._src_dir
+        cmd.dst_dir = self._dst_dir
+        cmd.incremental = True
+        cmd.execute()
+        return cmd
+
+    def test_execute(self):
+        cmd = self._execute()
+        self.assertTrue(os.path.isfile(cmd.dst_file))
+        self.assertTrue(os.path.isfile(cmd.manifest_file))
+
+        self._write('change.txt', 'new content')
+        self._write('sub/new.txt', 'new')
+        shutil.rmtree(os.path.join(self._src_dir, 'sub', 'deep'))
+        self._execute()
+
+        delta = os.path.join(self._dst_dir, 'src.1.tar.gz')
+        with tarfile.open(delta, 'r:gz') as tar:
+            names = {name[len(self._src_dir.lstrip('/')):] for name in tar.getnames()}
+        self.assertEqual({'/change.txt', '/sub', '/sub/new.txt'}, names)
+
+        manifest = compress.ArchiveManifest.load(cmd.manifest_file)
+        self.assertEqual(['sub/deep/', 'sub/deep/remove.txt'], manifest.archives[1]['deleted'])
+
+        # unchanged tree creates no delta
+        self._execute()
+        self.assertFalse(os.path.exists(os.path.join(self._dst_dir, 'src.2.tar.gz')))
+        self.assertEqual(2, len(compress.ArchiveManifest.load(cmd.manifest_file).archives))
+
+        restore_dir = os.path.join(self._test_dir, 'restore')
+        manifest = compress.ArchiveManifest.load(cmd.manifest_file)
+        manifest.restore(restore_dir)
+        restored = os.path.join(restore_dir, manifest.root)
+        self.assertEqual(compress.scan_tree(self._src_dir).keys(), compress.scan_tree(restored).keys())
+        with open(os.path.join(restored, 'change.txt')) as file:
+            self.assertEqual('new content', file.read())
+
+    def test_restore_type_change(self):
+        cmd = self._execute()
+        os.remove(os.path.join(self._src_dir, 'change.txt'))
+        os.mkdir(os.path.join(self._src_dir, 'change.txt'))
+        self._write('change.txt/inner.txt', 'inner')
+        shutil.rmtree(os.path.join(self._src_dir, 'sub'))
+        self._write('sub', 'now a file')
+        self._execute()
+
+        restore_dir = os.path.join(self._test_dir, 'restore')
+        manifest = compress.ArchiveManifest.load(cmd.manifest_file)
+        manifest.restore(restore_dir)
+        restored = os.path.join(restore_dir, manifest.root)
+        self.assertEqual(compress.scan_tree(self._src_dir).keys(), compress.scan_tree(restored).keys())
+        with open(os.path.join(restored, 'change.txt', 'inner.txt')) as file:
+            self.assertEqual('inner', file.read())
+        with open(os.path.join(restored, 'sub')) as file:
+            self.assertEqual('now a file', file.read())
+
+    def test_full_archive_removes_manifest(self):
+        cmd = self._execute()
+        cmd.incremental = False
+        cmd.execute()
+        self.assertFalse(os.path.exists(cmd.manifest_file))
+
+
+class GZipSegmentedTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='gzipSegmentedTest')
+        self._test_dir = self._test_dir_tmp.name
+        self._src_dir = os.path.join(self._test_dir, 'src')
+        self._dst_dir = os.path.join(self._test_dir, 'dst')
+        os.mkdir(self._dst_dir)
+        for i in range(4):
+            os.makedirs(os.path.join(self._src_dir, 'd{}'.format(i)))
+            for j in range(5):
+                with open(os.path.join(self._src_dir, 'd{}'.format(i), 'f{}.bin'.format(j)), 'wb') as file:
+                    file.write(os.urandom(1000))
+
+    def tearDown(self):
+        self._test_dir_tmp.cleanup()
+
+    def _instance(self):
+        cmd = compress.GZip()
+        cmd.src_dir = self._src_dir
+        cmd.dst_dir = self._dst_dir
+        cmd.segment_size = 4000
+        return cmd
+
+    def _assert_restore(self, journal_file):
+        restore_dir = os.path.join(self._test_dir, 'restore')
+        journal = compress.SegmentJournal.load(journal_file)
+        journal.restore(restore_dir)
+        restored = os.path.join(restore_dir, journal.root)
+        self.assertEqual(compress.scan_tree(self._src_dir).keys(), compress.scan_tree(restored).keys())
+        with open(os.path.join(self._src_dir, 'd3', 'f4.bin'), 'rb') as expected, \
+                open(os.path.join(restored, 'd3', 'f4.bin'), 'rb') as actual:
+            self.assertEqual(expected.read(), actual.read())
+
+    def test_execute(self):
+        cmd = self._instance()
+        cmd.execute()
+
+        journal = compress.SegmentJournal.load(cmd.journal_file)
+        self.assertTrue(journal.complete)
+        self.assertEqual(5, len(journal.segments))
+        self.assertEqual(25, sum(segment['entries'] for segment in journal.segments))
+        self.assertEqual(os.path.join(self._dst_dir, 'src.gen0000.seg0000.tar.gz'), journal.files()[0])
+        self.assertFalse(os.path.exists(cmd.pending_journal_file))
+        self._assert_restore(cmd.journal_file)
+
+    def test_resume(self):
+        cmd = self._instance()
+        add_member = compress.GZip._add_member
+        added = list()
+
+        fail_at = [12]
+
+        def add_or_fail(instance, tar, rel):
+            if len(added) in fail_at:
+                raise OSError('No space left on device')
+            added.append(rel)
+            add_member(instance, tar, rel)
+
+        with unittest.mock.patch.object(compress.GZip, '_add_member', add_or_fail):
+            with self.assertRaises(RuntimeError):
+                cmd.execute()
+        journal = compress.SegmentJournal.load(cmd.pending_journal_file)
+        self.assertFalse(journal.complete)
+        self.assertEqual(2, len(journal.segments))
+        self.assertEqual(['src.gen0000.seg0000.tar.gz', 'src.gen0000.seg0000.tar.gz.index.json.gz',
+                          'src.gen0000.seg0001.tar.gz', 'src.gen0000.seg0001.tar.gz.index.json.gz',
+                          'src.journal.json.part'], sorted(os.listdir(self._dst_dir)))
+
+        added.clear()
+        fail_at.clear()
+        with unittest.mock.patch.object(compress.GZip, '_add_member', add_or_fail):
+            self._instance().execute()
+        # The entries of the 2 completed segments are not archived again.
+        self.assertEqual(25 - 11, len(added))
+        self._assert_restore(cmd.journal_file)
+
+    def test_resume_with_entries_before_resume_point(self):
+        cmd = self._instance()
+        add_member = compress.GZip._add_member
+        added = list()
+
+        def add_or_fail(instance, tar, rel):
+            if len(added) == 12:
+                raise OSError('No space left on device')
+            added.append(rel)
+            add_member(instance, tar, rel)
+
+        with unittest.mock.patch.object(compress.GZip, '_add_member', add_or_fail):
+            with self.assertRaises(RuntimeError):
+                cmd.execute()
+        # d0 is in the completed segments
+        with open(os.path.join(self._src_dir, 'd0', 'new.bin'), 'wb') as file:
+            file.write(b'new')
+        self._instance().execute()
+
+        self._assert_restore(cmd.journal_file)
+        journal = compress.SegmentJournal.load(cmd.journal_file)
+        self.assertEqual(26, sum(segment['entries'] for segment in journal.segments))
+        restore_dir = os.path.join(self._test_dir, 'extract')
+        self.assertEqual(1, journal.extract(['d0/new.bin'], restore_dir))
+
+    def test_complete_archive_is_replaced(self):
+        cmd = self._instance()
+        cmd.execute()
+        cmd.segment_size = 100000
+        cmd.execute()
+
+        self.assertEqual(['src.gen0001.seg0000.tar.gz', 'src.gen0001.seg0000.tar.gz.index.json.gz',
+                          'src.journal.json'], sorted(os.listdir(self._dst_dir)))
+        self._assert_restore(cmd.journal_file)
+
+    def test_complete_archive_is_kept_on_failure(self):
+        cmd = self._instance()
+        cmd.execute()
+        previous = compress.SegmentJournal.load(cmd.journal_file).files()
+
+        add_member = compress.GZip._add_member
+        added = list()
+
+        def add_or_fail(instance, tar, rel):
+            if len(added) == 12:
+                raise OSError('No space left on device')
+            added.append(rel)
+            add_member(instance, tar, rel)
+
+        with unittest.mock.patch.object(compress.GZip, '_add_member', add_or_fail):
+            with self.assertRaises(RuntimeError):
+                cmd.execute()
+        journal = compress.SegmentJournal.load(cmd.journal_file)
+        self.assertTrue(journal.complete)
+        self.assertEqual(previous, journal.files())
+        self.assertEqual(1, compress.SegmentJournal.load(cmd.pending_journal_file).generation)
+        self._assert_restore(cmd.journal_file)
+
+        cmd.execute()
+        journal = compress.SegmentJournal.load(cmd.journal_file)
+        self.assertEqual(1, journal.generation)
+        self.assertFalse(any(os.path.exists(fname) for fname in previous))
+        self.assertEqual(5 * 2 + 1, len(os.listdir(self._dst_dir)))  # segments, indexes and journal
+        self._assert_restore(cmd.journal_file)
+
+    def test_execute_workers(self):
+        cmd = self._instance()
+        cmd.workers = 3
+        cmd.execute()
+
+        journal = compress.SegmentJournal.load(cmd.journal_file)
+        self.assertEqual(['src.gen0000.seg{:04d}.tar.gz'.format(i) for i in range(5)],
+                         [segment['file'] for segment in journal.segments])
+        members = compress.SeekIndex.load(journal.files()[1]).members
+        self.assertEqual(journal.segments[1]['first'], members[0][0])
+        self.assertEqual(journal.segments[1]['last'], members[-1][0])
+        self._assert_restore(cmd.journal_file)
+
+    def test_extract(self):
+        cmd = self._instance()
+        cmd.execute()
+        journal = compress.SegmentJournal.load(cmd.journal_file)
+        self.assertEqual([journal.files()[4]], journal.locate('d3/f4.bin'))
+        self.assertEqual(journal.files()[2:4], journal.locate('d2'))
+
+        restore_dir = os.path.join(self._test_dir, 'restore')
+        self.assertEqual(1 + 6, journal.extract(['d3/f4.bin', 'd1'], restore_dir))
+        restored = compress.scan_tree(os.path.join(restore_dir, journal.root))
+        expected = {'d1/', 'd3/', 'd3/f4.bin'} | {'d1/f{}.bin'.format(j) for j in range(5)}
+        self.assertEqual(expected, set(restored))
+        with self.assertRaises(FileNotFoundError):
+            journal.extract(['missing.txt'], restore_dir)
+
+    def test_incremental_invalid(self):
+        cmd = self._instance()
+        cmd.incremental = True
+        with self.assertRaises(ValueError):
+            cmd.execute()
+
+
+class SeekIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='seekIndexTest')
+        self._test_dir = self._test_dir_tmp.name
+        self._src_dir = os.path.join(self._test_dir, 'src')
+        self._dst_dir = os.path.join(self._test_dir, 'dst')
+        os.mkdir(self._dst_dir)
+        os.makedirs(os.path.join(self._src_dir, 'sub'))
+        for i in range(5):
+            with open(os.path.join(self._src_dir, 'sub', 'f{}.bin'.format(i)), 'wb') as file:
+                file.write(os.urandom(600 * 1024))
+
+    def tearDown(self):
+        self._test_dir_tmp.cleanup()
+
+    def test_extract(self):
+        cmd = compress.GZip()
+        cmd.src_dir = self._src_dir
+        cmd.dst_dir = self._dst_dir
+        cmd.seek_index = True
+        cmd.execute()
+
+        index = compress.SeekIndex.load(cmd.dst_file)
+        self.assertEqual(['', 'sub/', 'sub/f0.bin'], [member[0] for member in index.members[:3]])
+        self.assertGreater(len(index.blocks), 2)
+        with gzip.open(cmd.dst_file, 'rb') as file:
+            file.seek(index.members[-1][1])
+            with tarfile.open(fileobj=file, mode='r|') as tar:
+                self.assertEqual(index.arc_name('sub/f4.bin'), tar.next().name)
+
+        # A corrupt first block proves, that only the blocks of the member are read.
+        with open(cmd.dst_file, 'r+b') as file:
+            file.seek(100)
+            file.write(b'corrupt')
+
+        restore_dir = os.path.join(self._test_dir, 'restore')
+        rels, found = index.select(['sub/f4.bin'])
+        self.assertEqual({'sub/f4.bin'}, found)
+        self.assertEqual(1, index.extract(cmd.dst_file, rels, restore_dir))
+        with open(os.path.join(self._src_dir, 'sub', 'f4.bin'), 'rb') as expected, \
+                open(os.path.join(restore_dir, index.root, 'sub', 'f4.bin'), 'rb') as actual:
+            self.assertEqual(expected.read(), actual.read())
+
+    def test_requires_python_compressor(self):
+        cmd = compress.GZip()
+        cmd.src_dir = self._src_dir
+        cmd.dst_dir = self._dst_dir
+        cmd.seek_index = True
+        cmd.compressor = compress.create_compressor('xz')
+        with self.assertRaises(ValueError):
+            cmd.execute()
+
+
+class CompressorTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        data = b'foo bar baz\n' * 10000 + os.urandom(1000)
+        for name in compress.COMPRESSORS:
+            for threads in (1, 2):
+                compressor = compress.create_compressor(name, threads)
+                if not compressor.is_available():
+                    continue
+                with self.subTest(compressor=name, threads=threads), tempfile.TemporaryFile() as file:
+                    # External compressors require a file with a file descriptor.
+                    with compressor.open(file) as writer:
+                        writer.write(data)
+                    file.flush()
+                    if name == 'none':
+                        self.assertEqual(len(data), file.tell())
+                    else:
+                        self.assertLess(file.tell(), len(data))
+
+                    file.seek(0)
+                    with compressor.open_reader(file) as reader:
+                        self.assertEqual(data, reader.read())
+
+    def test_level(self):
+        self.assertIn('-19', compress.create_compressor('zstd', level=19).cmd)
+        self.assertIn('-T4', compress.create_compressor('zstd', 4).cmd)
+        self.assertEqual(0, compress.create_compressor('xz', level=0).level)
+        with self.assertRaises(ValueError):
+            compress.create_compressor('gzip', level=10)
+        with self.assertRaises(ValueError):
+            compress.create_compressor('brotli')
+
+    def test_compressor_for_file(self):
+        self.assertEqual('zstd', compress.compressor_for_file('foo.tar.zst').name)
+        self.assertEqual('xz', compress.compressor_for_file('foo.tar.xz').name)
+        self.assertEqual('python', compress.compressor_for_file('foo.tar.gz').name)
+        self.assertEqual('none', compress.compressor_for_file('foo.tar').name)
+
+
+class ParallelGZipWriterTestCase(unittest.TestCase):
+
+    def test_write_blocks(self):
+        data = os.urandom(10000) * 20
+        output = io.BytesIO()
+        with compress.ParallelGZipWriter(output, threads=3, block_size=4096) as writer:
+            for i in range(0, len(data), 1000):
+                writer.write(data[i:i + 1000])
+
+        self.assertEqual(data, gzip.decompress(output.getvalue()))
+
+        self.assertEqual([[i * 4096, 0] for i in range(49)], [[block[0], 0] for block in writer.blocks])
+        offset, compressed = writer.blocks[10]
+        self.assertEqual(data[offset:offset + 4096], gzip.decompress(output.getvalue()[compressed:])[:4096])
+
+
+class PipeToFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dst_dir_tmp = tempfile.TemporaryDirectory(prefix='pipeToFileTest')
+        self._dest = os.path.join(self._dst_dir_tmp.name, 'out.gz')
+
+    def tearDown(self):
+        self._dst_dir_tmp.cleanup()
+
+    def test_compressors(self):
+        cmd = [sys.executable, '-c', 'print("foo" * 100000)']
+        for compressor in [compress.create_compressor('gzip'), compress.create_compressor('python', threads=2)]:
+            stats = compress.pipe_to_file(cmd, self._dest, compressor)
+            with gzip.open(self._dest, 'rb') as file:
+                self.assertEqual(b'foo' * 100000 + b'\n', file.read())
+            self.assertEqual(300001, stats.bytes_in)
+            self.assertEqual(os.path.getsize(self._dest), stats.bytes_out)
+
+    def test_producer_fails(self):
+        cmd = [sys.executable, '-c', 'import sys; print("partial"); sys.exit(3)']
+        with self.assertRaises(subprocess.CalledProcessError):
+            compress.pipe_to_file(cmd, self._dest, compress.create_compressor('python'))
+        self.assertEqual([], os.listdir(self._dst_dir_tmp.name))
+
+    def test_compressor_fails(self):
+        cmd = [sys.executable, '-c', 'print("foo" * 1000000)']
+        compressor = compress.ExternalCompressor('false', '.gz', [sys.executable, '-c', 'import sys; sys.exit(1)'])
+        with self.assertRaises((RuntimeError, subprocess.CalledProcessError)):
+            compress.pipe_to_file(cmd, self._dest, compressor)
+        self.assertEqual([], os.listdir(self._dst_dir_tmp.name))
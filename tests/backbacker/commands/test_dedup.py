@@ -0,0 +1,150 @@
+import concurrent.futures
+from datetime import datetime
+import io
+import os
+import random
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import backbacker.commands.dedup as dedup
+from backbacker.backbacker import create_parser
+
+
+class ChunkerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._chunker = dedup.Chunker(min_size=1024, avg_size=4096, max_size=16384)
+        self._data = random.Random(42).randbytes(200 * 1024)
+
+    def test_chunks(self):
+        chunks = list(self._chunker.chunks(io.BytesIO(self._data)))
+        self.assertEqual(self._data, b''.join(chunks))
+        self.assertTrue(all(len(chunk) <= 16384 for chunk in chunks))
+        self.assertTrue(all(len(chunk) >= 1024 for chunk in chunks[:-1]))
+
+    def test_insertion_shifts_few_chunks(self):
+        chunks = set(self._chunker.chunks(io.BytesIO(self._data)))
+        shifted = set(self._chunker.chunks(io.BytesIO(b'inserted' + self._data)))
+        self.assertLessEqual(len(shifted - chunks), 3)
+
+    def test_invalid_sizes(self):
+        with self.assertRaises(ValueError):
+            dedup.Chunker(min_size=4096, avg_size=1024, max_size=16384)
+
+    @unittest.skipUnless(dedup.numpy, 'numpy not installed')
+    def test_numpy_cut_points(self):
+        data = self._data + bytes(20 * 1024)
+        for offset in range(0, len(data), 7 * 1024):
+            self.assertEqual(self._python_cut_point(data[offset:]), self._chunker.cut_point(data[offset:]))
+
+    def _python_cut_point(self, data):
+        with unittest.mock.patch.object(dedup, '_GEAR_ARRAY', None):
+            return self._chunker.cut_point(data)
+
+
+class DedupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='dedupTest')
+        self._test_dir = self._test_dir_tmp.name
+        self._src_dir = os.path.join(self._test_dir, 'src')
+        self._store_dir = os.path.join(self._test_dir, 'store')
+        os.makedirs(os.path.join(self._src_dir, 'sub'))
+        self._data = random.Random(7).randbytes(100 * 1024)
+        self._write('dump.sql', self._data)
+        self._write('sub/small.txt', b'small')
+        self._chunker = dedup.Chunker(min_size=1024, avg_size=4096, max_size=16384)
+
+    def tearDown(self):
+        self._test_dir_tmp.cleanup()
+
+    def _write(self, rel, data):
+        with open(os.path.join(self._src_dir, rel), 'wb') as file:
+            file.write(data)
+
+    def _store(self, name='src'):
+        cmd = dedup.DedupStore(self._src_dir, self._store_dir, name=name, chunker=self._chunker)
+        cmd.execute()
+        return cmd
+
+    def test_store_restore(self):
+        first = self._store()
+        self._write('dump.sql', self._data + b'appended')
+        second = self._store(name='src2')
+        self.assertLess(second.bytes_stored, first.bytes_stored / 4)
+
+        dst_dir = os.path.join(self._test_dir, 'restore')
+        dedup.DedupRestore(second.manifest_file, dst_dir).execute()
+        with open(os.path.join(dst_dir, 'dump.sql'), 'rb') as file:
+            self.assertEqual(self._data + b'appended', file.read())
+        with open(os.path.join(dst_dir, 'sub', 'small.txt'), 'rb') as file:
+            self.assertEqual(b'small', file.read())
+
+    def test_manifest_name(self):
+        manifest = os.path.basename(self._store().manifest_file)
+        date, _, name = manifest.partition('_')
+        datetime.strptime(date, '%Y%m%dT%H%M%S')
+        self.assertEqual('src.manifest.json.gz', name)
+
+    def test_gc(self):
+        first = self._store(name='a')
+        self._write('dump.sql', b'other content' * 1000)
+        second = self._store(name='b')
+        store = dedup.ChunkStore(self._store_dir)
+        self.assertEqual(0, store.gc(grace=0)[0])
+
+        os.remove(first.manifest_file)  # e.g. by backup_rotation
+        removed, freed = store.gc(grace=0)
+        self.assertGreater(removed, 0)
+        self.assertGreater(freed, 0)
+
+        dst_dir = os.path.join(self._test_dir, 'restore')
+        dedup.DedupRestore(second.manifest_file, dst_dir).execute()
+        with open(os.path.join(dst_dir, 'dump.sql'), 'rb') as file:
+            self.assertEqual(b'other content' * 1000, file.read())
+
+    def test_gc_grace(self):
+        first = self._store(name='a')
+        os.remove(first.manifest_file)
+        store = dedup.ChunkStore(self._store_dir)
+
+        parser = create_parser('test')
+        args = parser.parse_args(['dedup_gc', '--store_dir', self._store_dir])
+        self.assertEqual(3600, args.grace)
+        self.assertEqual(0, args.func(args))
+        self.assertTrue(os.listdir(store.chunks_dir))  # within the default grace period
+
+        args = parser.parse_args(['dedup_gc', '--store_dir', self._store_dir, '--grace', '0'])
+        self.assertEqual(0, args.func(args))
+        self.assertFalse(any(files for _, _, files in os.walk(store.chunks_dir)))
+
+    def test_put_concurrently(self):
+        store = dedup.ChunkStore(self._store_dir)
+        store.init()
+        data = self._data[:64 * 1024]
+        barrier = threading.Barrier(4, timeout=10)
+        replace = os.replace
+
+        def replace_together(src, dst):
+            # all threads have written their temporary file before the first one is published
+            barrier.wait()
+            replace(src, dst)
+
+        with unittest.mock.patch.object(dedup.os, 'replace', replace_together), \
+                unittest.mock.patch.object(dedup.os.path, 'exists', return_value=False):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(lambda _: store.put(data), range(4)))
+        digest = results[0][0]
+        self.assertEqual(data, store.get(digest))
+        self.assertEqual([digest], os.listdir(os.path.dirname(store.chunk_file(digest))))
+
+    def test_corrupted_chunk(self):
+        cmd = self._store()
+        store = dedup.ChunkStore(self._store_dir)
+        digest = store.load_manifest(cmd.manifest_file)['files'][0]['chunks'][0]
+        with open(store.chunk_file(digest), 'wb') as file:
+            file.write(dedup.zlib.compress(b'garbage'))
+        with self.assertRaises(RuntimeError):
+            store.get(digest)
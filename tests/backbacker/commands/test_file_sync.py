@@ -125,4 +125,131 @@ class RsyncTestCase(FileSyncTests):
         return file_sync.Rsync()
 
 
+@unittest.skipUnless(shutil.which('rsync'), 'requires rsync')
+class RsyncShardedTestCase(FileSyncTests):
+
+    @classmethod
+    def instance(cls):
+        instance = file_sync.Rsync()
+        instance.shards = 2
+        return instance
+
+
+class PySyncTestCase(FileSyncTests):
+
+    @classmethod
+    def instance(cls):
+        return file_sync.PySync()
+
+    def test_update_changed(self):
+        """
+        bar.txt is changed in src dir. After sync it must be updated in dst dir and the mtime must be preserved.
+        Unchanged files must not be copied again.
+        """
+        fs = self.instance()
+        fs.src_dir = self._src_dir
+        fs.dst_dir = self._dst_dir
+        fs.execute()
+
+        src_file = os.path.join(self._src_dir, 'bar.txt')
+        with open(src_file, 'w') as file:
+            file.write('changed content')
+        os.utime(src_file, (1000000000, 1000000000))
+        fs.workers = 2
+        fs.execute()
+
+        self.assertEqual(1, fs.copied_files)
+        dst_file = os.path.join(self._dst_dir, 'bar.txt')
+        with open(dst_file, 'r') as file:
+            self.assertEqual('changed content', file.read())
+        self.assertEqual(1000000000, int(os.path.getmtime(dst_file)))
+
+    def test_mirror_keeps_excluded(self):
+        """Excluded files in dst dir must not be deleted in mirror mode."""
+        with open(os.path.join(self._dst_dir, 'local.log'), 'w') as file:
+            file.write('log')
+
+        fs = self.instance()
+        fs.src_dir = self._src_dir
+        fs.dst_dir = self._dst_dir
+        fs.mirror = True
+        fs.exclude_files = ['*.log']
+        fs.execute()
+
+        self.assertTrue(os.path.isfile(os.path.join(self._dst_dir, 'local.log')))
+        self.assertTrue(os.path.isfile(os.path.join(self._dst_dir, 'foo', 'foo.txt')))
+
+
+class PartitionTestCase(unittest.TestCase):
+
+    def test_partition(self):
+        weights = {'big': 100, 'a': 40, 'b': 35, 'c': 30, 'd': 1}
+        shards = file_sync.partition(weights, 2)
+        self.assertEqual([['big', 'd'], ['a', 'b', 'c']], shards)
+
+    def test_partition_more_shards_than_items(self):
+        shards = file_sync.partition({'a': 1, 'b': 2}, 4)
+        self.assertEqual([['b'], ['a']], shards)
+
+    def test_entry_weight(self):
+        with tempfile.TemporaryDirectory(prefix='partitionTest') as tmp_dir:
+            os.makedirs(os.path.join(tmp_dir, 'dir', 'sub', 'deep'))
+            for fname in ('file.txt', os.path.join('dir', 'a.txt'), os.path.join('dir', 'sub', 'b.txt')):
+                with open(os.path.join(tmp_dir, fname), 'w') as file:
+                    file.write(fname)
+
+            with os.scandir(tmp_dir) as it:
+                weights = {entry.name: file_sync._entry_weight(entry) for entry in it}
+        # only the direct entries of a folder are counted
+        self.assertEqual({'dir': 3, 'file.txt': 1}, weights)
+
+    def test_shards_invalid(self):
+        with self.assertRaises(ValueError):
+            file_sync.Rsync().shards = 0
+
+
+class RsyncStatsTestCase(unittest.TestCase):
+
+    OUTPUT = '''
+     12,345,678  42%   11.77MB/s    0:00:01 (xfr#3, to-chk=17/30)
+Number of files: 1,234 (reg: 1,000, dir: 234)
+Number of created files: 10 (reg: 10)
+Number of deleted files: 2
+Number of regular files transferred: 12
+Total file size: 1,234,567 bytes
+Total transferred file size: 12,345 bytes
+Literal data: 12,000 bytes
+Matched data: 345 bytes
+File list size: 0
+Total bytes sent: 13,000
+Total bytes received: 250
+
+sent 13,000 bytes  received 250 bytes  26,500.00 bytes/sec
+total size is 1,234,567  speedup is 93.17
+'''
+
+    def test_parse(self):
+        stats = file_sync.RsyncStats.parse(self.OUTPUT)
+        self.assertEqual(1234, stats.files_total)
+        self.assertEqual(12, stats.files_transferred)
+        self.assertEqual(2, stats.files_deleted)
+        self.assertEqual(1234567, stats.bytes_total)
+        self.assertEqual(12000, stats.bytes_literal)
+        self.assertEqual(13000, stats.bytes_sent)
+        self.assertAlmostEqual(93.17, stats.speedup, places=2)
+
+    def test_parse_rsync_30(self):
+        stats = file_sync.RsyncStats.parse('Number of files transferred: 7\n')
+        self.assertEqual(7, stats.files_transferred)
+
+    def test_progress(self):
+        self.assertTrue(file_sync.RsyncStats.PROGRESS.match(self.OUTPUT.splitlines()[1].strip()))
+
+    def test_merge(self):
+        stats = file_sync.RsyncStats.parse(self.OUTPUT)
+        stats.merge(file_sync.RsyncStats.parse(self.OUTPUT))
+        self.assertEqual(2468, stats.files_total)
+        self.assertEqual(26000, stats.bytes_sent)
+
+
 del FileSyncTests  # do not execute base test
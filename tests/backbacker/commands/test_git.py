@@ -1,6 +1,7 @@
 import os
 import shutil
 import stat
+import subprocess
 import tempfile
 import unittest
 
@@ -55,6 +56,96 @@ class GitBundleTestCase(unittest.TestCase):
         self.assertTrue(os.path.isfile(os.path.join(self._dst_dir, git_bundle.dst_file)))
 
 
+class GitBundleIncrementalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='gitBundleIncrementalTest')
+        self._repo = os.path.join(self._test_dir_tmp.name, 'repo')
+        self._dst_dir = os.path.join(self._test_dir_tmp.name, 'dst')
+        os.mkdir(self._dst_dir)
+        subprocess.check_call(['git', 'init', '--quiet', self._repo])
+        self._commit('initial')
+
+    def tearDown(self):
+        self._test_dir_tmp.cleanup()
+
+    def _git(self, *args):
+        return subprocess.check_output(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+                                       + list(args), cwd=self._repo).decode().strip()
+
+    def _commit(self, msg):
+        self._git('commit', '--quiet', '--allow-empty', '-m', msg)
+
+    def _bundle(self):
+        git_bundle = git.GitBundle(repo=self._repo, dst_dir=self._dst_dir, incremental=True)
+        git_bundle.execute()
+        return git_bundle
+
+    def test_execute_incremental(self):
+        git_bundle = self._bundle()
+        self.assertTrue(os.path.isfile(git_bundle.dst_file))
+
+        self._bundle()  # unchanged, no new bundle
+        self.assertEqual(1, len(git.GitBundleChain.load(git_bundle.chain_file).bundles))
+
+        self._git('branch', 'feature')
+        self._commit('second')
+        self._bundle()
+        self._commit('third')
+        self._git('branch', '-D', 'feature')
+        self._bundle()
+
+        chain = git.GitBundleChain.load(git_bundle.chain_file)
+        self.assertEqual(3, len(chain.bundles))
+        self.assertEqual(['repo.git.bundle', 'repo.1.git.bundle', 'repo.2.git.bundle'],
+                         [os.path.basename(fname) for fname in chain.files()])
+
+        restored = os.path.join(self._test_dir_tmp.name, 'restored')
+        git.GitBundleRestore(git_bundle.chain_file, restored).execute()
+        head = self._git('rev-parse', 'HEAD')
+        self.assertEqual(head, subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=restored).decode().strip())
+        refs = subprocess.check_output(['git', 'for-each-ref', '--format=%(refname)'], cwd=restored).decode()
+        self.assertNotIn('refs/heads/feature', refs)
+
+    def test_execute_incremental_refs_only(self):
+        git_bundle = self._bundle()
+        first = self._git('rev-parse', 'HEAD')
+        self._commit('second')
+        self._bundle()
+
+        # tag and branch at existing commits, no new objects
+        self._git('tag', 'v1', first)
+        self._git('branch', 'old', first)
+        self._bundle()
+        chain = git.GitBundleChain.load(git_bundle.chain_file)
+        self.assertEqual(3, len(chain.bundles))
+        self.assertIsNone(chain.bundles[-1]['file'])
+
+        self._commit('third')
+        self._git('tag', '-a', 'v2', '-m', 'v2', first)
+        self._bundle()
+
+        chain = git.GitBundleChain.load(git_bundle.chain_file)
+        self.assertEqual(['repo.git.bundle', 'repo.1.git.bundle', 'repo.3.git.bundle'],
+                         [os.path.basename(fname) for fname in chain.files()])
+
+        restored = os.path.join(self._test_dir_tmp.name, 'restored')
+        git.GitBundleRestore(git_bundle.chain_file, restored).execute()
+        expected = self._git('for-each-ref', '--format=%(objectname) %(refname)')
+        self.assertEqual(expected, subprocess.check_output(['git', 'for-each-ref',
+                                                            '--format=%(objectname) %(refname)'],
+                                                           cwd=restored).decode().strip())
+
+    def test_restore_missing_bundle(self):
+        self._bundle()
+        self._commit('second')
+        git_bundle = self._bundle()
+        os.remove(os.path.join(self._dst_dir, 'repo.1.git.bundle'))
+
+        with self.assertRaises(FileNotFoundError):
+            git.GitBundleChain.load(git_bundle.chain_file).check_files()
+
+
 def _on_rm_error(func, path, exc_info):
     # workaround for 'PermissionError: [WinError 5]' on windows
     if isinstance(exc_info[1], PermissionError):
@@ -1,6 +1,13 @@
+import email.utils
+import http.server
+import importlib.util
+import json
 import os.path
 import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
 
 import backbacker.commands.github as github
 
@@ -22,3 +29,166 @@ class GithubBundleTestCase(unittest.TestCase):
         github_clone.execute()
 
         self.assertTrue(os.path.isfile(os.path.join(self._dst_dir, 'BackBacker.git.bundle')))
+
+
+class GithubBundleConcurrentTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dst_dir_tmp = tempfile.TemporaryDirectory(prefix='githubBundleTest')
+        self._dst_dir = self._dst_dir_tmp.name
+        self._repo = os.path.abspath(os.path.join(__file__, '..', '..', '..', '..'))
+
+    def tearDown(self):
+        self._dst_dir = None
+        self._dst_dir_tmp.cleanup()
+
+    def test_execute_failures(self):
+        repos = [('first', self._repo), ('missing', os.path.join(self._dst_dir, 'missing')), ('second', self._repo)]
+
+        github_bundle = github.GithubBundle(username='cpieloth', dst_dir=self._dst_dir, workers=2)
+        with unittest.mock.patch.object(github.GithubBundle, 'collect_repository_urls', return_value=iter(repos)):
+            with self.assertRaisesRegex(RuntimeError, '1 of 3 repositories: missing'):
+                github_bundle.execute()
+
+        self.assertTrue(os.path.isfile(os.path.join(self._dst_dir, 'first.git.bundle')))
+        self.assertTrue(os.path.isfile(os.path.join(self._dst_dir, 'second.git.bundle')))
+
+    def test_workers_invalid(self):
+        with self.assertRaises(ValueError):
+            github.GithubBundle(username='cpieloth', dst_dir=self._dst_dir, workers=0)
+
+
+class MirrorCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='mirrorCacheTest')
+        self._dst_dir = os.path.join(self._test_dir_tmp.name, 'dst')
+        self._cache_dir = os.path.join(self._test_dir_tmp.name, 'cache')
+        self._repo = os.path.abspath(os.path.join(__file__, '..', '..', '..', '..'))
+        os.mkdir(self._dst_dir)
+
+    def tearDown(self):
+        self._test_dir_tmp.cleanup()
+
+    def _execute(self, repos, cache):
+        github_bundle = github.GithubBundle(username='cpieloth', dst_dir=self._dst_dir)
+        github_bundle.cache = cache
+        with unittest.mock.patch.object(github.GithubBundle, 'collect_repository_urls', return_value=iter(repos)):
+            github_bundle.execute()
+
+    def test_incremental(self):
+        self._execute([('repo', self._repo)], github.MirrorCache(self._cache_dir))
+        bundle = os.path.join(self._dst_dir, 'repo.git.bundle')
+        self.assertTrue(os.path.isfile(bundle))
+        self.assertTrue(os.path.isdir(os.path.join(self._cache_dir, 'repo.git')))
+
+        os.utime(bundle, (0, 0))
+        self._execute([('repo', self._repo)], github.MirrorCache(self._cache_dir))
+        self.assertEqual(0, os.stat(bundle).st_mtime, 'unchanged repository must not be bundled again')
+
+    def test_evict_deleted(self):
+        self._execute([('old', self._repo), ('repo', self._repo)], github.MirrorCache(self._cache_dir))
+
+        self._execute([('repo', self._repo)], github.MirrorCache(self._cache_dir, max_size=0))
+        self.assertFalse(os.path.isdir(os.path.join(self._cache_dir, 'old.git')))
+        self.assertTrue(os.path.isdir(os.path.join(self._cache_dir, 'repo.git')))
+
+
+class _GithubStandIn(http.server.BaseHTTPRequestHandler):
+    """Serves two pages of repositories with ETags, the first request can be rate limited."""
+
+    requests = list()
+    authorizations = list()
+    rate_limited = False
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        page = 2 if 'page=2' in self.path else 1
+        etag = '"page{}"'.format(page)
+        self.requests.append((self.path, self.headers.get('If-None-Match')))
+        self.authorizations.append(self.headers.get('Authorization'))
+
+        if _GithubStandIn.rate_limited:
+            _GithubStandIn.rate_limited = False
+            self.send_response(403)
+            self.send_header('X-RateLimit-Remaining', '0')
+            self.send_header('X-RateLimit-Reset', str(int(time.time())))
+            self.end_headers()
+            return
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = json.dumps([{'name': 'repo{}'.format(page), 'clone_url': 'url{}'.format(page)}]).encode()
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        if page == 1:
+            self.send_header('Link', '<http://{}:{}/users/foo/repos?per_page=100&page=2>; rel="next"'
+                             .format(*self.server.server_address))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@unittest.skipUnless(importlib.util.find_spec('requests'), 'requires requests')
+class RepositoryListingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._cache_dir_tmp = tempfile.TemporaryDirectory(prefix='repositoryListingTest')
+        _GithubStandIn.requests = list()
+        _GithubStandIn.authorizations = list()
+        self._server = http.server.HTTPServer(('127.0.0.1', 0), _GithubStandIn)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+        self._api_url = 'http://{}:{}'.format(*self._server.server_address)
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._cache_dir_tmp.cleanup()
+
+    def test_conditional_requests(self):
+        listing = github.RepositoryListing(self._api_url, cache_dir=self._cache_dir_tmp.name)
+        expected = [('repo1', 'url1'), ('repo2', 'url2')]
+        self.assertEqual(expected, list(listing.repositories('foo')))
+        self.assertEqual([None, None], [etag for _, etag in _GithubStandIn.requests])
+
+        listing = github.RepositoryListing(self._api_url, cache_dir=self._cache_dir_tmp.name)
+        self.assertEqual(expected, list(listing.repositories('foo')))
+        self.assertEqual(['"page1"', '"page2"'], [etag for _, etag in _GithubStandIn.requests[2:]])
+
+    def test_rate_limit(self):
+        _GithubStandIn.rate_limited = True
+        listing = github.RepositoryListing(self._api_url)
+        with unittest.mock.patch('time.sleep') as sleep:
+            self.assertEqual(2, len(list(listing.repositories('foo'))))
+        sleep.assert_called_once()
+        self.assertEqual(3, len(_GithubStandIn.requests))
+
+    def test_token(self):
+        listing = github.RepositoryListing(self._api_url, token='secret')
+        self.assertEqual(2, len(list(listing.repositories('foo'))))
+        self.assertEqual(['Bearer secret', 'Bearer secret'], _GithubStandIn.authorizations)
+
+        listing = github.RepositoryListing(self._api_url)
+        list(listing.repositories('foo'))
+        self.assertEqual([None, None], _GithubStandIn.authorizations[2:])
+
+
+class RetryAfterTestCase(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(120.0, github._parse_retry_after('120'))
+
+    def test_http_date(self):
+        value = email.utils.formatdate(time.time() + 60, usegmt=True)
+        self.assertAlmostEqual(60, github._parse_retry_after(value), delta=2)
+
+    def test_invalid(self):
+        self.assertIsNone(github._parse_retry_after(None))
+        self.assertIsNone(github._parse_retry_after('soon'))
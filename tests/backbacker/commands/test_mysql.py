@@ -0,0 +1,54 @@
+import gzip
+import os
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import backbacker.commands.mysql as mysql
+
+# Stand-in for mysqldump, checks that the credentials are passed by an option file.
+MYSQLDUMP = '''#!{python}
+import sys
+if sys.argv[1] == '--version':
+    sys.exit(0)
+assert sys.argv[1].startswith('--defaults-extra-file='), sys.argv
+with open(sys.argv[1].split('=', 1)[1]) as cnf:
+    assert 'password="se\\\\"cret"' in cnf.read()
+print('-- dump of ' + sys.argv[2])
+'''
+
+
+class MySqlDumpGZipTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='mysqlTest')
+        bin_dir = os.path.join(self._test_dir_tmp.name, 'bin')
+        self._dst_dir = os.path.join(self._test_dir_tmp.name, 'dst')
+        os.mkdir(bin_dir)
+        os.mkdir(self._dst_dir)
+
+        mysqldump = os.path.join(bin_dir, 'mysqldump')
+        with open(mysqldump, 'w') as file:
+            file.write(MYSQLDUMP.format(python=sys.executable))
+        os.chmod(mysqldump, 0o755)
+
+        path = bin_dir + os.pathsep + os.environ.get('PATH', '')
+        self._env = unittest.mock.patch.dict(os.environ, {'PATH': path})
+        self._env.start()
+
+    def tearDown(self):
+        self._env.stop()
+        self._test_dir_tmp.cleanup()
+
+    def test_execute(self):
+        cmd = mysql.MySqlDumpGZip()
+        cmd.dst_dir = self._dst_dir
+        cmd.db_name = 'foo'
+        cmd.db_user = 'root'
+        cmd.db_passwd = 'se"cret'
+        cmd.execute()
+
+        with gzip.open(os.path.join(self._dst_dir, 'foo.sql.gz'), 'rb') as file:
+            self.assertEqual(b'-- dump of foo\n', file.read())
+        self.assertEqual(15, cmd.stats.bytes_in)
@@ -0,0 +1,178 @@
+import json
+import lzma
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+import unittest.mock
+
+import backbacker.commands.compress as compress
+import backbacker.commands.pgsql as pgsql
+
+# Stand-in for pg_dump, writes the arguments to the output file, directory or stdout.
+PG_DUMP = '''#!{python}
+import argparse
+import os
+import sys
+if sys.argv[1] == '--version':
+    sys.exit(0)
+assert os.environ['PGPASSWORD'] == 'secret'
+parser = argparse.ArgumentParser()
+parser.add_argument('--no-password', action='store_true')
+parser.add_argument('-U')
+parser.add_argument('-n')
+parser.add_argument('-t')
+parser.add_argument('-Z')
+parser.add_argument('-F')
+parser.add_argument('-j')
+parser.add_argument('-f')
+parser.add_argument('dbname')
+args = parser.parse_args()
+if args.F == 'd':
+    os.mkdir(args.f)
+    with open(os.path.join(args.f, 'toc.dat'), 'w') as file:
+        file.write(' '.join(sys.argv[1:]))
+    if os.environ.get('PG_DUMP_FAIL'):
+        sys.exit(1)
+elif args.f:
+    with open(args.f, 'w') as file:
+        file.write(' '.join(sys.argv[1:]))
+else:
+    sys.stdout.write(' '.join(sys.argv[1:]))
+'''
+
+# Stand-in for psql, lists three databases.
+PSQL = '''#!{python}
+import sys
+if sys.argv[1] == '--version':
+    sys.exit(0)
+print('small|10')
+print('big|3000')
+print('other|200')
+'''
+
+
+class PgSqlDumpGZipTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='pgsqlTest')
+        bin_dir = os.path.join(self._test_dir_tmp.name, 'bin')
+        self._dst_dir = os.path.join(self._test_dir_tmp.name, 'dst')
+        os.mkdir(bin_dir)
+        os.mkdir(self._dst_dir)
+
+        pg_dump = os.path.join(bin_dir, 'pg_dump')
+        with open(pg_dump, 'w') as file:
+            file.write(PG_DUMP.format(python=sys.executable))
+        os.chmod(pg_dump, 0o755)
+        psql = os.path.join(bin_dir, 'psql')
+        with open(psql, 'w') as file:
+            file.write(PSQL.format(python=sys.executable))
+        os.chmod(psql, 0o755)
+
+        path = bin_dir + os.pathsep + os.environ.get('PATH', '')
+        self._env = unittest.mock.patch.dict(os.environ, {'PATH': path})
+        self._env.start()
+
+    def tearDown(self):
+        self._env.stop()
+        self._test_dir_tmp.cleanup()
+
+    def _instance(self):
+        cmd = pgsql.PgSqlDumpGZip()
+        cmd.dst_dir = self._dst_dir
+        cmd.db_name = 'foo'
+        cmd.db_user = 'postgres'
+        cmd.db_passwd = 'secret'
+        cmd.db_schema = 'public'
+        return cmd
+
+    @staticmethod
+    def _read(fname):
+        with open(fname, 'r') as file:
+            return file.read()
+
+    def test_execute_plain(self):
+        cmd = self._instance()
+        cmd.execute()
+
+        args = self._read(os.path.join(self._dst_dir, 'foo.sql.gz'))
+        self.assertIn('-n public', args)
+        self.assertIn('-Z 9', args)
+        self.assertNotIn('-F', args)
+
+    def test_execute_directory(self):
+        cmd = self._instance()
+        cmd.jobs = 4
+        cmd.compress_level = 1
+        cmd.execute()
+        cmd.execute()  # replaces previous dump
+
+        args = self._read(os.path.join(self._dst_dir, 'foo.dir', 'toc.dat'))
+        self.assertIn('-F d -j 4', args)
+        self.assertIn('-Z 1', args)
+        self.assertIn('-n public', args)
+
+    def test_execute_directory_failed(self):
+        cmd = self._instance()
+        cmd.jobs = 4
+        cmd.execute()
+
+        cmd.compress_level = 1
+        with unittest.mock.patch.dict(os.environ, {'PG_DUMP_FAIL': '1'}):
+            with self.assertRaises(Exception):
+                cmd.execute()
+        # previous dump is kept
+        self.assertEqual(['foo.dir'], os.listdir(self._dst_dir))
+        self.assertIn('-Z 9', self._read(os.path.join(self._dst_dir, 'foo.dir', 'toc.dat')))
+
+    def test_execute_pack(self):
+        cmd = self._instance()
+        cmd.jobs = 2
+        cmd.pack = True
+        cmd.execute()
+
+        self.assertEqual(['foo.dir.tar'], os.listdir(self._dst_dir))
+        with tarfile.open(cmd.dst_file) as tar:
+            self.assertIn('foo.dir/toc.dat', tar.getnames())
+
+    def test_execute_compressor(self):
+        cmd = self._instance()
+        cmd.compressor = compress.create_compressor('xz', level=1)
+        cmd.execute()
+
+        self.assertEqual(os.path.join(self._dst_dir, 'foo.sql.xz'), cmd.dst_file)
+        with lzma.open(cmd.dst_file, 'rt') as file:
+            args = file.read()
+        self.assertIn('-Z 0', args)
+        self.assertNotIn('-f', args)
+
+        cmd.jobs = 2
+        cmd.execute()
+        self.assertEqual({'foo.sql.xz', 'foo.dir.tar.xz'}, set(os.listdir(self._dst_dir)))
+        with tarfile.open(cmd.dst_file, 'r:xz') as tar:
+            self.assertIn('foo.dir/toc.dat', tar.getnames())
+
+    def test_compress_level_invalid(self):
+        with self.assertRaises(ValueError):
+            self._instance().compress_level = 10
+
+    def test_dump_all(self):
+        cmd = pgsql.PgSqlDumpAll()
+        cmd.dst_dir = self._dst_dir
+        cmd.db_user = 'postgres'
+        cmd.db_passwd = 'secret'
+        cmd.db_pattern = '[bs]*'
+        cmd.workers = 2
+        cmd.execute()
+
+        self.assertEqual({'big.sql.gz', 'small.sql.gz', 'pgsql_dump_report.json'}, set(os.listdir(self._dst_dir)))
+        with open(cmd.report_file, 'r') as file:
+            report = json.load(file)
+        self.assertEqual(['big', 'small'], [entry['name'] for entry in report['databases']])
+        self.assertTrue(all(entry['error'] is None for entry in report['databases']))
+
+    def test_dump_all_workers_invalid(self):
+        with self.assertRaises(ValueError):
+            pgsql.PgSqlDumpAll().workers = 0
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+import backbacker.commands.compress as compress
+import backbacker.commands.restore as restore
+from backbacker.backbacker import create_parser
+
+
+class RestoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='restoreTest')
+        self._test_dir = self._test_dir_tmp.name
+        self._src_dir = os.path.join(self._test_dir, 'src')
+        self._dst_dir = os.path.join(self._test_dir, 'dst')
+        self._restore_dir = os.path.join(self._test_dir, 'restore')
+        os.mkdir(self._dst_dir)
+        for name in ('a', 'b'):
+            os.makedirs(os.path.join(self._src_dir, name))
+            with open(os.path.join(self._src_dir, name, 'file.txt'), 'w') as file:
+                file.write(name * 1000)
+
+        self._gzip = compress.GZip()
+        self._gzip.src_dir = self._src_dir
+        self._gzip.dst_dir = self._dst_dir
+
+    def tearDown(self):
+        self._test_dir_tmp.cleanup()
+
+    def _restored(self, rel):
+        return os.path.join(self._restore_dir, self._src_dir.lstrip(os.sep), rel)
+
+    def test_segmented_path(self):
+        self._gzip.segment_size = 1000
+        self._gzip.execute()
+
+        parser = create_parser('test')
+        args = parser.parse_args(['restore', '--file', self._gzip.journal_file, '--dst_dir', self._restore_dir,
+                                  '--path', 'b/file.txt'])
+        self.assertEqual(0, args.func(args))
+        self.assertTrue(os.path.isfile(self._restored('b/file.txt')))
+        self.assertFalse(os.path.exists(self._restored('a')))
+
+    def test_archive(self):
+        self._gzip.execute()
+        restore.Restore(self._gzip.dst_file, self._restore_dir).execute()
+        self.assertTrue(os.path.isfile(self._restored('a/file.txt')))
+        self.assertTrue(os.path.isfile(self._restored('b/file.txt')))
+
+        with self.assertRaises(ValueError):
+            restore.Restore(self._gzip.dst_file, self._restore_dir, ['a/file.txt']).execute()
+
+    def test_seek_index_path(self):
+        self._gzip.seek_index = True
+        self._gzip.execute()
+        restore.Restore(self._gzip.dst_file, self._restore_dir, ['a']).execute()
+        self.assertTrue(os.path.isfile(self._restored('a/file.txt')))
+        self.assertFalse(os.path.exists(self._restored('b')))
+
+        with self.assertRaises(FileNotFoundError):
+            restore.Restore(self._gzip.dst_file, self._restore_dir, ['c']).execute()
@@ -0,0 +1,68 @@
+import os
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+from backbacker import availability
+
+# Stand-in for a program, counts its calls.
+TOOL = '''#!{python}
+import sys
+with open(sys.argv[0] + '.calls', 'a') as file:
+    file.write('x')
+print('tool version 3.1.2 protocol 31')
+'''
+
+
+class AvailabilityCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='availabilityTest')
+        bin_dir = os.path.join(self._test_dir_tmp.name, 'bin')
+        os.mkdir(bin_dir)
+        self._tool = os.path.join(bin_dir, 'bbtool')
+        with open(self._tool, 'w') as file:
+            file.write(TOOL.format(python=sys.executable))
+        os.chmod(self._tool, 0o755)
+        self._cache_file = os.path.join(self._test_dir_tmp.name, 'tools.json')
+
+        path = bin_dir + os.pathsep + os.environ.get('PATH', '')
+        self._env = unittest.mock.patch.dict(os.environ, {'PATH': path})
+        self._env.start()
+
+    def tearDown(self):
+        self._env.stop()
+        self._test_dir_tmp.cleanup()
+
+    def _calls(self):
+        if not os.path.exists(self._tool + '.calls'):
+            return 0
+        with open(self._tool + '.calls', 'r') as file:
+            return len(file.read())
+
+    def test_lookup_once(self):
+        cache = availability.AvailabilityCache()
+        for _ in range(5):
+            info = cache.lookup('bbtool')
+        self.assertTrue(info.available)
+        self.assertEqual(self._tool, info.path)
+        self.assertEqual((3, 1, 2), info.version)
+        self.assertTrue(info.at_least(3, 1))
+        self.assertFalse(info.at_least(3, 2))
+        self.assertEqual(1, self._calls())
+
+    def test_missing(self):
+        info = availability.AvailabilityCache().lookup('bbtool_missing')
+        self.assertFalse(info.available)
+        self.assertIsNone(info.path)
+        self.assertIsNone(info.version)
+
+    def test_persisted(self):
+        availability.AvailabilityCache(self._cache_file).lookup('bbtool')
+        info = availability.AvailabilityCache(self._cache_file).lookup('bbtool')
+        self.assertTrue(info.available)
+        self.assertEqual(1, self._calls())
+
+        availability.AvailabilityCache(self._cache_file, ttl=0).lookup('bbtool')
+        self.assertEqual(2, self._calls())
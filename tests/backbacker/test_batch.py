@@ -0,0 +1,152 @@
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import backbacker.batch as batch
+from backbacker.backbacker import create_parser
+
+
+class BatchFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='batchTest')
+        self._batch_file = os.path.join(self._test_dir_tmp.name, 'batch.bb')
+
+    def tearDown(self):
+        self._test_dir_tmp.cleanup()
+
+    def _write(self, content):
+        with open(self._batch_file, 'w') as file:
+            file.write(content)
+
+    def test_parse(self):
+        job = batch.BatchJob.parse(3, '@dump after:a,b pgsqldump --db_name foo')
+        self.assertEqual(3, job.line_no)
+        self.assertEqual('dump', job.label)
+        self.assertEqual(['a', 'b'], job.after)
+        self.assertEqual(['pgsqldump', '--db_name', 'foo'], job.argv)
+
+    def test_parse_plain(self):
+        job = batch.BatchJob.parse(1, 'example --name foo')
+        self.assertIsNone(job.label)
+        self.assertEqual([], job.after)
+        self.assertEqual('example --name foo', job.command)
+
+    def test_parse_missing_command(self):
+        with self.assertRaises(ValueError):
+            batch.BatchJob.parse(1, '@foo after:bar')
+
+    def test_read(self):
+        self._write('# comment\n\n@a example --name a\nafter:a example --name b\n')
+        jobs = batch.read_batch_file(self._batch_file)
+        self.assertEqual(2, len(jobs))
+        self.assertEqual(4, jobs[1].line_no)
+        self.assertEqual(['a'], jobs[1].after)
+
+    def test_read_unknown_dependency(self):
+        self._write('after:a example --name b\n@a example --name a\n')
+        with self.assertRaises(ValueError):
+            batch.read_batch_file(self._batch_file)
+
+    def test_read_duplicate_label(self):
+        self._write('@a example --name a\n@a example --name b\n')
+        with self.assertRaises(ValueError):
+            batch.read_batch_file(self._batch_file)
+
+    def test_load(self):
+        self._write('example --name a\nexample --name b\n')
+        jobs = batch.load_batch_file(self._batch_file)
+        self.assertTrue(all(job.compiled for job in jobs))
+        self.assertEqual(0, jobs[0].execute())
+
+    def test_load_reports_all_errors(self):
+        self._write('example --name a\nunknown_cmd --foo\nexample\nafter:x example --name c\n'
+                    'backup_rotation --dir /tmp --rotate -1\n')
+        with self.assertRaises(batch.BatchFileError) as ctx:
+            batch.load_batch_file(self._batch_file)
+
+        errors = ctx.exception.errors
+        self.assertEqual(4, len(errors))
+        for line_no, error in zip([2, 3, 4, 5], errors):
+            self.assertTrue(error.startswith('Line {}:'.format(line_no)), error)
+
+
+class BatchCmdTestCase(unittest.TestCase):
+
+    def test_jobs(self):
+        parser = create_parser('test')
+        self.assertEqual(4, parser.parse_args(['batch', '--jobs', '4', 'batch.bb']).jobs)
+        for value in ('0', '-1', 'x'):
+            with self.assertRaises(SystemExit) as ctx, contextlib.redirect_stderr(io.StringIO()):
+                parser.parse_args(['batch', '--jobs', value, 'batch.bb'])
+            self.assertEqual(2, ctx.exception.code)
+
+
+class RunJobsTestCase(unittest.TestCase):
+
+    @staticmethod
+    def _jobs(*specs):
+        return [batch.BatchJob.parse(i, spec) for i, spec in enumerate(specs, start=1)]
+
+    def test_sequential_stop_on_error(self):
+        executed = list()
+
+        def run(job):
+            executed.append(job.command)
+            return 3 if job.command == 'fail' else 0
+
+        rc = batch.run_jobs(self._jobs('ok', 'fail', 'ok2'), run)
+        self.assertEqual(3, rc)
+        self.assertEqual(['ok', 'fail'], executed)
+
+    def test_sequential_ignore_errors(self):
+        executed = list()
+
+        def run(job):
+            executed.append(job.command)
+            return 1 if job.command == 'fail' else 0
+
+        rc = batch.run_jobs(self._jobs('@a fail', 'after:a skipped', 'ok'), run, ignore_errors=True)
+        self.assertEqual(2, rc)
+        self.assertEqual(['fail', 'ok'], executed)
+
+    def test_parallel_dependencies(self):
+        finished = list()
+        lock = threading.Lock()
+
+        def run(job):
+            time.sleep(0.05 if job.label == 'slow' else 0.0)
+            with lock:
+                finished.append(job.label)
+            return 0
+
+        jobs = self._jobs('@slow a', '@fast b', '@last after:slow,fast c')
+        rc = batch.run_jobs(jobs, run, workers=3)
+        self.assertEqual(0, rc)
+        self.assertEqual('last', finished[-1])
+        self.assertEqual(['fast', 'slow'], finished[:2])
+
+    def test_parallel_ignore_errors(self):
+        executed = list()
+        lock = threading.Lock()
+
+        def run(job):
+            with lock:
+                executed.append(job.label)
+            return 1 if job.label == 'a' else 0
+
+        jobs = self._jobs('@a fail', '@b ok', '@c after:a skipped', '@d after:b ok')
+        rc = batch.run_jobs(jobs, run, workers=2, ignore_errors=True)
+        self.assertEqual(2, rc)
+        self.assertEqual({'a', 'b', 'd'}, set(executed))
+
+    def test_parallel_stop_on_error(self):
+        def run(job):
+            return 4 if job.label == 'a' else 0
+
+        jobs = self._jobs('@a fail', '@b after:a never')
+        self.assertEqual(4, batch.run_jobs(jobs, run, workers=2))
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from backbacker import command
+from backbacker import instrumentation
+
+
+class PythonCommand(command.SystemCommand):
+
+    def __init__(self, script, timeout=None):
+        super().__init__(sys.executable)
+        self.script = script
+        self.timeout = timeout
+
+    def _command_line(self):
+        return [self.cmd, '-c', self.script]
+
+
+class ListCommand(command.Command):
+
+    def __init__(self):
+        self.executed = False
+
+    def execute(self):
+        self.executed = True
+
+
+class ThreadedCommand(command.SystemCommand):
+
+    def __init__(self):
+        super().__init__(sys.executable)
+        self.executed = False
+
+    def _execute_command(self):
+        self.executed = True
+
+
+class CommandAsyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='commandTest')
+        self._pid_file = os.path.join(self._test_dir_tmp.name, 'pid')
+
+    def tearDown(self):
+        self._test_dir_tmp.cleanup()
+
+    def _sleep_script(self, seconds):
+        script = 'import os, time\nopen({!r}, "w").write(str(os.getpid()))\ntime.sleep({})'
+        return script.format(self._pid_file, seconds)
+
+    def _assert_reaped(self):
+        with open(self._pid_file) as file:
+            pid = int(file.read())
+        with self.assertRaises(ProcessLookupError):
+            os.kill(pid, 0)
+
+    def test_execute_async(self):
+        instrumentation.collector.clear()
+        script = 'import sys\nprint("out 1")\nprint("out 2")\nprint("err", file=sys.stderr)'
+        result = asyncio.run(PythonCommand(script).execute_async())
+        self.assertEqual(0, result.returncode)
+        self.assertEqual(b'out 1\nout 2\n', result.stdout)
+        self.assertEqual(b'err\n', result.stderr)
+        self.assertEqual(['PythonCommand'], [record.command for record in instrumentation.collector.records()])
+
+    def test_execute_async_without_command_line(self):
+        instrumentation.collector.clear()
+        cmd = ThreadedCommand()
+        self.assertIsNone(asyncio.run(cmd.execute_async()))
+        self.assertTrue(cmd.executed)
+        self.assertEqual(['ThreadedCommand'], [record.command for record in instrumentation.collector.records()])
+
+    def test_execute_sync(self):
+        PythonCommand('pass').execute()
+        with self.assertRaises(subprocess.CalledProcessError):
+            PythonCommand('import sys; sys.exit(2)').execute()
+
+    def test_failure(self):
+        script = 'import sys\nprint("broken", file=sys.stderr)\nsys.exit(3)'
+        with self.assertRaises(subprocess.CalledProcessError) as ctx:
+            asyncio.run(PythonCommand(script).execute_async())
+        self.assertEqual(3, ctx.exception.returncode)
+        self.assertEqual(b'broken\n', ctx.exception.stderr)
+
+    def test_timeout(self):
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            asyncio.run(PythonCommand(self._sleep_script(30), timeout=1).execute_async())
+        self.assertLess(time.monotonic() - start, 10)
+        self._assert_reaped()
+
+    def test_cancel(self):
+        async def cancel():
+            task = asyncio.ensure_future(PythonCommand(self._sleep_script(30)).execute_async())
+            while not os.path.exists(self._pid_file):
+                await asyncio.sleep(0.05)
+            task.cancel()
+            await task
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(cancel())
+        self._assert_reaped()
+
+    def test_on_line(self):
+        lines = list()
+        script = 'import sys\nsys.stdout.write("a\\nb")\nsys.stderr.write("c\\r\\n")'
+        asyncio.run(command.run_process([sys.executable, '-c', script],
+                                        on_line=lambda name, line: lines.append((name, line))))
+        self.assertEqual([('stderr', 'c'), ('stdout', 'a'), ('stdout', 'b')], sorted(lines))
+
+    def test_execute_concurrently(self):
+        commands = [PythonCommand('import time; time.sleep(1)') for _ in range(3)]
+        commands.append(PythonCommand('import sys; sys.exit(1)'))
+        commands.append(ListCommand())
+
+        start = time.monotonic()
+        results = asyncio.run(command.execute_concurrently(commands, limit=5))
+        self.assertLess(time.monotonic() - start, 2.5)
+        self.assertTrue(all(result.returncode == 0 for result in results[:3]))
+        self.assertIsInstance(results[3], subprocess.CalledProcessError)
+        self.assertIsNone(results[4])
+        self.assertTrue(commands[4].executed)
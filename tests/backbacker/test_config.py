@@ -21,3 +21,5 @@ class ConfigTestCase(unittest.TestCase):
         cfg = backbacker.config.Config.read_config(os.path.join(os.path.dirname(__file__), 'fixtures', 'config.ini'))
         self.assertEqual(cfg.log.file, '/tmp/backbacker.log')
         self.assertEqual(cfg.log.type, 'console')
+        self.assertEqual(cfg.tools.cache_file, '/tmp/backbacker_tools.json')
+        self.assertEqual(cfg.tools.cache_ttl, 60)
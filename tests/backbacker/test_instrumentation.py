@@ -0,0 +1,102 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from backbacker import command
+from backbacker import instrumentation
+
+
+class WriteCommand(command.Command):
+
+    def __init__(self, dst_dir, size=100):
+        self.dst_dir = dst_dir
+        self.size = size
+
+    def execute(self):
+        with open(os.path.join(self.dst_dir, 'out.bin'), 'wb') as file:
+            file.write(b'x' * self.size)
+        subprocess.check_call([sys.executable, '-c', 'pass'])
+
+
+class DerivedCommand(WriteCommand):
+
+    def execute(self):
+        super().execute()
+
+
+class FailingCommand(command.Command):
+
+    def execute(self):
+        raise RuntimeError('failed')
+
+
+class NestedCommand(command.Command):
+
+    def __init__(self, children):
+        self.children = children
+
+    def execute(self):
+        for child in self.children:
+            child.execute()
+
+
+class InstrumentationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dst_dir_tmp = tempfile.TemporaryDirectory(prefix='instrumentationTest')
+        self._dst_dir = self._dst_dir_tmp.name
+        instrumentation.collector.clear()
+
+    def tearDown(self):
+        self._dst_dir_tmp.cleanup()
+
+    def test_measure(self):
+        with instrumentation.job('backup'), instrumentation.output_measured():
+            WriteCommand(self._dst_dir, 1000).execute()
+
+        records = instrumentation.collector.records()
+        self.assertEqual(1, len(records))
+        self.assertEqual('WriteCommand', records[0].command)
+        self.assertEqual('backup', records[0].job)
+        self.assertEqual(1000, records[0].bytes_written)
+        self.assertGreater(records[0].seconds, 0.0)
+        self.assertIsNone(records[0].error)
+
+    def test_output_not_measured(self):
+        WriteCommand(self._dst_dir, 1000).execute()
+        self.assertIsNone(instrumentation.collector.records()[0].bytes_written)
+
+        with instrumentation.output_measured():
+            NestedCommand([WriteCommand(self._dst_dir, 1000)]).execute()
+        nested, top_level = instrumentation.collector.records()[1:]
+        self.assertIsNone(nested.bytes_written)
+        self.assertIsNone(top_level.bytes_written)  # NestedCommand has no dst_dir
+        self.assertFalse(instrumentation.collector.measure_output)
+
+    def test_super_execute_measured_once(self):
+        DerivedCommand(self._dst_dir).execute()
+        self.assertEqual(['DerivedCommand'], [record.command for record in instrumentation.collector.records()])
+
+    def test_nested(self):
+        NestedCommand([WriteCommand(self._dst_dir), WriteCommand(self._dst_dir)]).execute()
+        records = instrumentation.collector.records()
+        self.assertEqual([1, 1, 0], [record.depth for record in records])
+        self.assertEqual('NestedCommand', records[-1].command)
+
+    def test_error(self):
+        with self.assertRaises(RuntimeError):
+            FailingCommand().execute()
+        self.assertEqual('failed', instrumentation.collector.records()[0].error)
+
+    def test_write_report(self):
+        WriteCommand(self._dst_dir).execute()
+        fname = os.path.join(self._dst_dir, 'report.json')
+        instrumentation.collector.write_report(fname, rc=0)
+
+        with open(fname, 'r') as file:
+            report = json.load(file)
+        self.assertEqual(0, report['rc'])
+        self.assertEqual('WriteCommand', report['commands'][0]['command'])
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+from backbacker import prometheus
+from backbacker.backbacker import create_parser
+
+
+class PrometheusTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._test_dir_tmp = tempfile.TemporaryDirectory(prefix='prometheusTest')
+        self._prom_file = os.path.join(self._test_dir_tmp.name, 'backbacker.prom')
+
+    def tearDown(self):
+        self._test_dir_tmp.cleanup()
+
+    def _read(self):
+        with open(self._prom_file, 'r') as file:
+            return file.read()
+
+    def test_write_textfile(self):
+        results = [prometheus.Result('dump', 'pgsqldump', 1.5, 0, 1024, finished=1000.0),
+                   prometheus.Result('line "2"', 'rsync', 2.0, 1)]
+        prometheus.write_textfile(self._prom_file, results)
+
+        content = self._read()
+        self.assertIn('# TYPE backbacker_command_duration_seconds gauge', content)
+        self.assertIn('backbacker_command_duration_seconds{name="dump",command="pgsqldump"} 1.5', content)
+        self.assertIn('backbacker_command_exit_status{name="line \\"2\\"",command="rsync"} 1', content)
+        self.assertIn('backbacker_command_last_success_timestamp_seconds{name="dump",command="pgsqldump"} 1000.0',
+                      content)
+        self.assertIn('backbacker_command_output_bytes{name="dump",command="pgsqldump"} 1024', content)
+        self.assertNotIn('output_bytes{name="line', content)
+        self.assertEqual(['backbacker.prom'], os.listdir(self._test_dir_tmp.name))
+
+    def test_last_success_carried_forward(self):
+        prometheus.write_textfile(self._prom_file, [prometheus.Result('dump', 'pgsqldump', 1.0, 0, finished=1000.0)])
+        prometheus.write_textfile(self._prom_file, [prometheus.Result('dump', 'pgsqldump', 1.0, 2, finished=2000.0)])
+
+        content = self._read()
+        self.assertIn('backbacker_command_exit_status{name="dump",command="pgsqldump"} 2', content)
+        self.assertIn('backbacker_command_last_success_timestamp_seconds{name="dump",command="pgsqldump"} 1000.0',
+                      content)
+
+    def test_cli_command(self):
+        parser = create_parser('test')
+        args = parser.parse_args(['example', '--name', 'foo', '--prom_file', self._prom_file])
+        self.assertEqual(0, args.func(args))
+        self.assertIn('backbacker_command_exit_status{name="example",command="example"} 0', self._read())
+
+    def _batch(self, content, prom_file):
+        batch_file = os.path.join(self._test_dir_tmp.name, 'batch.bb')
+        with open(batch_file, 'w') as file:
+            file.write(content)
+        parser = create_parser('test')
+        args = parser.parse_args(['batch', '--ignore_errors', '--prom_file', prom_file, batch_file])
+        return args.func(args)
+
+    def test_batch_skipped(self):
+        prometheus.write_textfile(self._prom_file, [prometheus.Result('b', 'example', 1.0, 0, finished=1000.0)])
+        missing = os.path.join(self._test_dir_tmp.name, 'missing')
+        content = '@a git_bundle --src_dir {} --dst_dir {}\n@b after:a example --name foo\n'.format(
+            missing, self._test_dir_tmp.name)
+        self.assertEqual(2, self._batch(content, self._prom_file))
+
+        content = self._read()
+        self.assertIn('backbacker_command_exit_status{name="a",command="git_bundle"} 1', content)
+        self.assertIn('backbacker_command_exit_status{name="b",command="example"} -1', content)
+        self.assertIn('backbacker_command_last_success_timestamp_seconds{name="b",command="example"} 1000.0',
+                      content)
+        self.assertNotIn('duration_seconds{name="b"', content)
+
+    def test_batch_textfile_error(self):
+        prom_file = os.path.join(self._test_dir_tmp.name, 'missing', 'backbacker.prom')
+        self.assertEqual(0, self._batch('example --name foo\n', prom_file))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the compressors on a sample tree.
+
+Archives the tree with the compress command for each compressor and level, then extracts the archive.
+By default a tree of text-like files and incompressible files is generated, --src_dir benchmarks a real tree,
+e.g. a folder of database dumps. Compressors, which are not installed, are skipped.
+
+Usage: python3 tools/benchmark_codecs.py --codecs gzip zstd xz --levels 1 3 9 --threads 4
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from backbacker.commands import compress  # noqa: E402 pylint: disable=wrong-import-position
+
+__author__ = 'Christof Pieloth'
+
+WORDS = ['INSERT', 'INTO', 'VALUES', 'backup', 'table', 'user', 'NULL', '2024-01-01', 'foo', 'bar', 'baz']
+
+
+def create_tree(root, files, size, random_share=0.1):
+    rng = random.Random(42)
+    os.makedirs(root)
+    for i in range(files):
+        fname = os.path.join(root, 'f{:05d}'.format(i))
+        with open(fname, 'wb') as file:
+            if rng.random() < random_share:
+                file.write(os.urandom(size))
+            else:
+                text = ' '.join(rng.choice(WORDS) for _ in range(size // 5))
+                file.write(text.encode()[:size])
+
+
+def tree_size(root):
+    return sum(os.path.getsize(os.path.join(path, fname)) for path, _, fnames in os.walk(root) for fname in fnames)
+
+
+def run(compressor, src_dir, tmp_dir):
+    dst_dir = os.path.join(tmp_dir, 'dst')
+    extract_dir = os.path.join(tmp_dir, 'extract')
+    os.mkdir(dst_dir)
+    try:
+        instance = compress.GZip()
+        instance.src_dir = src_dir
+        instance.dst_dir = dst_dir
+        instance.compressor = compressor
+        start = time.monotonic()
+        instance.execute()
+        compress_time = time.monotonic() - start
+        size = os.path.getsize(instance.dst_file)
+
+        start = time.monotonic()
+        compress.extract_archive(instance.dst_file, extract_dir)
+        extract_time = time.monotonic() - start
+        return size, compress_time, extract_time
+    finally:
+        shutil.rmtree(dst_dir)
+        shutil.rmtree(extract_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the compressors.')
+    parser.add_argument('--src_dir', help='Tree to compress, default is a generated tree.')
+    parser.add_argument('--files', type=int, default=200, help='Number of generated files.')
+    parser.add_argument('--size', type=int, default=512 * 1024, help='Size of a generated file in bytes.')
+    parser.add_argument('--codecs', nargs='+', default=list(compress.CODECS), choices=compress.COMPRESSORS,
+                        help='Compressors to benchmark.')
+    parser.add_argument('--levels', type=int, nargs='*', default=[],
+                        help='Compression levels, default is the default level of each compressor.')
+    parser.add_argument('--threads', type=int, default=1, help='Number of compression threads.')
+    args = parser.parse_args()
+
+    candidates = list()
+    for codec in args.codecs:
+        for level in args.levels if args.levels and codec != 'none' else [None]:
+            try:
+                compressor = compress.create_compressor(codec, args.threads, level)
+            except ValueError as ex:
+                print('Skipping: {}'.format(ex))
+                continue
+            if not compressor.is_available():
+                print('{} is not available, skipping it.'.format(codec))
+                continue
+            name = codec if compressor.level is None else '{} level={}'.format(codec, compressor.level)
+            candidates.append((name, compressor))
+
+    with tempfile.TemporaryDirectory(prefix='benchmarkCodecs') as tmp_dir:
+        src_dir = args.src_dir
+        if not src_dir:
+            src_dir = os.path.join(tmp_dir, 'src')
+            create_tree(src_dir, args.files, args.size)
+        total = tree_size(src_dir)
+        print('{} bytes, {} threads'.format(total, args.threads))
+        print('{:<20} {:>14} {:>8} {:>14} {:>14} {:>12}'.format(
+            'compressor', 'size [bytes]', 'ratio', 'compress [s]', 'MiB/s', 'extract [s]'))
+        for name, compressor in candidates:
+            size, compress_time, extract_time = run(compressor, src_dir, tmp_dir)
+            print('{:<20} {:>14} {:>8.3f} {:>14.2f} {:>14.1f} {:>12.2f}'.format(
+                name, size, size / total if total else 0.0, compress_time,
+                total / compress_time / 1024 / 1024 if compress_time > 0 else 0.0, extract_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the file sync commands on a generated tree of small files.
+
+Measures an initial sync into an empty directory and a no-op sync of an identical tree,
+for pysync with different numbers of workers and for rsync, if it is installed.
+
+Usage: python3 tools/benchmark_file_sync.py --files 20000 --size 4096
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from backbacker.commands import file_sync  # noqa: E402 pylint: disable=wrong-import-position
+
+__author__ = 'Christof Pieloth'
+
+
+def create_tree(root, files, size, files_per_dir=100):
+    data = os.urandom(size)
+    for i in range(files):
+        dname = os.path.join(root, 'd{:05d}'.format(i // files_per_dir))
+        if i % files_per_dir == 0:
+            os.makedirs(dname)
+        with open(os.path.join(dname, 'f{:07d}.bin'.format(i)), 'wb') as file:
+            file.write(data)
+
+
+def run(instance, src_dir, dst_dir):
+    instance.src_dir = os.path.join(src_dir, '')
+    instance.dst_dir = dst_dir
+    instance.mirror = True
+    start = time.monotonic()
+    instance.execute()
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the file sync commands.')
+    parser.add_argument('--files', type=int, default=20000, help='Number of files.')
+    parser.add_argument('--size', type=int, default=4096, help='Size of a file in bytes.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16], help='Workers of pysync.')
+    args = parser.parse_args()
+
+    candidates = list()
+    for workers in args.workers:
+        instance = file_sync.PySync()
+        instance.workers = workers
+        candidates.append(('pysync workers={}'.format(workers), instance))
+    rsync = file_sync.Rsync()
+    if rsync.is_available():
+        candidates.append(('rsync', rsync))
+    else:
+        print('rsync is not available, skipping it.')
+
+    with tempfile.TemporaryDirectory(prefix='benchmarkFileSync') as tmp_dir:
+        src_dir = os.path.join(tmp_dir, 'src')
+        create_tree(src_dir, args.files, args.size)
+        print('{} files of {} bytes'.format(args.files, args.size))
+        print('{:<24} {:>12} {:>12}'.format('command', 'initial [s]', 'no-op [s]'))
+        for name, instance in candidates:
+            dst_dir = os.path.join(tmp_dir, 'dst')
+            os.mkdir(dst_dir)
+            initial = run(instance, src_dir, dst_dir)
+            noop = run(instance, src_dir, dst_dir)
+            shutil.rmtree(dst_dir)
+            print('{:<24} {:>12.2f} {:>12.2f}'.format(name, initial, noop))
+
+
+if __name__ == '__main__':
+    main()